@@ -5,13 +5,14 @@ Rectangle {
   anchors.fill: parent
 
   function updateAllAccounts(){
-    controller.updateAccount(messageBox, null)
+    controller.updateAccount(null)
   }
 
+  // account data is refreshed by the cache watcher, this only keeps LastUpdatedRel current
   Timer {
     id: labelRefreshTimer
-    interval: 10 * 1000
-    running: true
+    interval: 60 * 1000
+    running: accountView.visible
     repeat: true
 
     onTriggered: {
@@ -49,10 +50,20 @@ Rectangle {
           anchors.bottom: parent.bottom
           color: model.account.IsLoading ? "#FF0000" : "#666666"
 
+          Text {
+            anchors.fill: parent
+            anchors.margins: 2
+            text: model.account.IsLoading ? model.account.Progress : ""
+            elide: Text.ElideRight
+            horizontalAlignment: Text.AlignHCenter
+            verticalAlignment: Text.AlignVCenter
+            font.pointSize: scaling.fontSmall
+          }
+
           MouseArea {
             anchors.fill: parent
             onClicked: {
-              controller.updateAccount(messageBox, model.account)
+              controller.updateAccount(model.account)
             }
           }
         }
@@ -70,10 +81,11 @@ Rectangle {
               console.log("skipping update, account view is not visible")
             }else{
               console.log("updating account " + model.account.Name)
-              controller.updateAccount(messageBox, model.account)
+              controller.updateAccount(model.account)
             }
           }
         }
+        // the cache watcher refreshes on changes, this catches any it misses
         Timer {
           id: refreshTimer
           interval: model.account.RefreshInterval * 1000
@@ -127,27 +139,15 @@ Rectangle {
     height: parent.height * 0.30
     clip: true
 
-    function getText() {
-      return messageBoxTextArea.text
-    }
-    function setText(text) {
-       messageBoxTextArea.text = text
-    }
-    function scrollToBottom() {
-      messageBoxFlickable.contentY = messageBoxTextArea.height - messageBoxFlickable.height
-    }
-
-    Flickable {
-      id: messageBoxFlickable
+    ListView {
+      id: messageBoxListView
       anchors.fill: parent
-      contentWidth: messageBoxTextArea.paintedWidth
-      contentHeight: messageBoxTextArea.paintedHeight
+      model: logModel
       flickableDirection: Flickable.HorizontalAndVerticalFlick
       boundsBehavior: Flickable.DragOverBounds
-      Text {
-        anchors.fill: parent
-        id: messageBoxTextArea
-        text: "CONSOLE OUTPUT\n"
+      onCountChanged: positionViewAtEnd()
+      delegate: Text {
+        text: model.line
       }
     }
   }
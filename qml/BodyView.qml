@@ -9,8 +9,22 @@ Rectangle {
   }
   function setBody(body){
     setZoom(1.0)
+    remainingBodySize = 0
+    bodyText.textFormat = TextEdit.AutoText
     bodyText.text = body
   }
+  function setChunkedBody(body, isRichText){
+    setZoom(1.0)
+    remainingBodySize = 0
+    bodyText.textFormat = isRichText ? TextEdit.RichText : TextEdit.PlainText
+    bodyText.text = body
+  }
+  function appendBody(body){
+    bodyText.append(body)
+  }
+  function setRemainingBodySize(size){
+    remainingBodySize = size
+  }
   function setSelectable(isSelectable){
     selectable = isSelectable
   }
@@ -19,6 +33,7 @@ Rectangle {
   }
 
   property bool selectable: false
+  property int remainingBodySize: 0
   property variant scales: [0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0, 10.0]
   property real curScale: 1.0
   property real minScale: 0.1
@@ -98,6 +113,7 @@ Rectangle {
     width: parent.width - 30
     contentWidth: parent.width - 30
     contentHeight: headerText.paintedHeight + bodyText.paintedHeight
+      + (loadRestButton.visible ? loadRestButton.height : 0)
     anchors.fill: parent
     flickableDirection: Flickable.HorizontalAndVerticalFlick
     boundsBehavior: Flickable.DragOverBounds
@@ -162,6 +178,25 @@ Rectangle {
           }
         }
       }
+      Rectangle {
+        id: loadRestButton
+        visible: bodyView.remainingBodySize > 0
+        y: headerText.paintedHeight + bodyText.paintedHeight
+        width: parent.width
+        height: loadRestText.paintedHeight * 2
+        color: "#AAAAAA"
+        Text {
+          id: loadRestText
+          anchors.centerIn: parent
+          text: "load rest of message ("
+            + Math.ceil(bodyView.remainingBodySize / 1024) + "KiB)"
+          font.pointSize: scaling.fontLarge
+        }
+        MouseArea {
+          anchors.fill: parent
+          onClicked: controller.loadRestOfBody()
+        }
+      }
     }
   }
 
@@ -39,7 +39,13 @@ Rectangle {
     onEnterPressed: {
       add.clicked()
     }
+    onValueChanged: {
+      //the controller already filters and ranks the address book
+      controller.updateAddressSuggestions(value)
+      refreshSuggestions()
+    }
     suggModel: addressBookModel
+    filterEnabled: false
   }
 
   Btn {
@@ -70,18 +70,25 @@ Rectangle {
 
     Timer {
       id: updateFileListTimer
-      interval: 750;
+      interval: 150;
       onTriggered: {
         suggBox.updateFileList()
       }
     }
 
     function updateFileList() {
-      if(controller.updateFileList(suggBox.text)){
+      controller.updateFileList(suggBox.text)
+    }
+
+    //the controller filters the listing and appends matches in batches
+    Connections {
+      target: fileListModel
+      function onChanged(){
         suggBox.resetFilter()
       }
     }
 
     suggModel: fileListModel
+    filterEnabled: false
   }
 }
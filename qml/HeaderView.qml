@@ -127,6 +127,27 @@ Rectangle {
 
     property bool isWideView: width >= main.headerWideViewMinPx
 
+    onContentYChanged: setViewRange()
+    onHeightChanged: setViewRange()
+    onCountChanged: setViewRange()
+    function setViewRange(){
+      var first = indexAt(0, contentY)
+      if(first < 0){
+        first = indexAt(0, contentY + spacing)
+      }
+      var last = indexAt(0, contentY + height - 1)
+      if(last < 0){
+        last = indexAt(0, contentY + height - 1 - spacing)
+      }
+      if(first < 0 || last < 0){
+        headerModel.setViewRange(0, count - 1)
+        return
+      }
+      //delegates up to cacheBuffer px past either edge are kept too
+      var bufferRows = Math.ceil(cacheBuffer * (last - first + 1) / Math.max(1, height))
+      headerModel.setViewRange(first - bufferRows, last + bufferRows)
+    }
+
     Keys.onPressed:{
       if (event.key == Qt.Key_Up){
         decrementCurrentIndex()
@@ -0,0 +1,106 @@
+import QtQuick 2.3
+
+Rectangle {
+  anchors.fill: parent
+
+  Rectangle {
+    id: searchBox
+    anchors.top: parent.top
+    anchors.left: parent.left
+    anchors.right: parent.right
+    width: parent.width
+    height: searchTextBox.height
+    border.width: 2
+    z: 10
+
+    TextInput {
+      anchors.margins: 2
+      id: searchTextBox
+      width: parent.width
+      height: font.pointSize * 2
+      font.pointSize: scaling.fontMedium
+      Keys.onReturnPressed: {
+        controller.globalSearch(searchTextBox.text)
+      }
+    }
+  }
+
+  ListView {
+    id: sourceList
+    anchors.top: searchBox.bottom
+    anchors.left: parent.left
+    anchors.right: parent.right
+    anchors.topMargin: 5
+    height: scaling.fontTiny * 2.5
+    orientation: ListView.Horizontal
+    spacing: 15
+    clip: true
+    model: searchSourceModel
+    delegate: Text {
+      text: model.source.Name + ": " + getCountText()
+      color: model.source.ErrorMsg != "" ? "red" : "black"
+      font.pointSize: scaling.fontTiny
+      function getCountText(){
+        if(model.source.ErrorMsg != ""){
+          return "ERROR"
+        }else if(!model.source.IsFinished){
+          return "..."
+        }else{
+          return model.source.Count
+        }
+      }
+    }
+  }
+
+  ListView {
+    id: resultFlickable
+    model: searchResultModel
+    spacing: 10
+    anchors.top: sourceList.bottom
+    anchors.bottom: parent.bottom
+    anchors.left: parent.left
+    anchors.right: parent.right
+    anchors.topMargin: 5
+    clip: true
+
+    delegate: Rectangle {
+      color: "#AAAAAA"
+      height: resultView.height
+      width: parent ? parent.width : 0
+
+      MouseArea {
+        anchors.fill: parent
+        onClicked: {
+          controller.globalSearchResultSelected(model.result)
+          navToPage(headerPage)
+          navToPage(bodyPage)
+        }
+      }
+      Column {
+        id: resultView
+        width: parent.width
+        height: resultSourceLabel.paintedHeight + resultAddressLabel.paintedHeight + resultSubjectLabel.paintedHeight
+        Text {
+          id: resultSourceLabel
+          text: model.result.Date + "  " + model.result.Account + "/" + model.result.Folder
+          font.pointSize: scaling.fontSmall
+        }
+        Text {
+          id: resultAddressLabel
+          text: model.result.From
+          font.pointSize: scaling.fontMedium
+        }
+        Text {
+          id: resultSubjectLabel
+          text: model.result.Subject
+          font.pointSize: scaling.fontSmall
+        }
+      }
+    }
+  }
+
+  ScrollBar{
+    flickable: resultFlickable
+    anchors.rightMargin: 0 - 30
+  }
+}
@@ -9,6 +9,7 @@ Rectangle {
 
   property alias suggModel: edit.suggModel
   property alias popupHeight: edit.popupHeight
+  property alias filterEnabled: edit.filterEnabled
 
   property alias labelText: label.text
   property alias value: edit.text
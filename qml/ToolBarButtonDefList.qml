@@ -4,7 +4,7 @@ QtObject {
   // order is determined by 'buttonDefs', not 'pages'
   property variant pages: {
     "accountPage": {
-      "buttons": ["newAccount", "options", "update"],
+      "buttons": ["newAccount", "options", "update", "search"],
       "buttonsExtra": [],
     },
     "folderPage": {
@@ -12,8 +12,8 @@ QtObject {
       "buttonsExtra": [],
     },
     "headerPage": {
-      "buttons": ["back", "more", "markAllRead", "hideKb", "showExtra"],
-      "buttonsExtra": ["config", "send", "wayMore", "all", "folder"],
+      "buttons": ["back", "markAllRead", "hideKb", "showExtra"],
+      "buttonsExtra": ["config", "send", "folder", "search"],
     },
     "bodyPage": {
       "buttons": ["back", "toggleHtml", "toggleSelectable", "copy", "showExtra"],
@@ -27,6 +27,10 @@ QtObject {
       "buttons": ["back", "hideKb", "sendEmail"],
       "buttonsExtra": [],
     },
+    "searchPage": {
+      "buttons": ["back", "hideKb"],
+      "buttonsExtra": [],
+    },
   }
 
   function getButtonDefs(){
@@ -108,30 +112,6 @@ QtObject {
         }
       }
     },
-    ToolBarButtonDef {
-      name: "more"
-      text: "more"
-      onClicked: {
-        controller.moreHeaders(0)
-        controller.updateCounterBox(headerView.getCounterBox())
-      }
-    },
-    ToolBarButtonDef {
-      name: "wayMore"
-      text: "+30%"
-      onClicked: {
-        controller.moreHeaders(30)
-        controller.updateCounterBox(headerView.getCounterBox())
-      }
-    },
-    ToolBarButtonDef {
-      name: "all"
-      text: "all"
-      onClicked: {
-        controller.moreHeaders(100)
-        controller.updateCounterBox(headerView.getCounterBox())
-      }
-    },
     ToolBarButtonDef {
       name: "markAllRead"
       text: "all=>read"
@@ -144,6 +124,11 @@ QtObject {
       text: "folders"
       onClicked: navToPage(folderPage)
     },
+    ToolBarButtonDef {
+      name: "search"
+      text: "search all"
+      onClicked: navToPage(searchPage)
+    },
     ToolBarButtonDef {
       name: "toggleHtml"
       text: getButtonText(controller.HtmlMode)
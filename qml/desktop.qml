@@ -27,9 +27,10 @@ Rectangle {
     navToPage(controller.findChild(main, pageName + "Page"))
   }
   function navToPage(page){
-    setIsMain(page != configPage)
+    setIsMain(page != configPage && page != searchPage)
 
     configPage.visible = page == configPage
+    searchPage.visible = page == searchPage
     bodyView.visible = page == bodyPage
 
     if(page == accountPage){
@@ -46,6 +47,7 @@ Rectangle {
       controller.setupConfig()
     }else if(page == sendPage){
       controller.showSendWindow()
+    }else if(page == searchPage){
     }
 
     initToolBarTimer.restart()
@@ -72,6 +74,7 @@ Rectangle {
 
     if(isMain){
       configPage.visible = false
+      searchPage.visible = false
     }
 
     leftColumn.visible = isMain
@@ -83,7 +86,7 @@ Rectangle {
   }
   function initToolBar(){
     var activePageNames = []
-    var allPages = [accountPage, headerPage, folderPage, bodyPage, configPage, sendPage]
+    var allPages = [accountPage, headerPage, folderPage, bodyPage, configPage, sendPage, searchPage]
     for (var pageIndex = 0; pageIndex < allPages.length; ++pageIndex){
       var p = allPages[pageIndex]
       if(p.visible){
@@ -194,6 +197,17 @@ Rectangle {
 
       ConfigView{ id: configView }
     }
+
+    // SEARCH PAGE
+    Rectangle {
+      id: searchPage
+      objectName: "searchPage"
+      anchors.fill: parent
+      visible: false
+      anchors.margins: 30
+
+      SearchView{ id: searchView }
+    }
   }
 
   ToolBarButtonDefList {
@@ -34,6 +34,8 @@ Rectangle {
       navToPage(accountPage);
     }else if(sendPage.visible){
       navToPage(headerPage);
+    }else if(searchPage.visible){
+      navToPage(accountPage);
     }
   }
 
@@ -52,6 +54,7 @@ Rectangle {
     bodyPage.visible = false
     configPage.visible = false
     sendPage.visible = false
+    searchPage.visible = false
 
     page.visible = true
     curPage = page
@@ -70,6 +73,7 @@ Rectangle {
     }else if(curPage == configPage){
       controller.setupConfig()
     }else if(curPage == sendPage){
+    }else if(curPage == searchPage){
     }
   }
 
@@ -209,6 +213,17 @@ Rectangle {
 
       SendView{ id: sendView }
     }
+
+    // SEARCH PAGE
+    Rectangle {
+      id: searchPage
+      objectName: "searchPage"
+      anchors.fill: parent
+      visible: false
+      anchors.margins: 30
+
+      SearchView{ id: searchView }
+    }
   }
 
   // HACK TO HIDE KEYBOARD
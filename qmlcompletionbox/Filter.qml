@@ -5,6 +5,7 @@ Item {
     property alias model: filterModel
 
     property bool prefixOnly: true
+    property bool filterEnabled: true
     property QtObject sourceModel: undefined
     property string filter: ""
     property string property: ""
@@ -53,6 +54,9 @@ Item {
         if (item[this.property] === undefined)
             return false
 
+        if (!filterEnabled)
+            return true
+
         var suggFilter = this.filter
         if(prefixOnly){
           suggFilter = "^" + suggFilter
@@ -6,6 +6,7 @@ Rectangle {
 
     property variant suggModel
     property bool showPreview: false
+    property bool filterEnabled: true
     property int popupHeight: contents.height - inputField.height
 
     signal enterPressed
@@ -77,6 +78,7 @@ Rectangle {
             anchors.left: inputField.left
             filter: inputField.textInput.text
             property: "name"
+            filterEnabled: suggBox.filterEnabled
             onItemSelected: complete(item)
 
             function complete(item) {
@@ -30,6 +30,7 @@ Rectangle {
     property alias suggestionsModel: filterItem.model
     property alias filter: filterItem.filter
     property alias property: filterItem.property
+    property alias filterEnabled: filterItem.filterEnabled
     property int fontSize: 8
     signal itemSelected(variant item)
 
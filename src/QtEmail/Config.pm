@@ -76,6 +76,8 @@ my $accountConfigSchema = [
 ];
 my $optionsConfigSchema = [
   ["update_cmd",        "OPT", "command to run after all updates"],
+  ["update_parallel",   "OPT", "GUI: max accounts to update at once (default=3)"],
+  ["body_render_limit", "OPT", "GUI: chars of a body to show before 'load rest' (default=262144)"],
   ["encrypt_cmd",       "OPT", "command to encrypt passwords on disk"],
   ["decrypt_cmd",       "OPT", "command to decrypt saved passwords"],
   ["client_id",         "OPT", "google API client ID, stored with optional encrypt_cmd"],
@@ -2,6 +2,7 @@ package QtEmail::Email;
 use strict;
 use warnings;
 use Time::HiRes qw(time);
+use Fcntl qw(:flock);
 use lib "/opt/qtemail/lib";
 
 use QtEmail::Shared qw(GET_GVAR);
@@ -102,6 +103,8 @@ sub formatStatusShort($@);
 sub padtrim($$);
 sub readGlobalUnreadCountsFile();
 sub updateGlobalUnreadCountsFile($);
+sub lockStatusFiles();
+sub writeFileAtomic($$);
 sub relTime($);
 sub clearError($);
 sub hasError($);
@@ -389,18 +392,12 @@ sub cmdReadConfigOptionsSchema($){
 
 sub writeStatusFiles(@){
   my @accNames = @_;
+  my $lockFh = lockStatusFiles();
   my $counts = readGlobalUnreadCountsFile();
 
-  my $fmt;
-  $fmt = formatStatusLine $counts, @accNames;
-  open FH, "> $$GVAR{STATUS_LINE_FILE}" or die "Could not write $$GVAR{STATUS_LINE_FILE}\n";
-  print FH $fmt;
-  close FH;
-
-  $fmt = formatStatusShort $counts, @accNames;
-  open FH, "> $$GVAR{STATUS_SHORT_FILE}" or die "Could not write $$GVAR{STATUS_SHORT_FILE}\n";
-  print FH $fmt;
-  close FH;
+  writeFileAtomic $$GVAR{STATUS_LINE_FILE}, formatStatusLine($counts, @accNames);
+  writeFileAtomic $$GVAR{STATUS_SHORT_FILE}, formatStatusShort($counts, @accNames);
+  close $lockFh;
 }
 sub formatStatusLine($@){
   my ($counts, @accNames) = @_;
@@ -489,11 +486,27 @@ sub updateGlobalUnreadCountsFile($){
     }
   }
 
-  open FH, "> $$GVAR{UNREAD_COUNTS_FILE}" or die "Could not write $$GVAR{UNREAD_COUNTS_FILE}\n";
-  for my $accName(@accOrder){
-    print FH "$counts{$accName}:$accName\n";
-  }
-  close FH;
+  my $lockFh = lockStatusFiles();
+  writeFileAtomic $$GVAR{UNREAD_COUNTS_FILE},
+    join "", map {"$counts{$_}:$_\n"} @accOrder;
+  close $lockFh;
+}
+
+#per-account updates run in parallel, so the global files are written under an flock
+#  and replaced by rename, readers without the lock never see a partial file
+sub lockStatusFiles(){
+  open my $lockFh, ">>", $$GVAR{STATUS_LOCK_FILE}
+    or die "Could not open $$GVAR{STATUS_LOCK_FILE}\n";
+  flock $lockFh, LOCK_EX or die "Could not lock $$GVAR{STATUS_LOCK_FILE}\n";
+  return $lockFh;
+}
+sub writeFileAtomic($$){
+  my ($file, $contents) = @_;
+  my $tmpFile = "$file.tmp.$$";
+  open my $fh, ">", $tmpFile or die "Could not write $file\n";
+  print $fh $contents;
+  close $fh or die "Could not write $file\n";
+  rename $tmpFile, $file or die "Could not write $file\n";
 }
 
 sub relTime($){
@@ -0,0 +1,212 @@
+package QtEmail::Server;
+use strict;
+use warnings;
+use lib "/opt/qtemail/lib";
+use IO::Select;
+use POSIX qw(WNOHANG);
+
+our @ISA = qw(Exporter);
+use Exporter;
+our @EXPORT = qw(
+  cmdServer
+);
+
+sub cmdServer($);
+sub preloadModules();
+sub startRequest($$);
+sub finishRequest($);
+sub reapRequests($);
+sub killAllRequests($);
+sub parseFrames($);
+sub writeFrame($$$);
+
+my @PRELOAD_MODULES = qw(
+  QtEmail::Email
+  QtEmail::Body
+  QtEmail::UpdatePrint
+  QtEmail::Smtp
+  Mail::IMAPClient
+  IO::Socket::SSL
+  MIME::Parser
+  Encode
+  Date::Parse
+  Date::Format
+);
+
+my $READ_SIZE = 65536;
+my $REAP_INTERVAL_SECONDS = 0.1;
+
+#frames, in both directions, are:  "<TYPE> <ID> <LENGTH>\n<PAYLOAD>"
+#  client => server
+#    REQ:  run email.pl with the args in PAYLOAD, each arg followed by a NUL
+#    KILL: send SIGTERM to the process group of request ID
+#  server => client
+#    READY: sent once at startup, after modules are loaded
+#    OUT:   stdout of request ID
+#    ERR:   stderr of request ID
+#    EXIT:  exit code of request ID, after all OUT/ERR frames
+#           sent once the process is reaped, which never blocks the loop
+sub cmdServer($){
+  my ($mainSub) = @_;
+  preloadModules();
+
+  binmode STDIN;
+  binmode STDOUT;
+
+  my $select = IO::Select->new();
+  $select->add(\*STDIN);
+
+  my $requests = {};
+  my $fhRequests = {};
+  my $inBuf = "";
+
+  writeFrame "READY", 0, "";
+
+  while(1){
+    my $isReaping = grep {$$_{openCount} == 0} values %$requests;
+    my $timeout = $isReaping ? $REAP_INTERVAL_SECONDS : undef;
+    for my $fh($select->can_read($timeout)){
+      if(fileno $fh == fileno STDIN){
+        my $len = sysread STDIN, $inBuf, $READ_SIZE, length $inBuf;
+        if(not defined $len or $len == 0){
+          killAllRequests $requests;
+          exit 0;
+        }
+        for my $frame(parseFrames \$inBuf){
+          my ($type, $id, $payload) = @$frame;
+          if($type eq "REQ"){
+            my @args = split /\0/, $payload, -1;
+            pop @args;
+            my $request = startRequest $mainSub, [@args];
+            $$request{id} = $id;
+            $$requests{$id} = $request;
+            for my $fh($$request{outFh}, $$request{errFh}){
+              $$fhRequests{fileno $fh} = $request;
+              $select->add($fh);
+            }
+          }elsif($type eq "KILL"){
+            if(defined $$requests{$id}){
+              kill 'TERM', -$$requests{$id}{pid};
+            }
+          }else{
+            die "ERROR: unknown frame type $type\n";
+          }
+        }
+      }else{
+        my $request = $$fhRequests{fileno $fh};
+        my $type = $fh == $$request{outFh} ? "OUT" : "ERR";
+        my $buf;
+        my $len = sysread $fh, $buf, $READ_SIZE;
+        if(defined $len and $len > 0){
+          writeFrame $type, $$request{id}, $buf;
+        }else{
+          $select->remove($fh);
+          delete $$fhRequests{fileno $fh};
+          close $fh;
+          $$request{openCount}--;
+        }
+      }
+    }
+    reapRequests $requests;
+  }
+}
+
+sub preloadModules(){
+  for my $module(@PRELOAD_MODULES){
+    my $file = $module;
+    $file =~ s/::/\//g;
+    eval { require "$file.pm" };
+  }
+}
+
+sub startRequest($$){
+  my ($mainSub, $args) = @_;
+  pipe my $outR, my $outW or die "ERROR: could not create pipe: $!\n";
+  pipe my $errR, my $errW or die "ERROR: could not create pipe: $!\n";
+
+  my $pid = fork;
+  die "ERROR: could not fork: $!\n" if not defined $pid;
+  if($pid == 0){
+    setpgrp 0, 0;
+    close $outR;
+    close $errR;
+    open STDIN, "<", "/dev/null";
+    open STDOUT, ">&", $outW or die "ERROR: could not redirect stdout\n";
+    open STDERR, ">&", $errW or die "ERROR: could not redirect stderr\n";
+    close $outW;
+    close $errW;
+    eval { &$mainSub(@$args) };
+    if($@){
+      print STDERR $@;
+      exit 255;
+    }
+    exit 0;
+  }
+
+  close $outW;
+  close $errW;
+  return {
+    pid => $pid,
+    outFh => $outR,
+    errFh => $errR,
+    openCount => 2,
+  };
+}
+
+#returns 1 if the process has exited and EXIT was sent, 0 if it is still running
+sub finishRequest($){
+  my ($request) = @_;
+  my $pid = waitpid $$request{pid}, WNOHANG;
+  return 0 if $pid == 0;
+  my $exitCode;
+  if(($? & 127) != 0){
+    $exitCode = 128 + ($? & 127);
+  }else{
+    $exitCode = $? >> 8;
+  }
+  writeFrame "EXIT", $$request{id}, $exitCode;
+  return 1;
+}
+
+sub reapRequests($){
+  my ($requests) = @_;
+  for my $id(keys %$requests){
+    my $request = $$requests{$id};
+    if($$request{openCount} == 0 and finishRequest $request){
+      delete $$requests{$id};
+    }
+  }
+}
+
+sub killAllRequests($){
+  my ($requests) = @_;
+  for my $request(values %$requests){
+    kill 'TERM', -$$request{pid};
+  }
+}
+
+sub parseFrames($){
+  my ($bufRef) = @_;
+  my @frames;
+  while($$bufRef =~ /^(\w+) (\d+) (\d+)\n/){
+    my ($type, $id, $len) = ($1, $2, $3);
+    my $headerLen = length "$type $id $len\n";
+    last if length $$bufRef < $headerLen + $len;
+    my $payload = substr $$bufRef, $headerLen, $len;
+    substr($$bufRef, 0, $headerLen + $len) = "";
+    push @frames, [$type, $id, $payload];
+  }
+  return @frames;
+}
+
+sub writeFrame($$$){
+  my ($type, $id, $payload) = @_;
+  my $frame = "$type $id " . length($payload) . "\n" . $payload;
+  while(length $frame > 0){
+    my $len = syswrite STDOUT, $frame;
+    die "ERROR: could not write to client: $!\n" if not defined $len;
+    substr($frame, 0, $len) = "";
+  }
+}
+
+1;
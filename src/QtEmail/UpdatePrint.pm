@@ -53,11 +53,13 @@ our @ISA = qw(Exporter);
 use Exporter;
 our @EXPORT = qw(
   cmdUpdate
+  cmdRunUpdateCmd
   cmdPrint
   cmdPrintUids
 );
 
-sub cmdUpdate($@);
+sub cmdUpdate($$@);
+sub cmdRunUpdateCmd();
 sub cmdPrint($@);
 sub cmdPrintUids($$$@);
 
@@ -68,8 +70,8 @@ sub cacheAllHeaders($$$);
 
 my $GVAR = QtEmail::Shared::GET_GVAR;
 
-sub cmdUpdate($@){
-  my ($folderNameFilter, @accNames) = @_;
+sub cmdUpdate($$@){
+  my ($folderNameFilter, $runUpdateCmd, @accNames) = @_;
   my $config = getConfig();
   my @accOrder = @{$$config{accOrder}};
   if(@accNames == 0){
@@ -162,11 +164,7 @@ sub cmdUpdate($@){
   }
   updateGlobalUnreadCountsFile($config);
   writeStatusFiles(@accOrder);
-  if(defined $$config{options}{update_cmd}){
-    my $cmd = $$config{options}{update_cmd};
-    print "running update_cmd: $cmd\n";
-    system "$cmd";
-  }
+  cmdRunUpdateCmd() if $runUpdateCmd;
   for my $cmd(@newUnreadCommands){
     print "running new_unread_cmd: $cmd\n";
     system $cmd;
@@ -175,6 +173,15 @@ sub cmdUpdate($@){
   return $success;
 }
 
+sub cmdRunUpdateCmd(){
+  my $config = getConfig();
+  if(defined $$config{options}{update_cmd}){
+    my $cmd = $$config{options}{update_cmd};
+    print "running update_cmd: $cmd\n";
+    system "$cmd";
+  }
+}
+
 sub cmdPrint($@){
   my ($folderName, @accNames) = @_;
   my $config = getConfig();
@@ -359,7 +366,7 @@ sub cacheAllHeaders($$$){
     }
   }
 
-  writeUidFile $accName, $folderName, "all", keys %okCachedHeaderUids;
+  writeUidFile $accName, $folderName, "all", sort {$a <=> $b} keys %okCachedHeaderUids;
 
   return ([@messages], undef);
 }
@@ -49,7 +49,7 @@ sub email(@){
 
   my @cmdArgs = qw(
     -h --help
-    --update --header --body --body-plain --body-html --attachments
+    --update --update-cmd --header --body --body-plain --body-html --attachments
     --cache-all-bodies
     --smtp
     --mark-read --mark-unread --delete --delete-local --move
@@ -91,6 +91,10 @@ sub email(@){
     @complete = (@complete, @folderOptExamples);
   }
 
+  if($cmdArg =~ /^(--update)$/ and @opts == 0 and @args == 0){
+    @complete = (@complete, "--no-update-cmd");
+  }
+
   if($cmdArg =~ /^(--body|--body-plain|body-html)$/ and @args == 0){
     if(@opts == 0){
       @complete = (@complete, "--no-download", "-0", @folderOptExamples);
@@ -196,7 +200,8 @@ sub getAccounts(@){
 }
 
 # -h|--help
-# --update [--folder=FOLDER_NAME_FILTER] [ACCOUNT_NAME ACCOUNT_NAME ...]
+# --update [--no-update-cmd] [--folder=FOLDER_NAME_FILTER] [ACCOUNT_NAME ACCOUNT_NAME ...]
+# --update-cmd
 # --smtp ACCOUNT_NAME SUBJECT BODY TO [ARG ARG ..]
 # --mark-read [--folder=FOLDER_NAME] ACCOUNT_NAME UID [UID UID ...]
 # --mark-unread [--folder=FOLDER_NAME] ACCOUNT_NAME UID [UID UID ...]
@@ -11,16 +11,29 @@ from PyQt5.QtCore import *
 from PyQt5.QtQuick import *
 from PyQt5.QtWidgets import *
 
+from collections import OrderedDict
+import bisect
+import datetime
+import email
+import email.header
+import email.utils
+import heapq
+import itertools
+import mmap
 import os
 import os.path
 import re
 import signal
+import sqlite3
+import struct
 import sys
 import subprocess
+import threading
 import time
 
 EMAIL_BIN = "/opt/qtemail/bin/email.pl"
 EMAIL_SEARCH_BIN = "/opt/qtemail/bin/email-search.pl"
+SQLITE_PCRE_LIB = "/usr/lib/sqlite3/pcre.so"
 QML_DIR = "/opt/qtemail/qml"
 
 PLATFORM_DESKTOP = "desktop"
@@ -30,19 +43,92 @@ PLATFORM_MOBILE_ISSUE_KEYWORDS = ["maemo", "mer", "sailfish"]
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-PAGE_INITIAL_SIZE = 600
-PAGE_INITIAL_WITHOUT_UNREAD_SIZE = 200
-PAGE_MORE_SIZE = 200
+HEADER_MODEL_CACHE_SIZE = 300
+HEADER_MODEL_EVICT_DISTANCE = 150
+HEADER_BATCH_FIRST_SIZE = 50
+HEADER_BATCH_SIZE = 2000
+HEADER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+HEADER_CACHE_UID_BYTES = 40
+HEADER_INDEX_MAX_SEGMENTS = 16
+
+BODY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+BODY_PREFETCH_COUNT = 5
+BODY_FIRST_CHUNK_SIZE = 16 * 1024
+BODY_CHUNK_SIZE = 64 * 1024
+BODY_CHUNK_INTERVAL_MILLIS = 30
+BODY_RENDER_LIMIT_DEFAULT = 256 * 1024
+BODY_HTML_VOID_TAGS = set(["area", "base", "br", "col", "hr", "img", "input",
+  "link", "meta", "source", "wbr"])
+BODY_HTML_SPLIT_AFTER_TAGS = set(["br", "hr", "/p", "/div", "/tr", "/table",
+  "/li", "/ul", "/dl", "/blockquote", "/center", "/h1", "/h2", "/h3", "/h4", "/h5", "/h6"])
+BODY_HTML_REOPEN_TAGS = set(["div", "center", "blockquote", "table", "tbody",
+  "thead", "tfoot", "tr", "td", "th", "ul", "dl", "dd", "font", "span",
+  "a", "b", "i", "u", "em", "strong", "small", "big"])
+BODY_HTML_IMPLICIT_CLOSE = {
+  "p": set(["p"]),
+  "li": set(["li", "p"]),
+  "dt": set(["dt", "dd", "p"]),
+  "dd": set(["dt", "dd", "p"]),
+  "td": set(["td", "th", "p"]),
+  "th": set(["td", "th", "p"]),
+  "tr": set(["tr", "td", "th", "p"]),
+}
+
+READ_FLAG_FLUSH_DELAY_MILLIS = 1500
+
+QUICK_FILTER_DELAY_MILLIS = 150
+SEARCH_REFINE_MAX_UIDS = 20000
+SEARCH_CANCEL_CHECK_INTERVAL = 1000
+SEARCH_PAGE_FIRST_SIZE = 100
+SEARCH_PAGE_SIZE = 2000
+
+GLOBAL_SEARCH_WORKER_COUNT = 3
+GLOBAL_SEARCH_SOURCE_LIMIT = 500
+FILTER_RESULT_CACHE_MAX_ENTRIES = 50
+
+LOG_MAX_LINES = 500
+LOG_FLUSH_INTERVAL_MILLIS = 50
+
+CACHE_WATCH_DELAY_MILLIS = 200
+
+FILE_LIST_FIRST_BATCH_SIZE = 50
+FILE_LIST_BATCH_SIZE = 500
+FILE_LIST_BATCH_INTERVAL_MILLIS = 30
+FILE_LIST_CACHE_MAX_DIRS = 20
+
+ADDRESS_SUGGESTION_LIMIT = 20
+ADDRESS_USAGE_HALF_LIFE_DAYS = 90
+CONTACT_SENT_WEIGHT = 5
+CONTACT_HARVEST_BATCH_SIZE = 2000
+
+COMMAND_WORKER_COUNT = 4
+COMMAND_PRIORITY_INTERACTIVE = 0
+COMMAND_PRIORITY_SEARCH = 1
+COMMAND_PRIORITY_FLAGS = 2
+COMMAND_PRIORITY_UPDATE = 3
+
+UPDATE_PARALLEL_DEFAULT = 3
+
+EMAIL_SERVER_RESTART_LIMIT = 3
+EMAIL_SERVER_RESTART_WINDOW_SECONDS = 60
+EMAIL_SERVER_START_TIMEOUT_SECONDS = 10
 
 EMAIL_DIR = os.getenv("HOME") + "/.cache/email"
+HEADER_INDEX_FILE_NAME = "header-index"
+HEADER_SEARCH_FILE_NAME = "header-search.sqlite"
+FILTER_RESULTS_FILE_NAME = "filter-results.sqlite"
+CONTACTS_FILE_NAME = "contacts.sqlite"
 CONFIG_DIR = os.getenv("HOME") + "/.config/qtemail"
+CONFIG_FILE = CONFIG_DIR + "/qtemail.conf"
+ADDRESS_BOOK_FILE = CONFIG_DIR + "/addressbook"
+CONFIG_PREFIX = "email"
 
 PYTHON2 = sys.version_info < (3, 0)
 PYTHON3 = sys.version_info >= (3, 0)
 
 STR_TYPE = unicode if PYTHON2 else str
 
-pages = ["account", "header", "config", "send", "folder", "body"]
+pages = ["account", "header", "config", "send", "folder", "body", "search"]
 okPages = "|".join(pages)
 
 usage = """Usage:
@@ -137,9 +223,13 @@ def main():
   addressBookModel = AddressBookModel()
   fileListModel = FileListModel()
   fileInfoModel = FileInfoModel()
+  logModel = LogModel()
+  searchResultModel = SearchResultModel()
+  searchSourceModel = SearchSourceModel()
   controller = Controller(emailManager,
     accountModel, folderModel, headerModel, configModel, filterButtonModel, notifierModel,
-    addressBookModel, fileListModel, fileInfoModel)
+    addressBookModel, fileListModel, fileInfoModel, logModel,
+    searchResultModel, searchSourceModel)
 
   controller.setupAccounts()
 
@@ -165,16 +255,21 @@ def main():
     controller.setFontScale(opts['fontScale'])
 
   app = QApplication([])
+  controller.watchAccounts()
+  controller.preloadInboxes()
+  controller.harvestContacts()
   mainWindow = MainWindow(qmlFile, controller,
     accountModel, folderModel, headerModel, configModel, filterButtonModel, notifierModel,
-    addressBookModel, fileListModel, fileInfoModel)
+    addressBookModel, fileListModel, fileInfoModel, logModel,
+    searchResultModel, searchSourceModel)
 
   mainWindow.setTitle(os.path.basename(__file__))
 
   if useSendWindow:
     sendWindow = SendWindow(QML_DIR + "/SendView.qml", controller, mainWindow,
       accountModel, folderModel, headerModel, configModel, filterButtonModel, notifierModel,
-      addressBookModel, fileListModel, fileInfoModel)
+      addressBookModel, fileListModel, fileInfoModel, logModel,
+      searchResultModel, searchSourceModel)
     sendView = sendWindow.rootObject()
     mainWindow.rootContext().setContextProperty('sendView', sendView)
     sendView.setNotifierEnabled(True)
@@ -190,6 +285,18 @@ def main():
 class EmailManager():
   def __init__(self):
     self.emailRegex = self.compileEmailRegex()
+    self.folderCaches = OrderedDict()
+    self.folderCacheLock = threading.Lock()
+    self.bodyCache = OrderedDict()
+    self.bodyCacheBytes = 0
+    self.bodyCacheLock = threading.Lock()
+    self.backend = EmailBackend()
+    self.config = None
+    self.configStat = None
+    self.configSchemas = {}
+    self.configLock = threading.Lock()
+    self.statusFiles = {}
+    self.statusFilesLock = threading.Lock()
 
   def compileEmailRegex(self):
     c = "[a-zA-Z0-9!#$%&'*+\\-/=?^_`{|}~]"
@@ -209,29 +316,36 @@ class EmailManager():
       return []
     return self.emailRegex.findall(string)
 
-  def readConfig(self, configMode, accName=None):
-    configValues = {}
-    cmd = [EMAIL_BIN]
+  def readConfig(self, configMode, accName=None, decryptPasswords=False):
+    config = self.getConfig()
+    if config == None:
+      return {}
     if configMode == "account":
-      cmd.append("--read-config")
-      if accName != None:
-        cmd.append(accName)
+      if accName == None or accName not in config['accounts']:
+        return {}
+      configValues = dict(config['accounts'][accName])
+      if decryptPasswords:
+        for key in configValues.keys():
+          if "password" in key:
+            configValues[key] = self.decryptConfigValue(key, configValues[key], config)
     elif configMode == "options":
-      cmd.append("--read-options")
+      configValues = dict(config['options'])
     else:
       die("invalid config mode: " + configMode)
-
-    if cmd != None:
-      configOut = self.readProc(cmd)
-
-      for line in configOut.splitlines():
-        m = regexMatch(r"(\w+(?:\.\w+)?)=(.*)", line)
-        if m:
-          fieldName = m.group(1)
-          value = m.group(2)
-          value = value.replace('\\n', '\n')
-          configValues[fieldName] = value
     return configValues
+  def decryptConfigValue(self, key, value, config):
+    decryptCmd = config['options'].get('decrypt_cmd')
+    if decryptCmd == None:
+      return value
+    cmdStr = decryptCmd.rstrip("\n") + " '" + value.replace("'", "'\\''") + "'"
+    request = self.backend.run(["sh", "-c", cmdStr])
+    if request.exitCode != 0:
+      print("error decrypting " + key)
+      return ""
+    value = toStr(request.getStdout())
+    if value.endswith("\n"):
+      value = value[:-1]
+    return value
   def writeConfig(self, configValues, configMode, accName=None):
     cmd = [EMAIL_BIN]
     if configMode == "account":
@@ -245,12 +359,15 @@ class EmailManager():
     for key in configValues.keys():
       cmd.append(key + "=" + configValues[key])
 
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    (out, err) = process.communicate()
-    print >> sys.stdout, out
-    print >> sys.stderr, err
-    return {'exitCode': process.returncode, 'stdout': out, 'stderr': err}
+    request = self.backend.run(cmd)
+    out = request.getStdout()
+    print(toStr(out))
+    return {'exitCode': request.exitCode, 'stdout': out, 'stderr': request.getStderr()}
+  #the contact harvester reads the config too, so the caches are only touched under a lock
   def readSchema(self, configMode):
+    with self.configLock:
+      if configMode in self.configSchemas:
+        return self.configSchemas[configMode]
     cmd = [EMAIL_BIN]
     if configMode == "account":
       cmd.append("--read-config-schema")
@@ -259,9 +376,7 @@ class EmailManager():
     else:
       die("invalid config mode: " + str(configMode))
 
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    (out, err) = process.communicate()
-    print >> sys.stderr, err
+    out = self.backend.run(cmd).getStdout()
 
     schema = []
     for line in out.splitlines():
@@ -270,6 +385,9 @@ class EmailManager():
         key = m.group(1)
         desc = m.group(2)
         schema.append((key, desc))
+    if len(schema) > 0:
+      with self.configLock:
+        self.configSchemas[configMode] = schema
     return schema
 
   def getConfigFields(self, schema, configValues):
@@ -294,7 +412,7 @@ class EmailManager():
     if accName == None:
       configValues = []
     else:
-      configValues = self.readConfig("account", accName)
+      configValues = self.readConfig("account", accName, decryptPasswords=True)
     return self.getConfigFields(schema, configValues)
   def getOptionsConfigFields(self):
     schema = self.readSchema("options")
@@ -317,7 +435,89 @@ class EmailManager():
       configValues[field.FieldName] = field.Value
     return self.writeConfig(configValues, "options")
 
+  def getConfig(self):
+    configStat = statFile(CONFIG_FILE)
+    with self.configLock:
+      if self.config != None and configStat == self.configStat:
+        return self.config
+    try:
+      f = open(CONFIG_FILE, 'r')
+      lines = f.read().splitlines(True)
+      f.close()
+    except (IOError, OSError):
+      lines = []
+    config = parseConfigLines(lines,
+      self.readSchema("account"), self.readSchema("options"))
+    with self.configLock:
+      self.config = config
+      self.configStat = configStat
+    return config
+
+  def readStatusFile(self, filePath, parseFct):
+    fileStat = statFile(filePath)
+    with self.statusFilesLock:
+      if fileStat == None:
+        self.statusFiles.pop(filePath, None)
+        return None
+      if filePath in self.statusFiles and self.statusFiles[filePath][0] == fileStat:
+        return self.statusFiles[filePath][1]
+    try:
+      f = open(filePath, 'rb')
+      data = f.read()
+      f.close()
+    except (IOError, OSError):
+      return None
+    value = parseFct(data)
+    with self.statusFilesLock:
+      self.statusFiles[filePath] = (fileStat, value)
+    return value
+  def readUidFileCount(self, accName, folderName, fileName):
+    filePath = EMAIL_DIR + "/" + accName + "/" + folderName + "/" + fileName
+    count = self.readStatusFile(filePath, lambda data: data.count(b"\n"))
+    return 0 if count == None else count
+  def readAccountText(self, accName, fileName):
+    filePath = EMAIL_DIR + "/" + accName + "/" + fileName
+    return self.readStatusFile(filePath, toStr)
+
   def getAccounts(self):
+    accounts = self.readAccountStatus()
+    if accounts == None:
+      accounts = self.readAccountStatusProc()
+    return accounts
+  def readAccountStatus(self):
+    config = self.getConfig()
+    if config == None:
+      return None
+    accounts = []
+    for accName in config['accOrder']:
+      acc = config['accounts'][accName]
+      countIncludeFolderNames = getCountIncludeFolderNames(acc)
+      if countIncludeFolderNames == None:
+        return None
+      unreadCount = 0
+      totalCount = 0
+      for folderName in countIncludeFolderNames:
+        unreadCount += self.readUidFileCount(accName, folderName, "unread")
+        totalCount += self.readUidFileCount(accName, folderName, "all")
+
+      lastUpdated = self.readAccountText(accName, "last_updated")
+      m = regexMatch(r"^\s*(\d+)", lastUpdated) if lastUpdated != None else None
+      if m:
+        lastUpdated = int(m.group(1))
+        lastUpdatedRel = relTime(lastUpdated)
+      else:
+        lastUpdated = 0
+        lastUpdatedRel = relTime(None)
+
+      error = self.readAccountText(accName, "error")
+      error = "" if error == None else error.split("\n")[0]
+
+      updateInterval = parseIntervalConfig(acc.get('update_interval'))
+      refreshInterval = parseIntervalConfig(acc.get('refresh_interval'))
+      accounts.append(Account(
+        accName, lastUpdated, lastUpdatedRel, updateInterval, refreshInterval, unreadCount, totalCount, error, False))
+    return accounts
+  def readAccountStatusProc(self):
     accountOut = self.readProc([EMAIL_BIN, "--accounts"])
     accounts = []
     for line in accountOut.splitlines():
@@ -337,7 +537,22 @@ class EmailManager():
   def getFolders(self, accountName):
     if accountName == None:
       return []
-
+    folders = self.readFolderStatus(accountName)
+    if folders == None:
+      folders = self.readFolderStatusProc(accountName)
+    return folders
+  def readFolderStatus(self, accountName):
+    config = self.getConfig()
+    if config == None or accountName not in config['accounts']:
+      return None
+    folders = []
+    for (folderName, imapFolder) in parseFolders(config['accounts'][accountName]):
+      unreadCount = self.readUidFileCount(accountName, folderName, "unread")
+      totalCount = self.readUidFileCount(accountName, folderName, "all")
+      folders.append(Folder(
+        folderName, unreadCount, totalCount))
+    return folders
+  def readFolderStatusProc(self, accountName):
     folderOut = self.readProc([EMAIL_BIN, "--folders", accountName])
     folders = []
     for line in folderOut.splitlines():
@@ -349,82 +564,115 @@ class EmailManager():
         folders.append(Folder(
           folderName, unreadCount, totalCount))
     return folders
-  def getUids(self, accName, folderName, fileName):
-    filePath = EMAIL_DIR + "/" + accName + "/" + folderName + "/" + fileName
-    if not os.path.isfile(filePath):
-      return []
-    f = open(filePath, 'r')
-    uids = f.read().splitlines()
-    f.close()
-    uids = filter(lambda uid: re.match(r"^\d+$", uid), uids)
-    return list(map(int, uids))
-  def fetchHeaders(self, accName, folderName, limit=None, limitWithoutUnread=None, exclude=[], minUid=None):
-    uids = self.getUids(accName, folderName, "all")
-    uids.sort()
-    uids.reverse()
-    total = len(uids)
-    unread = set(self.getUids(accName, folderName, "unread"))
-
-    if minUid != None:
-      uids = list(filter(lambda uid: uid >= minUid, uids))
-    if len(exclude) > 0:
-      exUids = set(map(lambda header: header.uid_, exclude))
-      uids = list(filter(lambda uid: uid not in exUids, uids))
-    if limit != None:
-      uids = uids[0:limit]
-    if limitWithoutUnread != None:
-      while len(uids) > limitWithoutUnread and uids[-1] not in unread:
-        uids.pop()
-
-    headers = []
-    for uid in uids:
-      header = self.getHeader(accName, folderName, uid)
-      header.isSent_ = folderName == "sent"
-      header.read_ = not uid in unread
-      headers.append(header)
-    return (total, headers)
+  def getFolderCache(self, accName, folderName):
+    key = (accName, folderName)
+    with self.folderCacheLock:
+      if key in self.folderCaches:
+        self.folderCaches.move_to_end(key)
+      else:
+        self.folderCaches[key] = FolderHeaderCache(accName, folderName)
+      return self.folderCaches[key]
+  #only drops the LRU reference, other threads may still be reading the evicted cache
+  #  its mmap and sqlite connections are closed when the last reference goes away
+  def trimFolderCaches(self):
+    with self.folderCacheLock:
+      totalSize = sum(map(lambda c: c.getSize(), self.folderCaches.values()))
+      while totalSize > HEADER_CACHE_MAX_BYTES and len(self.folderCaches) > 1:
+        (key, folderCache) = self.folderCaches.popitem(last=False)
+        totalSize -= folderCache.getSize()
+  def preloadFolder(self, accName, folderName):
+    folderCache = self.getFolderCache(accName, folderName)
+    folderCache.tracker.refresh()
+    folderCache.headerIndex.refresh()
+    self.loadFirstHeaders(accName, folderName)
+    self.trimFolderCaches()
+  def loadFirstHeaders(self, accName, folderName):
+    folderCache = self.getFolderCache(accName, folderName)
+    firstUids = folderCache.tracker.getUids()[0:HEADER_BATCH_FIRST_SIZE]
+    for uid in firstUids:
+      if uid not in folderCache.records:
+        fields = self.getHeaderFields(accName, folderName, uid)
+        if fields != None:
+          folderCache.records[uid] = fields
+    return firstUids
+  def getUidTracker(self, accName, folderName):
+    return self.getFolderCache(accName, folderName).tracker
+  def updateFolderUids(self, accName, folderName, snapshot):
+    delta = self.getUidTracker(accName, folderName).getDelta(snapshot)
+    if delta.isReset or len(delta.newUids) > 0:
+      self.getHeaderIndex(accName, folderName).refresh()
+    return delta
+  def getHeaderIndex(self, accName, folderName):
+    return self.getFolderCache(accName, folderName).headerIndex
+  def getHeaderFields(self, accName, folderName, uid):
+    fields = self.getHeaderIndex(accName, folderName).lookup(uid)
+    if fields == None:
+      filePath = getHeaderFilePath(accName, folderName, uid)
+      fields = readHeaderFile(filePath)
+    return fields
+  def searchHeaders(self, accName, folderName, query, minUid, maxUid,
+    isCancelled=None, queryKey=None, onPage=None):
+    folderCache = self.getFolderCache(accName, folderName)
+    folderCache.tracker.refresh()
+    folderCache.headerIndex.refresh()
+    searchIndex = folderCache.searchIndex
+    (indexedUids, removedUids) = searchIndex.update(folderCache.tracker.getUids(),
+      lambda uid: self.getHeaderFields(accName, folderName, uid))
+    filterResults = folderCache.filterResults
+    if filterResults.isReset(folderCache.tracker.resetCount) or len(removedUids) > 0:
+      filterResults.clear()
+    elif len(indexedUids) > 0:
+      filterResults.invalidateUids(indexedUids)
+    if queryKey == None:
+      return searchIndex.search(query, minUid, maxUid, isCancelled, onPage)
+
+    filterResult = folderCache.filterResults.get(queryKey)
+    gaps = filterResult.getGaps(minUid, maxUid) if filterResult != None else None
+    if gaps == None:
+      filterResult = FilterResult(minUid, maxUid, [])
+      gaps = [(minUid, maxUid)]
+    for (gapMinUid, gapMaxUid) in gaps:
+      isFullRange = gapMinUid == minUid and gapMaxUid == maxUid
+      uids = searchIndex.search(query, gapMinUid, gapMaxUid, isCancelled,
+        onPage if isFullRange else None)
+      if uids == None:
+        return None
+      filterResult = filterResult.merge(gapMinUid, gapMaxUid, uids)
+    if len(gaps) > 0:
+      folderCache.filterResults.put(queryKey, filterResult)
+    return filterResult.getUids(minUid, maxUid)
+  def refineHeaderSearch(self, accName, folderName, query, uids, isCancelled):
+    okUids = []
+    for i, uid in enumerate(uids):
+      if i % SEARCH_CANCEL_CHECK_INTERVAL == 0 and isCancelled():
+        return None
+      fields = self.getHeaderFields(accName, folderName, uid)
+      if fields != None and matchQueryFields(query, fields):
+        okUids.append(uid)
+    return okUids
   def getHeader(self, accName, folderName, uid):
-    filePath = EMAIL_DIR + "/" + accName + "/" + folderName + "/" + "headers/" + str(uid)
-    if not os.path.isfile(filePath):
-      print("MISSING EMAIL HEADER: " + filePath)
+    fields = self.getHeaderFields(accName, folderName, uid)
+    if fields == None:
       return None
-    f = open(filePath, 'r')
-    header = f.read()
-    f.close()
-    hdrDate = ""
-    hdrFrom = ""
-    hdrTo = ""
-    hdrCC = ""
-    hdrBCC = ""
-    hdrSubject = ""
-    for line in header.split('\n'):
-      if line.strip() == "":
-        continue
-      m = regexMatch(r'(\w+): (.*)', line)
-      if not m:
-        print("MALFORMED HEADER FILE: " + filePath)
+    (hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject) = fields
+    return Header(int(uid), hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject, False, False, False)
+  #like email.pl, a plain body is only used while the full body is cached too
+  def readCachedBody(self, accName, folderName, uid, isHtml):
+    if not os.path.isfile(getBodyFilePath(accName, folderName, uid, "bodies")):
+      return None
+    if isHtml:
+      data = readFileBytes(getBodyFilePath(accName, folderName, uid, "bodies"))
+      if data == None:
         return None
-      field = m.group(1)
-      val = m.group(2)
-      if PYTHON2:
-        try:
-          val = val.encode('utf-8')
-        except:
-          val = val.decode('utf-8')
-
-      if field == "Date":
-        hdrDate = val
-      elif field == "From":
-        hdrFrom = val
-      elif field == "To":
-        hdrTo = val
-      elif field == "CC":
-        hdrCC = val
-      elif field == "BCC":
-        hdrBCC = val
-      elif field == "Subject":
-        hdrSubject = val
-    return Header(uid, hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject, False, False, False)
+      body = formatMimeBody(data, True)
+    else:
+      data = readFileBytes(getBodyFilePath(accName, folderName, uid, "bodies-plain"))
+      if data == None:
+        return None
+      body = toStr(data)
+    if body.endswith("\n"):
+      body = body[:-1]
+    return body + "\n"
   def getCachedBodies(self, accountName, folderName, uids, isHtml):
     if isHtml:
       bodyArg = "--body-html"
@@ -432,27 +680,59 @@ class EmailManager():
       bodyArg = "--body-plain"
     cmd = [EMAIL_BIN, bodyArg, "--no-download", "-0",
       "--folder=" + folderName, accountName] + list(map(str,uids))
-    bodyNuls = self.readProc(cmd)
+    bodyNuls = toStr(self.readProc(cmd))
     bodies = bodyNuls.split("\0")
     if len(bodies) > 0 and bodies[-1] == "":
       bodies.pop()
     if len(bodies) != len(uids):
       raise Exception("ERROR: could not read bodies")
-    uidBodies = dict(zip(uids, bodies))
-    for uid in uidBodies.keys():
+    return dict(zip(uids, bodies))
+  def getBodyCacheEntry(self, accName, folderName, uid, isHtml):
+    key = (accName, folderName, uid, isHtml)
+    with self.bodyCacheLock:
+      if key not in self.bodyCache:
+        return None
+      self.bodyCache.move_to_end(key)
+      return self.bodyCache[key]
+  def putBodyCacheEntry(self, accName, folderName, uid, isHtml, body):
+    key = (accName, folderName, uid, isHtml)
+    with self.bodyCacheLock:
+      if key in self.bodyCache:
+        self.bodyCacheBytes -= len(self.bodyCache.pop(key))
+      self.bodyCache[key] = body
+      self.bodyCacheBytes += len(body)
+      while self.bodyCacheBytes > BODY_CACHE_MAX_BYTES and len(self.bodyCache) > 1:
+        (_, oldBody) = self.bodyCache.popitem(last=False)
+        self.bodyCacheBytes -= len(oldBody)
+  def prefetchBodies(self, accName, folderName, uids, isHtml, isCancelled):
+    uids = list(filter(lambda uid:
+      self.getBodyCacheEntry(accName, folderName, uid, isHtml) == None, uids))
+    missingUids = []
+    for uid in uids:
+      if isCancelled():
+        return
+      body = self.readCachedBody(accName, folderName, uid, isHtml)
+      if body != None:
+        self.putBodyCacheEntry(accName, folderName, uid, isHtml, body)
+      else:
+        missingUids.append(uid)
+    uids = missingUids
+    if len(uids) == 0 or isCancelled():
+      return
+    try:
+      uidBodies = self.getCachedBodies(accName, folderName, uids, isHtml)
+    except Exception as e:
+      print("could not prefetch bodies: " + str(e))
+      return
+    for uid in uids:
       body = uidBodies[uid]
-      try:
-        body = body.encode('utf-8')
-      except:
-        try:
-          body = body.decode('utf-8')
-        except:
-          body = regexSub(r'[^\x00-\x7F]', ' ', body).encode('utf-8')
-    return uidBodies
+      #empty means the body is not downloaded yet
+      if body != "":
+        self.putBodyCacheEntry(accName, folderName, uid, isHtml, body + "\n")
   def getAddressBook(self):
-    filePath = CONFIG_DIR + "/" + "addressbook"
+    filePath = ADDRESS_BOOK_FILE
     if not os.path.isfile(filePath):
-      return []
+      return dict()
     f = open(filePath, 'r')
     addressBookContents = f.read()
     f.close()
@@ -469,21 +749,1098 @@ class EmailManager():
       else:
         if curAccName == None:
           warn("error reading address book, missing account name\n")
-          return []
+          return dict()
         if curAccName not in addressBook:
           addressBook[curAccName] = []
         addressBook[curAccName].append(line)
     return addressBook
 
   def readProc(self, cmdArr):
-    process = subprocess.Popen(cmdArr, stdout=subprocess.PIPE)
-    (stdout, _) = process.communicate()
-    return stdout
+    return self.backend.run(cmdArr).getStdout()
+
+#requests made before the server is READY are queued, and run directly if it never is
+class EmailBackend():
+  def __init__(self):
+    self.proc = None
+    self.serverReady = False
+    self.queuedRequests = []
+    self.requests = {}
+    self.nextRequestId = 1
+    self.restartTimes = []
+    self.serverDisabled = False
+    self.lock = threading.Lock()
+
+  def run(self, cmdArr):
+    request = self.start(cmdArr)
+    request.wait()
+    return request
+
+  def start(self, cmdArr, streamOutput=False, keepOutput=True):
+    if len(cmdArr) > 0 and cmdArr[0] == EMAIL_BIN:
+      request = self.startServerRequest(cmdArr[1:], streamOutput, keepOutput)
+      if request != None:
+        return request
+    return self.startProcRequest(cmdArr, streamOutput, keepOutput)
+
+  def startServerRequest(self, args, streamOutput, keepOutput):
+    with self.lock:
+      proc = self.ensureServer()
+      if proc == None:
+        return None
+      requestId = self.nextRequestId
+      self.nextRequestId += 1
+      request = EmailBackendRequest(lambda: self.killServerRequest(proc, requestId),
+        streamOutput, keepOutput)
+      self.requests[requestId] = request
+      if not self.serverReady:
+        self.queuedRequests.append((requestId, args))
+        return request
+      try:
+        self.writeRequestFrame(proc, requestId, args)
+      except (IOError, OSError) as e:
+        print("could not send request to email server: " + str(e))
+        del self.requests[requestId]
+        return None
+      return request
+  def writeRequestFrame(self, proc, requestId, args):
+    payload = b"".join(map(lambda arg: toBytes(arg) + b"\0", args))
+    self.writeFrame(proc, "REQ", requestId, payload)
+
+  def startProcRequest(self, cmdArr, streamOutput, keepOutput):
+    request = EmailBackendRequest(None, streamOutput, keepOutput)
+    self.runProcRequest(cmdArr, request)
+    return request
+  def runProcRequest(self, cmdArr, request):
+    proc = subprocess.Popen(cmdArr, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+      preexec_fn=os.setsid)
+    request.killAction = lambda: self.killProcGroup(proc)
+    errReader = threading.Thread(target=self.readProcStream,
+      args=(proc.stderr, request.onError))
+    errReader.daemon = True
+    errReader.start()
+    def readProcOutput():
+      self.readProcStream(proc.stdout, request.onOutput)
+      errReader.join()
+      request.onExit(proc.wait())
+    outReader = threading.Thread(target=readProcOutput)
+    outReader.daemon = True
+    outReader.start()
+
+  def killProcGroup(self, proc):
+    try:
+      os.killpg(proc.pid, signal.SIGTERM)
+    except OSError:
+      pass
+
+  def readProcStream(self, stream, onData):
+    while True:
+      data = stream.read1(65536) if PYTHON3 else stream.readline()
+      if not data:
+        break
+      onData(data)
+    stream.close()
+
+  def ensureServer(self):
+    if self.proc != None:
+      return self.proc
+    if self.serverDisabled:
+      return None
+
+    now = time.time()
+    self.restartTimes = list(filter(
+      lambda t: now - t < EMAIL_SERVER_RESTART_WINDOW_SECONDS, self.restartTimes))
+    if len(self.restartTimes) >= EMAIL_SERVER_RESTART_LIMIT:
+      print("email server keeps exiting, running commands directly instead")
+      self.serverDisabled = True
+      return None
+    self.restartTimes.append(now)
+
+    try:
+      proc = subprocess.Popen([EMAIL_BIN, "--server"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    except OSError as e:
+      print("could not start email server: " + str(e))
+      self.serverDisabled = True
+      return None
+
+    #READY is read by the reader thread, modules take a while to load
+    reader = threading.Thread(target=self.readServerFrames, args=(proc,))
+    reader.daemon = True
+    reader.start()
+    startTimer = threading.Timer(EMAIL_SERVER_START_TIMEOUT_SECONDS,
+      lambda: self.onServerStartFailed(proc, "email server did not start in time"))
+    startTimer.daemon = True
+    startTimer.start()
+    self.proc = proc
+    self.serverReady = False
+    return proc
+  def onServerReady(self, proc):
+    with self.lock:
+      if proc != self.proc:
+        return False
+      self.serverReady = True
+      queuedRequests = self.queuedRequests
+      self.queuedRequests = []
+      try:
+        for (requestId, args) in queuedRequests:
+          self.writeRequestFrame(proc, requestId, args)
+      except (IOError, OSError) as e:
+        print("could not send request to email server: " + str(e))
+      return True
+  def onServerStartFailed(self, proc, msg):
+    with self.lock:
+      if proc != self.proc or self.serverReady:
+        return
+      print(msg + ", running commands directly instead")
+      self.proc = None
+      self.serverDisabled = True
+      queuedRequests = self.queuedRequests
+      self.queuedRequests = []
+      requests = list(map(lambda q: self.requests.pop(q[0]), queuedRequests))
+    try:
+      proc.kill()
+    except OSError:
+      pass
+    for ((requestId, args), request) in zip(queuedRequests, requests):
+      self.runProcRequest([EMAIL_BIN] + args, request)
+
+  def killServerRequest(self, proc, requestId):
+    with self.lock:
+      if proc != self.proc or requestId not in self.requests:
+        return
+      queuedIds = list(map(lambda q: q[0], self.queuedRequests))
+      if requestId in queuedIds:
+        del self.queuedRequests[queuedIds.index(requestId)]
+        request = self.requests.pop(requestId)
+      else:
+        request = None
+        try:
+          self.writeFrame(proc, "KILL", requestId, b"")
+        except (IOError, OSError):
+          pass
+    if request != None:
+      request.onExit(128 + signal.SIGTERM)
+
+  def readServerFrames(self, proc):
+    frame = self.readFrame(proc)
+    if frame == None or frame[0] != "READY" or not self.onServerReady(proc):
+      self.onServerStartFailed(proc, "email server did not start")
+      proc.wait()
+      return
+    while True:
+      frame = self.readFrame(proc)
+      if frame == None:
+        break
+      (frameType, requestId, payload) = frame
+      with self.lock:
+        request = self.requests.get(requestId)
+        if frameType == "EXIT":
+          self.requests.pop(requestId, None)
+      if request == None:
+        continue
+      if frameType == "OUT":
+        request.onOutput(payload)
+      elif frameType == "ERR":
+        request.onError(payload)
+      elif frameType == "EXIT":
+        request.onExit(int(payload))
+
+    proc.wait()
+    print("email server exited with code " + str(proc.returncode))
+    with self.lock:
+      if self.proc == proc:
+        self.proc = None
+      orphans = list(self.requests.values())
+      self.requests = {}
+    for request in orphans:
+      request.onError(b"email server exited before command finished\n")
+      request.onExit(255)
+
+  def readFrame(self, proc):
+    line = proc.stdout.readline()
+    m = re.match(br"^(\w+) (\d+) (\d+)\n$", line)
+    if not m:
+      return None
+    payload = proc.stdout.read(int(m.group(3)))
+    if len(payload) != int(m.group(3)):
+      return None
+    return (toStr(m.group(1)), int(m.group(2)), payload)
+
+  def writeFrame(self, proc, frameType, requestId, payload):
+    header = frameType + " " + str(requestId) + " " + str(len(payload)) + "\n"
+    proc.stdin.write(toBytes(header) + payload)
+    proc.stdin.flush()
+
+class EmailBackendRequest():
+  def __init__(self, killAction, streamOutput, keepOutput):
+    self.killAction = killAction
+    self.streamOutput = streamOutput
+    self.keepOutput = keepOutput
+    self.stdout = []
+    self.stderr = []
+    self.pending = []
+    self.exitCode = None
+    self.cond = threading.Condition()
+
+  def onOutput(self, data):
+    with self.cond:
+      if self.keepOutput:
+        self.stdout.append(data)
+      if self.streamOutput:
+        self.pending.append(data)
+      self.cond.notify_all()
+  def onError(self, data):
+    sys.stderr.write(toStr(data))
+    sys.stderr.flush()
+    with self.cond:
+      self.stderr.append(data)
+  def onExit(self, exitCode):
+    with self.cond:
+      self.exitCode = exitCode
+      self.cond.notify_all()
+
+  def kill(self):
+    if self.exitCode == None:
+      self.killAction()
+  def wait(self):
+    with self.cond:
+      while self.exitCode == None:
+        self.cond.wait()
+      return self.exitCode
+  def isFinished(self):
+    return self.exitCode != None
+
+  def getStdout(self):
+    with self.cond:
+      return b"".join(self.stdout)
+  def getStderr(self):
+    with self.cond:
+      return b"".join(self.stderr)
+
+  def readLines(self):
+    buf = b""
+    while True:
+      with self.cond:
+        while len(self.pending) == 0 and self.exitCode == None:
+          self.cond.wait()
+        chunks = self.pending
+        self.pending = []
+        isFinished = self.exitCode != None
+      buf += b"".join(chunks)
+      lines = buf.split(b"\n")
+      buf = lines.pop()
+      for line in lines:
+        yield line + b"\n"
+      if isFinished:
+        break
+    if len(buf) > 0:
+      yield buf
+
+class UidListDelta():
+  def __init__(self, isReset, newUids, unreadUids, unreadChanged, snapshot):
+    self.isReset = isReset
+    self.newUids = newUids
+    self.unreadUids = unreadUids
+    self.unreadChanged = unreadChanged
+    self.snapshot = snapshot
+
+#what one consumer last saw of a UidListTracker
+#  uids are only ever prepended until the next reset
+class UidListSnapshot():
+  def __init__(self, resetCount, uids, unread):
+    self.resetCount = resetCount
+    self.uids = uids
+    self.unread = unread
+
+class FolderHeaderCache():
+  def __init__(self, accName, folderName):
+    self.tracker = UidListTracker(accName, folderName)
+    self.headerIndex = HeaderIndex(accName, folderName, self.tracker)
+    self.searchIndex = HeaderSearchIndex(accName, folderName)
+    self.filterResults = FilterResultCache(accName, folderName)
+    self.records = {}
+
+  def isLoaded(self):
+    return self.tracker.isLoaded()
+  def isUpToDate(self, snapshot):
+    return self.tracker.isUpToDate(snapshot)
+  def getSize(self):
+    size = self.tracker.getCount() * HEADER_CACHE_UID_BYTES
+    for fields in list(self.records.values()):
+      size += sum(map(len, fields))
+    return size
+
+class UidListTracker():
+  def __init__(self, accName, folderName):
+    folderDir = EMAIL_DIR + "/" + accName + "/" + folderName
+    self.allFile = folderDir + "/all"
+    self.unreadFile = folderDir + "/unread"
+    self.uids = []
+    self.highWater = None
+    self.allStat = None
+    self.unread = set()
+    self.unreadStat = None
+    self.resetCount = 0
+    self.lock = threading.Lock()
+
+  def getUids(self):
+    with self.lock:
+      return self.uids
+  def getUnread(self):
+    with self.lock:
+      return set(self.unread)
+  def getCount(self):
+    return len(self.uids) + len(self.unread)
+  def isLoaded(self):
+    return self.allStat != None
+  def getSnapshot(self):
+    with self.lock:
+      return UidListSnapshot(self.resetCount, self.uids, set(self.unread))
+  def isUpToDate(self, snapshot):
+    with self.lock:
+      if self.allStat == None or snapshot == None:
+        return False
+      return (statFile(self.allFile) == self.allStat
+        and statFile(self.unreadFile) == self.unreadStat
+        and snapshot.resetCount == self.resetCount
+        and snapshot.uids is self.uids
+        and snapshot.unread == self.unread)
+
+  def readUids(self, filePath, offset=0):
+    try:
+      f = open(filePath, 'rb')
+      f.seek(offset)
+      data = f.read()
+      f.close()
+    except (IOError, OSError):
+      return []
+    return [int(line) for line in data.split(b"\n") if line.isdigit()]
+
+  def endsWithHighWater(self, size):
+    if self.highWater == None:
+      return size == 0
+    last = toBytes(str(self.highWater)) + b"\n"
+    start = max(0, size - len(last) - 1)
+    try:
+      f = open(self.allFile, 'rb')
+      f.seek(start)
+      tail = f.read(size - start)
+      f.close()
+    except (IOError, OSError):
+      return False
+    return tail == last or tail == b"\n" + last
+
+  #re-reads the files without handing out a delta, so any thread can call it
+  def refresh(self):
+    with self.lock:
+      self.updateUnlocked()
+  #changes since snapshot, which belongs to the caller
+  def getDelta(self, snapshot):
+    with self.lock:
+      self.updateUnlocked()
+      unread = set(self.unread)
+      if snapshot == None or snapshot.resetCount != self.resetCount:
+        isReset = True
+        newUids = []
+        unreadChanged = unread if snapshot == None else unread.symmetric_difference(snapshot.unread)
+      else:
+        isReset = False
+        newUids = self.uids[0:len(self.uids) - len(snapshot.uids)]
+        unreadChanged = unread.symmetric_difference(snapshot.unread)
+      newSnapshot = UidListSnapshot(self.resetCount, self.uids, unread)
+      return UidListDelta(isReset, newUids, set(unread), unreadChanged, newSnapshot)
+  def updateUnlocked(self):
+    isReset = False
+    newUids = []
+    allStat = statFile(self.allFile)
+    if allStat != self.allStat:
+      oldSize = self.allStat[0] if self.allStat != None else 0
+      if self.allStat != None and allStat != None and self.endsWithHighWater(oldSize):
+        if allStat[0] > oldSize:
+          newUids = self.readUids(self.allFile, oldSize)
+      else:
+        isReset = True
+      self.allStat = allStat
+
+    if isReset:
+      uids = self.readUids(self.allFile)
+      uids.sort()
+      uids.reverse()
+      self.uids = uids
+      self.resetCount += 1
+    elif len(newUids) > 0:
+      newUids.sort()
+      newUids.reverse()
+      self.uids = newUids + self.uids
+    if len(self.uids) > 0:
+      self.highWater = max(self.uids[0], self.uids[-1])
+    else:
+      self.highWater = None
+
+    unreadStat = statFile(self.unreadFile)
+    if unreadStat != self.unreadStat:
+      self.unread = set(self.readUids(self.unreadFile))
+      self.unreadStat = unreadStat
+
+#watches the uid lists and account status files written by email.pl
+#  replaced or newly created files are re-added after each change
+#  folder dirs are watched only to notice uid lists being created
+class CacheWatcher(QObject):
+  cacheChanged = pyqtSignal(object)
+  def __init__(self):
+    QObject.__init__(self)
+    self.watcher = QFileSystemWatcher()
+    self.watcher.fileChanged.connect(self.onPathChanged)
+    self.watcher.directoryChanged.connect(self.onPathChanged)
+    self.pathSources = {}
+    self.dirSources = {}
+    self.changedSources = set()
+    self.flushTimer = QTimer()
+    self.flushTimer.setSingleShot(True)
+    self.flushTimer.setInterval(CACHE_WATCH_DELAY_MILLIS)
+    self.flushTimer.timeout.connect(self.flushChanges)
+
+  def setSources(self, sources):
+    self.pathSources = {}
+    self.dirSources = {}
+    for (accName, folderNames) in sources:
+      accDir = EMAIL_DIR + "/" + accName
+      self.pathSources[accDir] = (accName, None)
+      for fileName in ["last_updated", "error"]:
+        self.pathSources[accDir + "/" + fileName] = (accName, None)
+      for folderName in folderNames:
+        self.dirSources[accDir + "/" + folderName] = (accName, folderName)
+        for fileName in ["all", "unread"]:
+          self.pathSources[accDir + "/" + folderName + "/" + fileName] = (accName, folderName)
+    self.resetWatches()
+  def resetWatches(self):
+    watchedPaths = set(self.watcher.files() + self.watcher.directories())
+    allPaths = set(self.pathSources.keys()).union(self.dirSources.keys())
+    stalePaths = list(watchedPaths - allPaths)
+    if len(stalePaths) > 0:
+      self.watcher.removePaths(stalePaths)
+    newPaths = []
+    for path in allPaths:
+      if path not in watchedPaths and os.path.exists(path):
+        newPaths.append(path)
+    if len(newPaths) > 0:
+      self.watcher.addPaths(newPaths)
+    return newPaths
+  def onPathChanged(self, path):
+    if path in self.dirSources:
+      #the gui writes its own caches here too, so only new uid lists count
+      changedPaths = self.resetWatches()
+    else:
+      changedPaths = [path]
+    for changedPath in changedPaths:
+      source = self.pathSources.get(changedPath)
+      if source != None:
+        self.changedSources.add(source)
+        if not self.flushTimer.isActive():
+          self.flushTimer.start()
+  def flushChanges(self):
+    self.resetWatches()
+    changedSources = self.changedSources
+    self.changedSources = set()
+    self.cacheChanged.emit(changedSources)
+
+class HeaderSearchIndex():
+  def __init__(self, accName, folderName):
+    folderDir = EMAIL_DIR + "/" + accName + "/" + folderName
+    self.dbFile = folderDir + "/" + HEADER_SEARCH_FILE_NAME
+    self.conn = None
+    self.indexedUids = None
+    self.lastUids = None
+    self.lock = threading.Lock()
+
+  def openUnlocked(self):
+    if self.conn != None:
+      return
+    self.conn = sqlite3.connect(self.dbFile, check_same_thread=False)
+    cols = ", ".join(map(lambda field: "header_" + field, HEADER_SEARCH_FIELDS))
+    try:
+      self.conn.execute("create virtual table if not exists header"
+        + " using fts5(" + cols + ", tokenize='trigram')")
+    except sqlite3.OperationalError:
+      print("fts5 trigram tokenizer unavailable, using plain header table")
+      self.conn.execute("create table if not exists header (" + cols + ")")
+    self.conn.create_function("regexp", 2, sqlRegexp)
+    if isHeaderRegexSearch():
+      try:
+        self.conn.enable_load_extension(True)
+        self.conn.load_extension(SQLITE_PCRE_LIB)
+        self.conn.enable_load_extension(False)
+      except (AttributeError, sqlite3.OperationalError):
+        print("could not load " + SQLITE_PCRE_LIB + ", using python re for regexp")
+  def close(self):
+    with self.lock:
+      if self.conn != None:
+        self.conn.close()
+      self.conn = None
+      self.indexedUids = None
+      self.lastUids = None
+
+  def update(self, uids, getFields):
+    with self.lock:
+      self.openUnlocked()
+      if uids is self.lastUids:
+        return ([], [])
+      if self.indexedUids == None:
+        self.indexedUids = set(map(lambda row: row[0],
+          self.conn.execute("select rowid from header")))
+      uidSet = set(uids)
+      staleUids = self.indexedUids - uidSet
+      rows = []
+      for uid in uids:
+        if uid not in self.indexedUids:
+          fields = getFields(uid)
+          if fields != None:
+            (hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject) = fields
+            rows.append((uid, hdrDate, hdrFrom, hdrSubject, hdrTo, hdrCC, hdrBCC))
+      if len(rows) > 0 or len(staleUids) > 0:
+        with self.conn:
+          self.conn.executemany("delete from header where rowid = ?",
+            map(lambda uid: (uid,), staleUids))
+          self.conn.executemany("insert into header (rowid, "
+            + ", ".join(map(lambda field: "header_" + field, HEADER_SEARCH_FIELDS))
+            + ") values (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.indexedUids -= staleUids
+        self.indexedUids.update(map(lambda row: row[0], rows))
+      self.lastUids = uids
+      return (list(map(lambda row: row[0], rows)), list(staleUids))
+
+  def search(self, query, minUid, maxUid, isCancelled=None, onPage=None):
+    sql = "select rowid from header where rowid >= ? and rowid <= ?"
+    queryParams = []
+    if query != None:
+      (querySql, queryParams) = formatQuerySql(query)
+      sql += " and (" + querySql + ")"
+    with self.lock:
+      self.openUnlocked()
+      if isCancelled != None:
+        self.conn.set_progress_handler(isCancelled, SEARCH_CANCEL_CHECK_INTERVAL)
+      try:
+        if onPage == None:
+          params = [minUid, maxUid] + queryParams
+          return list(map(lambda row: row[0], self.conn.execute(sql, params)))
+
+        #newest first, each page starting below the last uid of the previous one
+        uids = []
+        pageMaxUid = maxUid
+        pageSize = SEARCH_PAGE_FIRST_SIZE
+        while True:
+          params = [minUid, pageMaxUid] + queryParams + [pageSize]
+          page = list(map(lambda row: row[0],
+            self.conn.execute(sql + " order by rowid desc limit ?", params)))
+          if len(page) > 0:
+            onPage(page, len(uids) == 0)
+          uids += page
+          if len(page) < pageSize:
+            return uids
+          pageMaxUid = page[-1] - 1
+          pageSize = SEARCH_PAGE_SIZE
+      except sqlite3.OperationalError:
+        if isCancelled != None and isCancelled():
+          return None
+        raise
+      finally:
+        self.conn.set_progress_handler(None, 0)
+
+class FilterResult():
+  def __init__(self, minUid, maxUid, uids):
+    self.minUid = minUid
+    self.maxUid = maxUid
+    self.uids = uids
+
+  def getGaps(self, minUid, maxUid):
+    if maxUid < self.minUid - 1 or minUid > self.maxUid + 1:
+      return None
+    gaps = []
+    if minUid < self.minUid:
+      gaps.append((minUid, self.minUid - 1))
+    if maxUid > self.maxUid:
+      gaps.append((self.maxUid + 1, maxUid))
+    return gaps
+  def merge(self, minUid, maxUid, uids):
+    return FilterResult(min(self.minUid, minUid), max(self.maxUid, maxUid),
+      sorted(set(self.uids).union(uids)))
+  def getUids(self, minUid, maxUid):
+    return list(filter(lambda uid: minUid <= uid and uid <= maxUid, self.uids))
+
+#results of named header-only filters, keyed by the normalized query
+#  covers every uid from min_uid to max_uid, so new mail only needs the new uids
+#  everything is dropped when uids are removed or the uid list is reset
+class FilterResultCache():
+  def __init__(self, accName, folderName):
+    folderDir = EMAIL_DIR + "/" + accName + "/" + folderName
+    self.dbFile = folderDir + "/" + FILTER_RESULTS_FILE_NAME
+    self.conn = None
+    self.resetCount = None
+    self.lock = threading.Lock()
+
+  def openUnlocked(self):
+    if self.conn != None:
+      return
+    self.conn = sqlite3.connect(self.dbFile, check_same_thread=False)
+    self.conn.execute("create table if not exists filter_result ("
+      + "query text primary key, min_uid integer, max_uid integer, uids text, updated real)")
+  def close(self):
+    with self.lock:
+      if self.conn != None:
+        self.conn.close()
+      self.conn = None
+
+  def get(self, queryKey):
+    with self.lock:
+      self.openUnlocked()
+      row = self.conn.execute("select min_uid, max_uid, uids from filter_result"
+        + " where query = ?", (queryKey,)).fetchone()
+    if row == None:
+      return None
+    (minUid, maxUid, uidsStr) = row
+    uids = list(map(int, uidsStr.split(","))) if uidsStr != "" else []
+    return FilterResult(minUid, maxUid, uids)
+  def put(self, queryKey, filterResult):
+    uidsStr = ",".join(map(str, filterResult.uids))
+    with self.lock:
+      self.openUnlocked()
+      with self.conn:
+        self.conn.execute("insert or replace into filter_result"
+          + " (query, min_uid, max_uid, uids, updated) values (?, ?, ?, ?, ?)",
+          (queryKey, filterResult.minUid, filterResult.maxUid, uidsStr, time.time()))
+        self.conn.execute("delete from filter_result where query not in"
+          + " (select query from filter_result order by updated desc limit ?)",
+          (FILTER_RESULT_CACHE_MAX_ENTRIES,))
+  #the first resetCount seen is the stored results' baseline, not a reset
+  def isReset(self, resetCount):
+    with self.lock:
+      isReset = self.resetCount != None and self.resetCount != resetCount
+      self.resetCount = resetCount
+    return isReset
+  def clear(self):
+    with self.lock:
+      self.openUnlocked()
+      with self.conn:
+        self.conn.execute("delete from filter_result")
+  #uids indexed late, e.g.: a header file written after its uid was listed
+  #  uids above a result's max_uid are left for the next search to extend it with
+  def invalidateUids(self, uids):
+    uids = sorted(uids)
+    with self.lock:
+      self.openUnlocked()
+      rows = self.conn.execute("select query, min_uid, max_uid from filter_result").fetchall()
+      staleQueries = []
+      for (queryKey, minUid, maxUid) in rows:
+        i = bisect.bisect_left(uids, minUid)
+        if i < len(uids) and uids[i] <= maxUid:
+          staleQueries.append((queryKey,))
+      if len(staleQueries) > 0:
+        with self.conn:
+          self.conn.executemany("delete from filter_result where query = ?", staleQueries)
+
+#every address seen in an account, with how often it was written to or received from
+#  harvest_progress holds the highest uid already harvested from each folder,
+#    with the lowest uid and the number of uids up to it, to notice renumbering
+class ContactStore():
+  def __init__(self, accName):
+    self.dbFile = EMAIL_DIR + "/" + accName + "/" + CONTACTS_FILE_NAME
+    self.conn = None
+    self.lock = threading.Lock()
+
+  def openUnlocked(self):
+    if self.conn != None:
+      return
+    self.conn = sqlite3.connect(self.dbFile, check_same_thread=False)
+    self.conn.execute("create table if not exists contact ("
+      + "address text primary key, name text,"
+      + " sent_count integer, received_count integer, last_seen real)")
+    self.conn.execute("create table if not exists harvest_progress ("
+      + "folder text primary key, max_uid integer, min_uid integer, uid_count integer)")
+    columns = [row[1] for row in self.conn.execute("pragma table_info(harvest_progress)")]
+    if "min_uid" not in columns:
+      self.conn.execute("alter table harvest_progress add column min_uid integer")
+      self.conn.execute("alter table harvest_progress add column uid_count integer")
+  def close(self):
+    with self.lock:
+      if self.conn != None:
+        self.conn.close()
+      self.conn = None
+
+  def getContacts(self):
+    with self.lock:
+      self.openUnlocked()
+      rows = self.conn.execute("select address, name, sent_count, received_count,"
+        + " last_seen from contact").fetchall()
+    contacts = {}
+    for (address, name, sentCount, receivedCount, lastSeen) in rows:
+      contacts[address] = (name, sentCount, receivedCount, lastSeen)
+    return contacts
+  #(maxUid, minUid, uidCount), minUid and uidCount are None for old progress rows
+  def getHarvestProgress(self, folderName):
+    with self.lock:
+      self.openUnlocked()
+      row = self.conn.execute("select max_uid, min_uid, uid_count from harvest_progress"
+        + " where folder = ?", (folderName,)).fetchone()
+    return (0, None, None) if row == None else row
+  def addUsage(self, addresses, usedTime):
+    contacts = {}
+    for address in addresses:
+      contacts[address] = ("", 1, 0, usedTime)
+    with self.lock:
+      self.openUnlocked()
+      with self.conn:
+        self.addContactsUnlocked(contacts)
+  def addHarvest(self, folderName, maxUid, minUid, uidCount, contacts):
+    with self.lock:
+      self.openUnlocked()
+      with self.conn:
+        self.addContactsUnlocked(contacts)
+        self.conn.execute("insert or replace into harvest_progress"
+          + " (folder, max_uid, min_uid, uid_count) values (?, ?, ?, ?)",
+          (folderName, maxUid, minUid, uidCount))
+  def addContactsUnlocked(self, contacts):
+    for (address, (name, sentCount, receivedCount, lastSeen)) in contacts.items():
+      self.conn.execute("insert or ignore into contact (address, name,"
+        + " sent_count, received_count, last_seen) values (?, '', 0, 0, 0)", (address,))
+      self.conn.execute("update contact set sent_count = sent_count + ?,"
+        + " received_count = received_count + ?, last_seen = max(last_seen, ?),"
+        + " name = case when ? = '' then name else ? end where address = ?",
+        (sentCount, receivedCount, lastSeen, name, name, address))
+
+class AddressBookEntry():
+  def __init__(self, text, addresses):
+    self.text = text
+    self.lowerText = text.lower()
+    self.addresses = addresses
+
+#sorted (word, text) pairs per account, for prefix lookups with bisect
+#  address book lines first, then harvested contacts that are not in the address book
+#  re-read only when the address book file or the contacts change,
+#  and only changed lines are re-indexed
+class AddressBookIndex():
+  def __init__(self, emailManager):
+    self.emailManager = emailManager
+    self.fileStat = None
+    self.addressBook = {}
+    self.entries = {}
+    self.tokens = {}
+    self.contactStores = {}
+    self.contacts = {}
+    self.staleAccNames = set()
+
+  def refresh(self):
+    try:
+      st = os.stat(ADDRESS_BOOK_FILE)
+      fileStat = (st.st_mtime, st.st_size)
+    except OSError:
+      fileStat = None
+    if fileStat != self.fileStat:
+      self.fileStat = fileStat
+      self.addressBook = self.emailManager.getAddressBook()
+      self.staleAccNames.update(self.entries.keys())
+    for accName in self.staleAccNames:
+      if accName in self.entries:
+        self.updateAccount(accName, self.getLines(accName))
+    self.staleAccNames.clear()
+  def getLines(self, accName):
+    lines = list(self.addressBook.get(accName, []))
+    bookAddresses = set(map(lambda e: e.lower(), self.emailManager.parseEmails("\n".join(lines))))
+    contacts = self.getContacts(accName)
+    for address in sorted(contacts.keys()):
+      if address not in bookAddresses:
+        name = contacts[address][0]
+        lines.append(address if name == "" else name + " <" + address + ">")
+    return lines
+  def updateAccount(self, accName, lines):
+    if accName not in self.entries:
+      self.entries[accName] = {}
+      self.tokens[accName] = []
+    entries = self.entries[accName]
+    tokens = self.tokens[accName]
+    isEmpty = len(entries) == 0
+
+    lineSet = set(lines)
+    for text in list(entries.keys()):
+      if text not in lineSet:
+        for token in self.getTokens(entries.pop(text)):
+          del tokens[bisect.bisect_left(tokens, token)]
+    for text in lines:
+      if text not in entries:
+        addresses = list(map(lambda e: e.lower(), self.emailManager.parseEmails(text)))
+        entry = AddressBookEntry(text, addresses)
+        entries[text] = entry
+        for token in self.getTokens(entry):
+          if isEmpty:
+            tokens.append(token)
+          else:
+            bisect.insort(tokens, token)
+    if isEmpty:
+      tokens.sort()
+  def getTokens(self, entry):
+    words = set(re.split("\\W+", entry.lowerText))
+    words.discard("")
+    return list(map(lambda word: (word, entry.text), words))
+
+  def getContactStore(self, accName):
+    if accName not in self.contactStores:
+      self.contactStores[accName] = ContactStore(accName)
+    return self.contactStores[accName]
+  def getContacts(self, accName):
+    if accName not in self.contacts:
+      try:
+        self.contacts[accName] = self.getContactStore(accName).getContacts()
+      except sqlite3.Error as e:
+        print("could not read contacts for " + accName + ": " + str(e))
+        self.contacts[accName] = {}
+    return self.contacts[accName]
+  def invalidateContacts(self, accName):
+    self.contacts.pop(accName, None)
+    self.staleAccNames.add(accName)
+  def addUsage(self, accName, addresses, usedTime):
+    addresses = sorted(set(map(lambda a: a.lower(), addresses)))
+    try:
+      self.getContactStore(accName).addUsage(addresses, usedTime)
+    except sqlite3.Error as e:
+      print("could not save contacts for " + accName + ": " + str(e))
+    self.invalidateContacts(accName)
+
+  def getScore(self, entry, contacts, now):
+    score = 0.0
+    for address in entry.addresses:
+      if address in contacts:
+        (name, sentCount, receivedCount, lastSeen) = contacts[address]
+        ageDays = max(0, now - lastSeen) / 86400.0
+        count = sentCount * CONTACT_SENT_WEIGHT + receivedCount
+        score += count * 0.5 ** (ageDays / ADDRESS_USAGE_HALF_LIFE_DAYS)
+    return score
+  def search(self, accName, text, limit):
+    queryWords = text.lower().split()
+    if len(queryWords) == 0 or accName == None:
+      return []
+    if accName not in self.entries:
+      self.updateAccount(accName, self.getLines(accName))
+    entries = self.entries[accName]
+    tokens = self.tokens[accName]
+
+    #every word of the query must start a word of the entry
+    prefixTexts = None
+    for queryWord in queryWords:
+      wordTexts = set()
+      i = bisect.bisect_left(tokens, (queryWord,))
+      while i < len(tokens) and tokens[i][0].startswith(queryWord):
+        wordTexts.add(tokens[i][1])
+        i += 1
+      if prefixTexts == None:
+        prefixTexts = wordTexts
+      else:
+        prefixTexts.intersection_update(wordTexts)
+    matches = list(map(lambda t: (True, entries[t]), prefixTexts))
+    if len(matches) < limit:
+      for entry in entries.values():
+        if entry.text not in prefixTexts:
+          if all(w in entry.lowerText for w in queryWords):
+            matches.append((False, entry))
+
+    contacts = self.getContacts(accName)
+    now = time.time()
+    ranked = heapq.nsmallest(limit, matches, key=lambda m:
+      (not m[0], -self.getScore(m[1], contacts, now), m[1].lowerText))
+    return list(map(lambda m: m[1].text, ranked))
+
+#header fields by uid, in an mmap-ed file of segments, each:
+#  magic, count, (uid, offset, length) table sorted by uid, field records
+#new uids above the high-water mark are appended as a new segment,
+#  the file is only rewritten when the uid list resets or there are too many segments
+class HeaderIndex():
+  MAGIC = b"QTEHIDX2"
+  PREAMBLE = struct.Struct("<8sI")
+  ENTRY = struct.Struct("<IQI")
+  FIELD_SEP = b"\0"
+
+  def __init__(self, accName, folderName, tracker):
+    folderDir = EMAIL_DIR + "/" + accName + "/" + folderName
+    self.headersDir = folderDir + "/headers"
+    self.indexFile = folderDir + "/" + HEADER_INDEX_FILE_NAME
+    self.tracker = tracker
+    self.mmap = None
+    self.segments = []
+    self.size = 0
+    self.maxUid = None
+    self.resetCount = None
+    self.lock = threading.Lock()
+    self.refreshLock = threading.Lock()
+    self.open()
+
+  def open(self):
+    with self.lock:
+      self.openUnlocked()
+  def openUnlocked(self):
+    self.close()
+    if not os.path.isfile(self.indexFile):
+      return
+    try:
+      f = open(self.indexFile, 'rb')
+      try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      finally:
+        f.close()
+    except (IOError, OSError, ValueError) as e:
+      print("could not map header index " + self.indexFile + ": " + str(e))
+      return
+
+    #(tablePos, count, minUid, maxUid) of each segment, ignoring any partial last one
+    segments = []
+    pos = 0
+    while pos + self.PREAMBLE.size <= len(mm):
+      (magic, count) = self.PREAMBLE.unpack_from(mm, pos)
+      tablePos = pos + self.PREAMBLE.size
+      if magic != self.MAGIC or count == 0 or tablePos + count * self.ENTRY.size > len(mm):
+        break
+      (minUid, firstOffset, firstLength) = self.ENTRY.unpack_from(mm, tablePos)
+      (maxUid, lastOffset, lastLength) = self.ENTRY.unpack_from(mm,
+        tablePos + (count - 1) * self.ENTRY.size)
+      if lastOffset + lastLength > len(mm):
+        break
+      segments.append((tablePos, count, minUid, maxUid))
+      pos = lastOffset + lastLength
+    if len(segments) == 0:
+      if mm[0:len(self.MAGIC)] == self.MAGIC:
+        print("ignoring malformed header index: " + self.indexFile)
+      mm.close()
+      return
+    self.mmap = mm
+    self.segments = segments
+    self.size = pos
+    self.maxUid = segments[-1][3]
+
+  def close(self):
+    if self.mmap != None:
+      self.mmap.close()
+    self.mmap = None
+    self.segments = []
+    self.size = 0
+    self.maxUid = None
+
+  def entryAt(self, tablePos, pos):
+    return self.ENTRY.unpack_from(self.mmap, tablePos + pos * self.ENTRY.size)
+
+  def lookup(self, uid):
+    with self.lock:
+      return self.lookupUnlocked(uid)
+  def lookupUnlocked(self, uid):
+    if self.mmap == None:
+      return None
+    uid = int(uid)
+    for (tablePos, count, minUid, maxUid) in self.segments:
+      if uid < minUid or uid > maxUid:
+        continue
+      lo = 0
+      hi = count
+      while lo < hi:
+        mid = (lo + hi) // 2
+        (midUid, offset, length) = self.entryAt(tablePos, mid)
+        if midUid < uid:
+          lo = mid + 1
+        elif midUid > uid:
+          hi = mid
+        else:
+          record = self.mmap[offset:offset+length]
+          return list(map(toStr, record.split(self.FIELD_SEP)))
+    return None
+
+  def readRecords(self):
+    records = {}
+    with self.lock:
+      if self.mmap != None:
+        for (tablePos, count, minUid, maxUid) in self.segments:
+          for pos in range(count):
+            (uid, offset, length) = self.entryAt(tablePos, pos)
+            records[uid] = self.mmap[offset:offset+length]
+    return records
+
+  #callers refresh the tracker first
+  def refresh(self):
+    with self.refreshLock:
+      snapshot = self.tracker.getSnapshot()
+      isReset = self.resetCount != None and self.resetCount != snapshot.resetCount
+      if self.mmap == None or isReset:
+        self.rebuild(snapshot.uids)
+      else:
+        #uids are newest first
+        newUids = []
+        for uid in snapshot.uids:
+          if uid <= self.maxUid:
+            break
+          newUids.append(uid)
+        if len(newUids) > 0:
+          self.append(newUids)
+      self.resetCount = snapshot.resetCount
+  def rebuild(self, uids):
+    #headers are never rewritten for a uid, so records already indexed are kept
+    oldRecords = self.readRecords()
+    records = {}
+    for uid in uids:
+      if uid in oldRecords:
+        records[uid] = oldRecords[uid]
+      else:
+        record = self.readRecord(uid)
+        if record != None:
+          records[uid] = record
+    tmpFile = self.indexFile + ".tmp"
+    try:
+      if len(records) == 0:
+        if os.path.isfile(self.indexFile):
+          os.remove(self.indexFile)
+      else:
+        f = open(tmpFile, 'wb')
+        f.write(self.formatSegment(records, 0))
+        f.close()
+        os.rename(tmpFile, self.indexFile)
+    except (IOError, OSError) as e:
+      print("could not write header index " + self.indexFile + ": " + str(e))
+    self.open()
+  def append(self, uids):
+    if len(self.segments) >= HEADER_INDEX_MAX_SEGMENTS:
+      self.rebuild(self.tracker.getSnapshot().uids)
+      return
+    records = {}
+    for uid in uids:
+      record = self.readRecord(uid)
+      if record != None:
+        records[uid] = record
+    if len(records) == 0:
+      return
+    try:
+      f = open(self.indexFile, 'r+b')
+      f.seek(self.size)
+      f.truncate()
+      f.write(self.formatSegment(records, self.size))
+      f.close()
+    except (IOError, OSError) as e:
+      print("could not append to header index " + self.indexFile + ": " + str(e))
+    self.open()
+  def readRecord(self, uid):
+    fields = readHeaderFile(self.headersDir + "/" + str(uid))
+    if fields == None:
+      return None
+    return self.FIELD_SEP.join(map(toBytes, fields))
+
+  def formatSegment(self, records, segmentPos):
+    uids = sorted(records.keys())
+    offset = segmentPos + self.PREAMBLE.size + len(uids) * self.ENTRY.size
+    table = []
+    for uid in uids:
+      table.append(self.ENTRY.pack(uid, offset, len(records[uid])))
+      offset += len(records[uid])
+    return (self.PREAMBLE.pack(self.MAGIC, len(uids))
+      + b"".join(table)
+      + b"".join(map(lambda uid: records[uid], uids)))
 
 class Controller(QObject):
   def __init__(self, emailManager,
     accountModel, folderModel, headerModel, configModel, filterButtonModel, notifierModel,
-    addressBookModel, fileListModel, fileInfoModel):
+    addressBookModel, fileListModel, fileInfoModel, logModel,
+    searchResultModel, searchSourceModel):
     QObject.__init__(self)
     self.fontScale = 1.0
     self.emailManager = emailManager
@@ -496,6 +1853,9 @@ class Controller(QObject):
     self.addressBookModel = addressBookModel
     self.fileListModel = fileListModel
     self.fileInfoModel = fileInfoModel
+    self.logModel = logModel
+    self.searchResultModel = searchResultModel
+    self.searchSourceModel = searchSourceModel
     self.initialPageName = "account"
     self.htmlMode = False
     self.configMode = None
@@ -505,14 +1865,64 @@ class Controller(QObject):
     self.header = None
     self.currentBodyText = None
     self.threads = []
-    self.currentHeaders = []
+    self.bodyPrefetcher = None
+    self.bodyPrefetchPendingUid = None
+    self.searchGenerations = {}
+    self.lastSearches = {}
+    self.searchFilterStrs = {}
+    self.globalSearchGeneration = 0
+    self.quickFilterText = ""
+    self.quickFilterTimer = QTimer()
+    self.quickFilterTimer.setSingleShot(True)
+    self.quickFilterTimer.setInterval(QUICK_FILTER_DELAY_MILLIS)
+    self.quickFilterTimer.timeout.connect(self.applyQuickFilter)
+    self.bodyGeneration = 0
+    self.bodyBox = None
+    self.pendingBodyChunks = []
+    self.renderedBodySize = 0
+    self.bodyRenderLimit = BODY_RENDER_LIMIT_DEFAULT
+    self.bodyChunkTimer = QTimer()
+    self.bodyChunkTimer.setSingleShot(True)
+    self.bodyChunkTimer.setInterval(BODY_CHUNK_INTERVAL_MILLIS)
+    self.bodyChunkTimer.timeout.connect(self.appendBodyChunk)
+    self.commandScheduler = CommandScheduler(emailManager.backend, COMMAND_WORKER_COUNT, logModel)
+    self.commandScheduler.queueDepthChanged.connect(self.queueDepthChanged)
+    self.pendingReadFlags = {}
+    self.readFlagSeq = 0
+    self.inFlightReadFlags = {}
+    self.readFlagTimer = QTimer()
+    self.readFlagTimer.setSingleShot(True)
+    self.readFlagTimer.setInterval(READ_FLAG_FLUSH_DELAY_MILLIS)
+    self.readFlagTimer.timeout.connect(self.flushReadFlags)
+    self.updatingAccounts = set()
+    self.queuedAccountUpdates = []
+    self.updateParallel = UPDATE_PARALLEL_DEFAULT
+    self.currentUids = []
+    self.unreadUids = set()
+    self.headerRecords = {}
+    self.headerGeneration = 0
+    self.headerLoader = None
+    self.headerRefreshPending = False
+    self.uidSnapshot = None
+    self.totalSize = 0
     self.headerFilters = []
     self.filterButtons = []
     self.setFilterButtons([])
-    self.addressBook = None
+    self.addressBookIndex = AddressBookIndex(self.emailManager)
     self.sendWindow = None
     self.counterBox = None
-    self.fileListDir = None
+    self.fileListText = None
+    self.dirListings = OrderedDict()
+    self.shownFileList = None
+    self.pendingFileListPaths = []
+    self.fileListTimer = QTimer()
+    self.fileListTimer.setSingleShot(True)
+    self.fileListTimer.setInterval(FILE_LIST_BATCH_INTERVAL_MILLIS)
+    self.fileListTimer.timeout.connect(self.appendFileListBatch)
+    self.headerModel.setHeaderFactory(self.createHeader)
+    self.cacheWatcher = None
+    self.contactHarvester = None
+    self.queuedHarvestAccNames = []
 
   @pyqtSlot(result=float)
   def getFontScale(self):
@@ -657,59 +2067,52 @@ class Controller(QObject):
     indentedBody = "\n".join(map(lambda line: "> " + line, lines)) + "\n"
     return bodyPrefix + indentedBody
 
-  @pyqtSlot(str, result=bool)
+  @pyqtSlot(str)
   def updateFileList(self, text):
-    oldDir = self.fileListDir
-    self.fileListDir = self.extractDir(text)
-    if oldDir == self.fileListDir:
-      print("filelist: skipping, same dir '" + str(self.fileListDir) + "'")
-      return False
+    self.fileListText = text
+    #show the cached listing right away, the lister re-checks its mtime
+    for dirPath in [text, os.path.dirname(text)]:
+      if dirPath != "" and os.path.normpath(dirPath) in self.dirListings:
+        dirPath = os.path.normpath(dirPath)
+        self.showFileList(self.dirListings[dirPath])
+        break
+    lister = DirListThread(text, self.dirListings)
+    lister.dirListed.connect(self.onDirListed)
+    lister.finished.connect(lambda: self.threads.remove(lister))
+    self.threads.append(lister)
+    lister.start()
+  def onDirListed(self, text, dirListing):
+    if dirListing != None:
+      self.dirListings[dirListing.dirPath] = dirListing
+      self.dirListings.move_to_end(dirListing.dirPath)
+      while len(self.dirListings) > FILE_LIST_CACHE_MAX_DIRS:
+        self.dirListings.popitem(last=False)
+    if text == self.fileListText:
+      self.showFileList(dirListing)
+  def showFileList(self, dirListing):
+    text = self.fileListText
+    if self.shownFileList == (dirListing, text):
+      return
+    self.shownFileList = (dirListing, text)
+    self.fileListTimer.stop()
+
+    if dirListing == None:
+      paths = []
     else:
-      items = []
-      if self.fileListDir != None:
-        for f in self.listDir(self.fileListDir):
-          items.append(Suggestion(f, self))
-
-      if len(items) == 0:
-        if len(self.fileListModel.getItems()) == 0:
-          print("filelist: skipping, suggestions empty now and were empty")
-          return False
-        else:
-          print("filelist: clearing")
-          self.fileListModel.clear()
-          return False
-      else:
-        print("filelist: adding " + str(len(items)) + " items")
-        self.fileListModel.setItems(items)
-        return True
-  def extractDir(self, filePath):
-    try:
-      dirPath = os.path.dirname(filePath)
-      if os.path.isdir(filePath):
-        return filePath
-      elif os.path.isdir(dirPath):
-        return dirPath
-      else:
-        return None
-    except:
-      print("FAILED TO EXTRACT DIR: " + path)
-      return None
-  def listDir(self, dirPath):
-    try:
-      dirs = []
-      files = []
-      ls = os.listdir(dirPath)
-      ls.sort()
-      for f in ls:
-        path = os.path.join(dirPath, f)
-        if os.path.isdir(path):
-          dirs.append(path + os.sep)
-        else:
-          files.append(path)
-      return dirs + files
-    except:
-      print("FAILED TO LIST DIR: " + path)
-      return None
+      paths = list(filter(lambda path: path.startswith(text), dirListing.paths))
+    if len(paths) == 0 and len(self.fileListModel.getItems()) == 0:
+      return
+    firstPaths = paths[0:FILE_LIST_FIRST_BATCH_SIZE]
+    self.fileListModel.setItems(list(map(lambda path: Suggestion(path, self), firstPaths)))
+    self.pendingFileListPaths = paths[FILE_LIST_FIRST_BATCH_SIZE:]
+    if len(self.pendingFileListPaths) > 0:
+      self.fileListTimer.start()
+  def appendFileListBatch(self):
+    paths = self.pendingFileListPaths[0:FILE_LIST_BATCH_SIZE]
+    self.pendingFileListPaths = self.pendingFileListPaths[FILE_LIST_BATCH_SIZE:]
+    self.fileListModel.appendItems(list(map(lambda path: Suggestion(path, self), paths)))
+    if len(self.pendingFileListPaths) > 0:
+      self.fileListTimer.start()
 
   @pyqtSlot(QObject)
   def sendEmail(self, sendForm):
@@ -730,6 +2133,7 @@ class Controller(QObject):
     if self.accountName == None:
       self.notifierModel.notify("no FROM account selected\n")
       return
+    recipients = self.emailManager.parseEmails(" ".join(to + cc + bcc))
     firstTo = to.pop(0)
 
     self.notifierModel.notify("sending...", False)
@@ -743,18 +2147,71 @@ class Controller(QObject):
     for att in attachments:
       cmd += ["--attach", att]
 
-    self.startEmailCommandThread(cmd, None,
-      self.onSendEmailFinished, {})
+    self.startEmailCommand(cmd, self.onSendEmailFinished,
+      {"accName": self.accountName, "recipients": recipients},
+      COMMAND_PRIORITY_INTERACTIVE)
+  def harvestContacts(self, accNames=None):
+    if accNames == None:
+      accNames = list(map(lambda acc: acc.Name, self.accountModel.getItems()))
+    for accName in accNames:
+      if accName not in self.queuedHarvestAccNames:
+        self.queuedHarvestAccNames.append(accName)
+    if self.contactHarvester == None:
+      self.startContactHarvester()
+  def startContactHarvester(self):
+    accNames = self.queuedHarvestAccNames
+    self.queuedHarvestAccNames = []
+    if len(accNames) == 0:
+      return
+    ownAddresses = {}
+    for accName in accNames:
+      user = self.emailManager.readConfig("account", accName).get("user", "")
+      ownAddresses[accName] = user.lower()
+    self.contactHarvester = ContactHarvestThread(self.emailManager, accNames, ownAddresses)
+    self.contactHarvester.contactsHarvested.connect(self.onContactsHarvested)
+    self.contactHarvester.finished.connect(self.onContactHarvesterFinished)
+    self.contactHarvester.start()
+  def onContactsHarvested(self, accName):
+    self.addressBookIndex.invalidateContacts(accName)
+  def onContactHarvesterFinished(self):
+    self.contactHarvester = None
+    self.startContactHarvester()
+
   def onSendEmailFinished(self, isSuccess, output, extraArgs):
     if not isSuccess:
       self.notifierModel.notify("\nFAILED\n\n" + output, False)
     else:
       self.notifierModel.notify("\nSUCCESS\n\n" + output, False)
+      self.addressBookIndex.addUsage(
+        extraArgs["accName"], extraArgs["recipients"], time.time())
 
   @pyqtSlot()
   def setupAccounts(self):
     self.accountModel.setItems(self.emailManager.getAccounts())
     self.ensureAccountModelSelected()
+    if self.cacheWatcher != None:
+      self.watchAccounts()
+  def watchAccounts(self):
+    if self.cacheWatcher == None:
+      self.cacheWatcher = CacheWatcher()
+      self.cacheWatcher.cacheChanged.connect(self.onCacheChanged)
+    sources = []
+    for acc in self.accountModel.getItems():
+      folderNames = list(map(lambda f: f.Name, self.emailManager.getFolders(acc.Name)))
+      sources.append((acc.Name, folderNames))
+    self.cacheWatcher.setSources(sources)
+  def onCacheChanged(self, changedSources):
+    self.refreshAccountLabels()
+    for (accName, folderName) in changedSources:
+      if accName != self.accountName or folderName == None:
+        continue
+      for folder in self.folderModel.getItems():
+        if folder.Name == folderName:
+          folder.refresh(
+            self.emailManager.readUidFileCount(accName, folderName, "unread"),
+            self.emailManager.readUidFileCount(accName, folderName, "all"))
+      if folderName == self.folderName:
+        self.ensureHeadersUpToDate()
   @pyqtSlot()
   def refreshAccountLabels(self):
     labels = self.accountModel.getItems()
@@ -776,12 +2233,116 @@ class Controller(QObject):
   @pyqtSlot()
   def setupHeaders(self):
     self.headerFilters = []
-    (total, headers) = self.emailManager.fetchHeaders(
-      self.accountName, self.folderName,
-      limit=PAGE_INITIAL_SIZE, limitWithoutUnread=PAGE_INITIAL_WITHOUT_UNREAD_SIZE,
-      exclude=[], minUid=None)
+    self.searchFilterStrs = {}
+    self.headerGeneration += 1
+    self.cancelHeaderLoader()
+    self.headerRefreshPending = False
+    self.headerModel.resetCache()
+    self.headerRecords = {}
+    self.unreadUids = set()
+    self.uidSnapshot = None
+    if self.accountName == None or self.folderName == None:
+      self.setHeaders([])
+      return
+    folderCache = self.emailManager.getFolderCache(self.accountName, self.folderName)
+    self.headerRecords = folderCache.records
+    if folderCache.isLoaded():
+      self.uidSnapshot = folderCache.tracker.getSnapshot()
+      self.unreadUids = set(self.uidSnapshot.unread)
+      self.setHeaders(self.uidSnapshot.uids)
+      if not folderCache.isUpToDate(self.uidSnapshot):
+        self.startHeaderLoader(HeaderLoaderThread.MODE_REFRESH)
+      return
+    self.setHeaders([])
+    self.startHeaderLoader(HeaderLoaderThread.MODE_LOAD)
+  def preloadInboxes(self):
+    accNames = list(map(lambda acc: acc.Name, self.accountModel.getItems()))
+    preloader = HeaderPreloadThread(self.emailManager, accNames, "inbox")
+    preloader.finished.connect(lambda: self.threads.remove(preloader))
+    self.threads.append(preloader)
+    preloader.start()
+  #a newer window supersedes the running prefetch, it starts once that one stops
+  def prefetchBodies(self, uid):
+    if self.bodyPrefetcher != None:
+      self.bodyPrefetcher.cancel()
+      self.bodyPrefetchPendingUid = uid
+      return
+    row = self.headerModel.getRow(uid)
+    if row == None:
+      return
+    uids = self.headerModel.getUids()
+    firstRow = max(0, row - BODY_PREFETCH_COUNT)
+    lastRow = min(len(uids) - 1, row + BODY_PREFETCH_COUNT)
+    prefetchUids = uids[row+1:lastRow+1] + uids[firstRow:row]
+    if len(prefetchUids) == 0:
+      return
+    prefetcher = BodyPrefetchThread(self.emailManager,
+      self.accountName, self.folderName, prefetchUids, self.htmlMode)
+    prefetcher.finished.connect(lambda: self.onBodyPrefetchFinished(prefetcher))
+    self.bodyPrefetcher = prefetcher
+    self.threads.append(prefetcher)
+    prefetcher.start()
+  def onBodyPrefetchFinished(self, prefetcher):
+    self.threads.remove(prefetcher)
+    if self.bodyPrefetcher == prefetcher:
+      self.bodyPrefetcher = None
+      if self.bodyPrefetchPendingUid != None:
+        uid = self.bodyPrefetchPendingUid
+        self.bodyPrefetchPendingUid = None
+        self.prefetchBodies(uid)
+  def startHeaderLoader(self, mode):
+    loader = HeaderLoaderThread(self.emailManager, mode,
+      self.headerGeneration, self.accountName, self.folderName, self.uidSnapshot)
+    loader.headersLoaded.connect(self.onHeadersLoaded)
+    loader.headersRefreshed.connect(self.onHeadersRefreshed)
+    loader.finished.connect(lambda: self.onHeaderLoaderFinished(loader))
+    self.headerLoader = loader
+    self.threads.append(loader)
+    loader.start()
+  def cancelHeaderLoader(self):
+    if self.headerLoader != None:
+      self.headerLoader.cancel()
+    self.headerLoader = None
+  def onHeaderLoaderFinished(self, loader):
+    self.threads.remove(loader)
+    if self.headerLoader == loader:
+      self.headerLoader = None
+      if self.headerRefreshPending:
+        self.headerRefreshPending = False
+        self.ensureHeadersUpToDate()
+  def onHeadersLoaded(self, generation, total, uids, snapshot):
+    if generation != self.headerGeneration:
+      return
+    if snapshot != None:
+      self.uidSnapshot = snapshot
+      self.unreadUids = set(snapshot.unread)
+    self.appendHeaders(uids)
     self.totalSize = total
-    self.setHeaders(headers)
+    self.updateCounterBox()
+  def onHeadersRefreshed(self, generation, delta):
+    if generation != self.headerGeneration:
+      return
+    self.uidSnapshot = delta.snapshot
+    self.updateUnreadUids(delta.unreadUids, delta.unreadChanged)
+    if delta.isReset:
+      self.setHeaders(delta.snapshot.uids)
+    elif len(delta.newUids) > 0:
+      self.prependHeaders(delta.newUids)
+    if delta.isReset or len(delta.newUids) > 0:
+      self.rerunSearchFilters()
+  def createHeader(self, uid):
+    header = None
+    fields = self.headerRecords.get(uid)
+    if fields != None:
+      (hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject) = fields
+      header = Header(uid, hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject, False, False, False)
+    else:
+      header = self.emailManager.getHeader(self.accountName, self.folderName, uid)
+    if header == None:
+      header = Header(uid, "", "", "", "", "", "", False, False, False)
+    header.isSent_ = self.folderName == "sent"
+    header.read_ = not uid in self.unreadUids
+    return header
   @pyqtSlot(str)
   def setConfigMode(self, mode):
     self.configMode = mode
@@ -832,6 +2393,7 @@ class Controller(QObject):
   @pyqtSlot(QObject)
   def headerSelected(self, header):
     self.setHeader(header)
+    self.prefetchBodies(header.Uid)
   @pyqtSlot()
   def clearAccount(self):
     self.reset()
@@ -841,21 +2403,15 @@ class Controller(QObject):
       account.setSelected(account.Name == self.accountName)
 
   def ensureAddressBook(self):
-    if self.addressBook == None:
-      self.addressBook = self.emailManager.getAddressBook()
-
-    if self.addressBook != None and self.accountName in self.addressBook:
-      accEmails = self.addressBook[self.accountName]
-    else:
-      accEmails = None
-
-    if accEmails == None or len(accEmails) == 0:
-      self.addressBookModel.clear()
-    else:
-      items = []
-      for emailAddress in accEmails:
-        items.append(Suggestion(emailAddress, self))
-      self.addressBookModel.setItems(items)
+    self.addressBookIndex.refresh()
+    self.addressBookModel.clear()
+  @pyqtSlot(str)
+  def updateAddressSuggestions(self, text):
+    self.addressBookIndex.refresh()
+    suggestions = self.addressBookIndex.search(
+      self.accountName, text, ADDRESS_SUGGESTION_LIMIT)
+    items = list(map(lambda suggestion: Suggestion(suggestion, self), suggestions))
+    self.addressBookModel.setItems(items)
 
   @pyqtSlot(str, result=str)
   def getAccountConfigValue(self, configKey):
@@ -922,22 +2478,27 @@ class Controller(QObject):
     self.filterButtons += filterButtons
     self.filterButtonModel.setItems(self.filterButtons)
 
-  def filterHeader(self, header):
+  def filterUids(self, uids):
+    if len(self.headerFilters) == 0:
+      return list(uids)
+    mask = None
     for f in self.headerFilters:
-      if not f.filterHeader(header):
-        return False
-    return True
+      filterMask = int.from_bytes(f.getMask(uids, self.unreadUids), 'big')
+      mask = filterMask if mask == None else mask & filterMask
+    return list(itertools.compress(uids, mask.to_bytes(len(uids), 'big')))
 
   @pyqtSlot(str, str, bool)
   def replaceHeaderFilterStr(self, name, headerFilterStr, isNegated):
     headerFilterStr = headerFilterStr.strip()
     attMatch = regexMatch("^(read)=(true|false)$", headerFilterStr, re.IGNORECASE)
-    headers = self.currentHeaders
+    uids = self.currentUids
+    searchGeneration = self.nextSearchGeneration(name)
 
-    if headerFilterStr == "" or len(headers) == 0:
+    if headerFilterStr == "" or len(uids) == 0:
       self.removeHeaderFilter(name)
       self.refreshHeaderFilters()
     elif attMatch:
+      self.searchFilterStrs.pop(name, None)
       negatedFmt = "[NEGATED] " if isNegated else ""
       print("att filter: " + headerFilterStr)
       att = attMatch.group(1)
@@ -953,16 +2514,46 @@ class Controller(QObject):
       self.replaceHeaderFilter(headerFilter)
       self.refreshHeaderFilters()
     else:
+      self.searchFilterStrs[name] = (headerFilterStr, isNegated)
       if isNegated:
         headerFilterStr = "!(" + headerFilterStr + ")"
       print("search filter: " + headerFilterStr)
-      minUid = None
-      maxUid = None
-      for header in headers:
-        if minUid == None or header.uid_ < minUid:
-          minUid = header.uid_
-        if maxUid == None or header.uid_ > maxUid:
-          maxUid = header.uid_
+      folderUids = self.emailManager.getUidTracker(self.accountName, self.folderName).getUids()
+      if len(folderUids) == 0:
+        folderUids = uids
+      minUid = min(folderUids)
+      maxUid = max(folderUids)
+      extraArgs = {"headerFilterName": name,
+        "headerGeneration": self.headerGeneration, "searchGeneration": searchGeneration}
+
+      query = buildSearchQuery(headerFilterStr)
+      if not queryHasBodyTerms(query):
+        #body terms are never cached, their results change as bodies are fetched
+        queryKey = None
+        if name in map(lambda filterButton: filterButton.Name, self.filterButtons):
+          queryKey = formatQueryKey(query)
+        self.commandScheduler.cancel("search:" + name)
+        extraArgs.update({"query": query, "minUid": minUid, "maxUid": maxUid})
+        refineUids = None
+        lastSearch = self.lastSearches.get(name)
+        if lastSearch != None:
+          (lastArgs, lastUids) = lastSearch
+          if (lastArgs["headerGeneration"] == self.headerGeneration
+            and lastArgs["minUid"] == minUid and lastArgs["maxUid"] == maxUid
+            and len(lastUids) <= SEARCH_REFINE_MAX_UIDS
+            and isQueryRefinement(lastArgs["query"], query)):
+            refineUids = lastUids
+        isCancelled = lambda: searchGeneration != self.searchGenerations.get(name)
+        searcher = HeaderSearchThread(self.emailManager, extraArgs,
+          self.accountName, self.folderName, query, queryKey, minUid, maxUid,
+          refineUids, isCancelled)
+        searcher.headersSearched.connect(self.onHeaderSearchFinished)
+        searcher.headersPaged.connect(self.onHeaderSearchPage)
+        searcher.finished.connect(lambda: self.threads.remove(searcher))
+        self.threads.append(searcher)
+        searcher.start()
+        return
+
       cmd = [EMAIL_SEARCH_BIN, "--search", "--folder="+self.folderName]
       if minUid != None:
         cmd += ["--minuid=" + str(minUid)]
@@ -970,9 +2561,60 @@ class Controller(QObject):
         cmd += ["--maxuid=" + str(maxUid)]
       cmd += [self.accountName, headerFilterStr]
       self.notifierModel.notify("searching: " + str(cmd), False)
-      self.startEmailCommandThread(cmd, None, self.onEmailSearchFinished, {"headerFilterName": name})
+      self.startEmailCommand(cmd, self.onEmailSearchFinished, extraArgs,
+        COMMAND_PRIORITY_SEARCH, "search:" + name, isCoalesced=True)
+  def nextSearchGeneration(self, name):
+    self.searchGenerations[name] = self.searchGenerations.get(name, 0) + 1
+    return self.searchGenerations[name]
+  def isSearchCurrent(self, extraArgs):
+    name = extraArgs["headerFilterName"]
+    return (extraArgs["headerGeneration"] == self.headerGeneration
+      and extraArgs["searchGeneration"] == self.searchGenerations.get(name))
+  def onHeaderSearchFinished(self, extraArgs, uids, errorMsg):
+    if not self.isSearchCurrent(extraArgs):
+      return
+    name = extraArgs["headerFilterName"]
+    if errorMsg != None:
+      self.notifierModel.notify("\nSEARCH FAILED\n\n" + errorMsg, False)
+      self.lastSearches.pop(name, None)
+      self.removeHeaderFilter(name)
+    else:
+      self.lastSearches[name] = (extraArgs, uids)
+      if extraArgs.get("isStreamed"):
+        return
+      self.replaceHeaderFilter(HeaderFilterWhitelist(name, uids))
+    self.refreshHeaderFilters()
+  def onHeaderSearchPage(self, extraArgs, uids, isFirstPage):
+    if not self.isSearchCurrent(extraArgs):
+      return
+    name = extraArgs["headerFilterName"]
+    if isFirstPage:
+      extraArgs["isStreamed"] = True
+      self.replaceHeaderFilter(HeaderFilterWhitelist(name, uids))
+      self.refreshHeaderFilters()
+      return
+    headerFilter = self.getHeaderFilter(name)
+    if headerFilter == None:
+      return
+    headerFilter.addUids(uids)
+    if self.headerLoader != None:
+      extraArgs["isStreamed"] = False
+    elif extraArgs["isStreamed"]:
+      #pages are newest first, like the rows already shown
+      #  the search covers the whole uid range, which may hold uids not in the view
+      (shownUids, shownUidSet) = extraArgs.get("shownUids", (None, None))
+      if shownUids is not self.currentUids:
+        shownUidSet = set(self.currentUids)
+        extraArgs["shownUids"] = (self.currentUids, shownUidSet)
+      uids = list(filter(shownUidSet.__contains__, uids))
+      newFilteredUids = self.filterUids(uids)
+      if len(newFilteredUids) > 0:
+        self.headerModel.appendItems(newFilteredUids)
+      self.updateCounterBox()
   def onEmailSearchFinished(self, isSuccess, output, extraArgs):
     self.notifierModel.hide()
+    if not self.isSearchCurrent(extraArgs):
+      return
     if not isSuccess:
       self.notifierModel.notify("\nSEARCH FAILED\n\n" + output, False)
       return
@@ -988,13 +2630,23 @@ class Controller(QObject):
       print("Error parsing filter string: " + str(e))
       self.removeHeaderFilter(name)
     self.refreshHeaderFilters()
+  def rerunSearchFilters(self):
+    for (name, (headerFilterStr, isNegated)) in list(self.searchFilterStrs.items()):
+      self.replaceHeaderFilterStr(name, headerFilterStr, isNegated)
   @pyqtSlot(str)
   def removeHeaderFilter(self, name):
+    self.nextSearchGeneration(name)
+    self.searchFilterStrs.pop(name, None)
     self.headerFilters = list(filter(lambda f: f.name != name, self.headerFilters))
   @pyqtSlot()
   def refreshHeaderFilters(self):
-    self.setHeaders(self.currentHeaders)
+    self.setHeaders(self.currentUids)
 
+  def getHeaderFilter(self, name):
+    for headerFilter in self.headerFilters:
+      if headerFilter.name == name:
+        return headerFilter
+    return None
   def replaceHeaderFilter(self, headerFilter):
     name = headerFilter.name
     self.headerFilters = list(filter(lambda f: f.name != name, self.headerFilters))
@@ -1005,112 +2657,305 @@ class Controller(QObject):
     for filterButton in self.filterButtonModel.getItems():
       filterButton.setChecked(False, False)
 
-  def setHeaders(self, headers):
-    self.currentHeaders = headers
-    filteredHeaders = list(filter(self.filterHeader, headers))
-    if len(filteredHeaders) == 0:
+  def setHeaders(self, uids):
+    self.currentUids = uids
+    self.totalSize = len(uids)
+    filteredUids = self.filterUids(uids)
+    if len(filteredUids) == 0:
       self.headerModel.clear()
     else:
-      self.headerModel.setItems(filteredHeaders)
+      self.headerModel.setItems(filteredUids)
     self.updateCounterBox()
-  def prependHeaders(self, headers):
-    newFilteredHeaders = list(filter(self.filterHeader, headers))
-    self.currentHeaders += headers
-    if len(newFilteredHeaders) > 0:
-      self.headerModel.prependItems(newFilteredHeaders)
+  def prependHeaders(self, uids):
+    newFilteredUids = self.filterUids(uids)
+    self.currentUids = uids + self.currentUids
+    self.totalSize = len(self.currentUids)
+    if len(newFilteredUids) > 0:
+      self.headerModel.prependItems(newFilteredUids)
     self.updateCounterBox()
-  def appendHeaders(self, headers):
-    newFilteredHeaders = list(filter(self.filterHeader, headers))
-    self.currentHeaders += headers
-    if len(newFilteredHeaders) > 0:
-      self.headerModel.appendItems(newFilteredHeaders)
+  def appendHeaders(self, uids):
+    newFilteredUids = self.filterUids(uids)
+    self.currentUids = self.currentUids + uids
+    self.totalSize = len(self.currentUids)
+    if len(newFilteredUids) > 0:
+      self.headerModel.appendItems(newFilteredUids)
     self.updateCounterBox()
 
   @pyqtSlot(str)
   def onSearchTextChanged(self, searchText):
-    self.replaceHeaderFilterStr("quick-filter", searchText, False)
+    self.quickFilterText = searchText
+    if searchText.strip() == "":
+      self.quickFilterTimer.stop()
+      self.applyQuickFilter()
+    else:
+      self.quickFilterTimer.start()
+  def applyQuickFilter(self):
+    self.replaceHeaderFilterStr("quick-filter", self.quickFilterText, False)
 
-  @pyqtSlot(QObject, QObject)
-  def updateAccount(self, messageBox, account):
+  @pyqtSlot(str)
+  def globalSearch(self, searchText):
+    self.globalSearchGeneration += 1
+    generation = self.globalSearchGeneration
+    self.searchResultModel.clear()
+    self.searchSourceModel.clear()
+    searchText = searchText.strip()
+    if searchText == "":
+      return
+
+    sources = []
+    for acc in self.emailManager.getAccounts():
+      for folder in self.emailManager.getFolders(acc.Name):
+        sources.append((acc.Name, folder.Name))
+    self.searchSourceModel.setItems(list(map(
+      lambda source: SearchSource(source[0], source[1]), sources)))
+
+    isCancelled = lambda: generation != self.globalSearchGeneration
+    sourcesLock = threading.Lock()
+    for i in range(min(GLOBAL_SEARCH_WORKER_COUNT, len(sources))):
+      searcher = GlobalSearchThread(self.emailManager, generation,
+        searchText, sources, sourcesLock, isCancelled)
+      searcher.sourcePaged.connect(self.onGlobalSearchPage)
+      searcher.sourceSearched.connect(self.onGlobalSearchSourceFinished)
+      searcher.finished.connect(lambda searcher=searcher: self.threads.remove(searcher))
+      self.threads.append(searcher)
+      searcher.start()
+  def onGlobalSearchPage(self, generation, accName, folderName, results):
+    if generation != self.globalSearchGeneration:
+      return
+    self.searchResultModel.insertSorted(list(map(
+      lambda result: SearchResult(accName, folderName, *result), results)))
+  def onGlobalSearchSourceFinished(self, generation, accName, folderName, count, errorMsg):
+    if generation != self.globalSearchGeneration:
+      return
+    source = self.searchSourceModel.getSource(accName, folderName)
+    if source != None:
+      source.setFinished(count, errorMsg)
+  @pyqtSlot(QObject)
+  def globalSearchResultSelected(self, result):
+    self.accountSelected(result.Account)
+    self.setFolderName(result.Folder)
+    self.setHeader(self.emailManager.getHeader(result.Account, result.Folder, result.Uid))
+
+  @pyqtSlot(QObject)
+  def updateAccount(self, account):
     if account == None:
-      accMsg = "ALL ACCOUNTS WITHOUT SKIP"
+      self.updateAllAccounts()
     else:
-      accMsg = account.Name
-    self.onAppendMessage(messageBox, "STARTING UPDATE FOR " + accMsg + "\n")
+      self.logModel.appendText("STARTING UPDATE FOR " + account.Name + "\n")
+      if account.Name in self.queuedAccountUpdates:
+        self.queuedAccountUpdates.remove(account.Name)
+      self.startAccountUpdate(account.Name)
+
+  def updateAllAccounts(self):
+    config = self.emailManager.getConfig()
+    if config == None:
+      self.logModel.appendText("STARTING UPDATE FOR ALL ACCOUNTS WITHOUT SKIP\n")
+      self.startEmailCommand([EMAIL_BIN, "--update"],
+        self.onUpdateAllAccountsFinished, {}, COMMAND_PRIORITY_UPDATE,
+        isLogged=True, captureOutput=False, isCoalesced=True)
+      return
+
+    accNames = []
+    for accName in config['accOrder']:
+      skip = config['accounts'][accName].get('skip', "")
+      if not regexMatch(r"^true$", skip, re.IGNORECASE):
+        accNames.append(accName)
+    self.logModel.appendText("STARTING UPDATE FOR " + ", ".join(accNames) + "\n")
+
+    self.updateParallel = UPDATE_PARALLEL_DEFAULT
+    parallel = config['options'].get('update_parallel', "")
+    if regexMatch(r"^\d+$", parallel) and int(parallel) > 0:
+      self.updateParallel = int(parallel)
+    self.commandScheduler.ensureWorkerCount(self.updateParallel + 1)
+
+    for accName in accNames:
+      if accName in self.updatingAccounts or accName in self.queuedAccountUpdates:
+        continue
+      self.queuedAccountUpdates.append(accName)
+      account = self.getAccountItem(accName)
+      if account != None:
+        account.setLoading(True)
+        account.setProgress("queued")
+    self.startQueuedAccountUpdates()
+  def onUpdateAllAccountsFinished(self, isSuccess, output, extraArgs):
+    self.setupAccounts()
+    if self.accountName != None:
+      self.ensureHeadersUpToDate()
+    self.harvestContacts()
 
+  def startQueuedAccountUpdates(self):
+    while len(self.queuedAccountUpdates) > 0:
+      if len(self.updatingAccounts) >= self.updateParallel:
+        break
+      self.startAccountUpdate(self.queuedAccountUpdates.pop(0))
+  def startAccountUpdate(self, accName):
+    self.updatingAccounts.add(accName)
+    account = self.getAccountItem(accName)
     if account != None:
       account.setLoading(True)
-
-    cmd = [EMAIL_BIN, "--update"]
+      account.setProgress("")
+
+    self.startEmailCommand([EMAIL_BIN, "--update", "--no-update-cmd", accName],
+      self.onUpdateAccountFinished, {"accName": accName}, COMMAND_PRIORITY_UPDATE,
+      isLogged=True, captureOutput=False,
+      logPrefix=accName + ": ", outputAction=self.onUpdateAccountOutput,
+      isCoalesced=True)
+  def onUpdateAccountOutput(self, line, extraArgs):
+    account = self.getAccountItem(extraArgs["accName"])
     if account != None:
-      cmd.append(account.Name)
-
-    self.startEmailCommandThread(cmd, messageBox,
-      self.onUpdateAccountFinished, {})
+      account.setProgress(line.strip())
   def onUpdateAccountFinished(self, isSuccess, output, extraArgs):
-    self.setupAccounts()
-    if self.accountName != None:
+    accName = extraArgs["accName"]
+    self.updatingAccounts.discard(accName)
+
+    account = self.getAccountItem(accName)
+    if account != None:
+      for acc in self.emailManager.getAccounts():
+        if acc.Name == accName:
+          account.refresh(
+            acc.LastUpdated,
+            acc.LastUpdatedRel,
+            acc.UpdateInterval,
+            acc.RefreshInterval,
+            acc.Unread,
+            acc.Total,
+            acc.Error)
+      account.setProgress("")
+      account.setLoading(accName in self.queuedAccountUpdates)
+    if accName == self.accountName:
       self.ensureHeadersUpToDate()
+    self.harvestContacts([accName])
+
+    self.startQueuedAccountUpdates()
+    if len(self.updatingAccounts) == 0 and len(self.queuedAccountUpdates) == 0:
+      self.setupAccounts()
+      #update_cmd runs once after all updates, not once per account
+      self.startEmailCommand([EMAIL_BIN, "--update-cmd"],
+        self.onUpdateCmdFinished, {}, COMMAND_PRIORITY_UPDATE,
+        isLogged=True, captureOutput=False)
+  def onUpdateCmdFinished(self, isSuccess, output, extraArgs):
+    if not isSuccess:
+      self.logModel.appendText("update_cmd FAILED\n")
+  def getAccountItem(self, accName):
+    for account in self.accountModel.getItems():
+      if account.Name == accName:
+        return account
+    return None
 
   @pyqtSlot()
   def markAllRead(self):
     if self.accountName == None:
       return
 
-    headerStates = []
     uids = []
-    for header in self.headerModel.getItems():
-      if not header.read_:
-        header.setLoading(True)
-        headerStates.append({'header': header, 'uid': header.uid_})
-        uids.append(str(header.uid_))
+    for uid in self.headerModel.getUids():
+      if uid in self.unreadUids:
+        uids.append(uid)
 
-    if len(uids) == 0:
-      return
+    for uid in uids:
+      self.queueReadFlag(uid, True)
+    if len(uids) > 0:
+      self.flushReadFlags()
 
-    cmd = [EMAIL_BIN, "--mark-read",
-      "--folder=" + self.folderName, self.accountName] + uids
+  @pyqtSlot(QObject)
+  def toggleRead(self, header):
+    self.queueReadFlag(header.uid_, not header.read_)
+    if not self.readFlagTimer.isActive():
+      self.readFlagTimer.start()
+
+  def queueReadFlag(self, uid, read):
+    oppositeKey = (self.accountName, self.folderName, not read)
+    if uid in self.pendingReadFlags.get(oppositeKey, set()):
+      self.pendingReadFlags[oppositeKey].discard(uid)
+      isPending = (self.accountName, self.folderName, uid) in self.inFlightReadFlags
+    else:
+      key = (self.accountName, self.folderName, read)
+      self.pendingReadFlags.setdefault(key, set()).add(uid)
+      isPending = True
+
+    if read:
+      self.unreadUids.discard(uid)
+    else:
+      self.unreadUids.add(uid)
+    header = self.headerModel.getCachedHeader(uid)
+    if header != None:
+      header.setLoading(isPending)
+      header.setRead(read)
 
-    self.startEmailCommandThread(cmd, None,
-      self.onMarkAllReadFinished, {
-        'accountName': self.accountName,
-        'folderName': self.folderName,
-        'headerStates': headerStates})
-  def onMarkAllReadFinished(self, isSuccess, output, extraArgs):
+  @pyqtSlot()
+  def flushReadFlags(self):
+    self.readFlagTimer.stop()
+    pendingReadFlags = self.pendingReadFlags
+    self.pendingReadFlags = {}
+
+    flush = {'remaining': 0}
+    for (accountName, folderName, read), uids in pendingReadFlags.items():
+      if len(uids) == 0:
+        continue
+      if read:
+        arg = "--mark-read"
+      else:
+        arg = "--mark-unread"
+      cmd = [EMAIL_BIN, arg,
+        "--folder=" + folderName, accountName] + list(map(str, sorted(uids)))
+
+      #the latest request for each uid, only that one may settle its state
+      self.readFlagSeq += 1
+      for uid in uids:
+        self.inFlightReadFlags[(accountName, folderName, uid)] = self.readFlagSeq
+
+      flush['remaining'] += 1
+      self.startEmailCommand(cmd,
+        self.onReadFlagsFinished, {
+          'accountName': accountName,
+          'folderName': folderName,
+          'read': read,
+          'uids': uids,
+          'seq': self.readFlagSeq,
+          'flush': flush},
+        COMMAND_PRIORITY_FLAGS)
+  def isReadFlagQueued(self, accountName, folderName, uid):
+    for read in [True, False]:
+      if uid in self.pendingReadFlags.get((accountName, folderName, read), set()):
+        return True
+    return False
+  def onReadFlagsFinished(self, isSuccess, output, extraArgs):
     accountName = extraArgs['accountName']
     folderName = extraArgs['folderName']
-    headerStates = extraArgs['headerStates']
+    read = extraArgs['read']
+    uids = extraArgs['uids']
+    seq = extraArgs['seq']
+    flush = extraArgs['flush']
 
-    if accountName == self.accountName and folderName == self.folderName:
-      for headerState in headerStates:
-        header = headerState['header']
-        if headerState['uid'] == header.uid_:
-          header.setLoading(False)
-          if isSuccess:
-            header.setRead(True)
+    if not isSuccess:
+      self.notifierModel.notify("ERROR: could not mark " + str(len(uids))
+        + " message(s) " + ("read" if read else "unread") + "\n")
 
-    self.setupAccounts()
+    #uids toggled again since are left to the later request
+    settledUids = []
+    for uid in uids:
+      key = (accountName, folderName, uid)
+      if self.inFlightReadFlags.get(key) == seq:
+        del self.inFlightReadFlags[key]
+        if not self.isReadFlagQueued(accountName, folderName, uid):
+          settledUids.append(uid)
 
-  @pyqtSlot(QObject)
-  def toggleRead(self, header):
-    header.setLoading(True)
+    if accountName == self.accountName and folderName == self.folderName:
+      for uid in settledUids:
+        if not isSuccess:
+          if read:
+            self.unreadUids.add(uid)
+          else:
+            self.unreadUids.discard(uid)
+        header = self.headerModel.getCachedHeader(uid)
+        if header != None:
+          header.setLoading(False)
+          if not isSuccess:
+            header.setRead(not read)
 
-    if header.read_:
-      arg = "--mark-unread"
-    else:
-      arg = "--mark-read"
-    cmd = [EMAIL_BIN, arg,
-      "--folder=" + self.folderName, self.accountName, str(header.uid_)]
-
-    self.startEmailCommandThread(cmd, None,
-      self.onToggleReadFinished, {'header': header})
-  def onToggleReadFinished(self, isSuccess, output, extraArgs):
-    header = extraArgs['header']
-    header.isLoading_ = False
-    header.setLoading(False)
-    if isSuccess:
-      header.setRead(not header.read_)
-    self.setupAccounts()
+    flush['remaining'] -= 1
+    if flush['remaining'] == 0:
+      self.setupAccounts()
 
   @pyqtSlot(bool)
   def setHtmlMode(self, htmlMode):
@@ -1119,11 +2964,14 @@ class Controller(QObject):
 
   @pyqtSlot(QObject, QObject)
   def fetchCurrentBodyText(self, bodyBox, headerBox):
-    self.fetchCurrentBodyTextWithTransform(bodyBox, headerBox, None, False)
+    self.fetchCurrentBodyTextWithTransform(bodyBox, headerBox, None, False, True)
 
   def fetchCurrentBodyTextWithTransform(self, bodyBox, headerBox,
-      transform, forcePlain=False):
+      transform, forcePlain=False, isChunked=False):
     self.currentBodyText = None
+    self.bodyGeneration += 1
+    self.bodyChunkTimer.stop()
+    self.pendingBodyChunks = []
     bodyBox.setBody("...loading body")
     if self.header == None:
       self.notifierModel.notify("CURRENT MESSAGE NOT SET")
@@ -1139,35 +2987,109 @@ class Controller(QObject):
         + "    (uid: " + str(self.header.Uid) + ")\n"
       );
 
-    if self.htmlMode and not forcePlain:
+    isHtml = self.htmlMode and not forcePlain
+
+    renderLimit = BODY_RENDER_LIMIT_DEFAULT
+    config = self.emailManager.getConfig()
+    if config != None:
+      limit = config['options'].get('body_render_limit', "")
+      if regexMatch(r"^\d+$", limit):
+        renderLimit = int(limit)
+
+    extraArgs = {'bodyBox': bodyBox, 'transform': transform,
+      'isHtml': isHtml, 'isChunked': isChunked, 'renderLimit': renderLimit,
+      'bodyGeneration': self.bodyGeneration,
+      'bodyCacheKey': (self.accountName, self.folderName, self.header.Uid, isHtml)}
+
+    self.commandScheduler.cancel("body")
+    cachedBody = self.emailManager.getBodyCacheEntry(*extraArgs['bodyCacheKey'])
+    if cachedBody != None:
+      extraArgs['bodyCacheKey'] = None
+      self.onFetchCurrentBodyTextFinished(True, cachedBody, extraArgs)
+      return
+
+    #read and parse the cached body file off-thread, email.pl only if it is missing
+    self.startBodyPreparer(None, extraArgs)
+  def fetchBodyWithCommand(self, extraArgs):
+    (accName, folderName, uid, isHtml) = extraArgs['bodyCacheKey']
+    if isHtml:
       arg = "--body-html"
     else:
       arg = "--body-plain"
+    cmd = [EMAIL_BIN, arg, "--folder=" + folderName, accName, str(uid)]
 
-    cmd = [EMAIL_BIN, arg,
-      "--folder=" + self.folderName, self.accountName, str(self.header.Uid)]
-
-    self.startEmailCommandThread(cmd, None,
-      self.onFetchCurrentBodyTextFinished, {'bodyBox': bodyBox, 'transform': transform})
+    self.startEmailCommand(cmd,
+      self.onFetchCurrentBodyTextFinished, extraArgs,
+      COMMAND_PRIORITY_INTERACTIVE, "body", isCoalesced=True)
   def onFetchCurrentBodyTextFinished(self, isSuccess, output, extraArgs):
     bodyBox = extraArgs['bodyBox']
     transform = extraArgs['transform']
-    if transform:
-      body = transform(output)
-    else:
-      body = output
-
-    body = self.removeInlineCidImages(body)
+    if isSuccess and extraArgs['bodyCacheKey'] != None:
+      self.emailManager.putBodyCacheEntry(*(extraArgs['bodyCacheKey'] + (output,)))
 
-    if isSuccess:
-      self.currentBodyText = body
-      bodyBox.setBody(body)
-    else:
+    if not isSuccess:
       self.currentBodyText = None
       bodyBox.setBody("ERROR FETCHING BODY\n")
+      return
+
+    generation = extraArgs['bodyGeneration']
+    isHtml = extraArgs['isHtml']
+    if len(output) <= BODY_FIRST_CHUNK_SIZE:
+      body = prepareBody(output, transform, isHtml, extraArgs['renderLimit'])
+      self.onBodyPrepared(extraArgs, generation, body, [body])
+      return
+
+    self.startBodyPreparer(output, extraArgs)
+  def startBodyPreparer(self, body, extraArgs):
+    preparer = BodyPrepareThread(self.emailManager, extraArgs['bodyGeneration'], body,
+      extraArgs['transform'], extraArgs['isHtml'], extraArgs['isChunked'],
+      extraArgs['renderLimit'], extraArgs['bodyCacheKey'] if body == None else None)
+    preparer.bodyPrepared.connect(lambda generation, body, chunks:
+      self.onBodyPrepared(extraArgs, generation, body, chunks))
+    preparer.finished.connect(lambda: self.threads.remove(preparer))
+    self.threads.append(preparer)
+    preparer.start()
+  def onBodyPrepared(self, extraArgs, generation, body, chunks):
+    if generation != self.bodyGeneration:
+      return
+    if body == None:
+      self.fetchBodyWithCommand(extraArgs)
+      return
+    bodyBox = extraArgs['bodyBox']
+    self.currentBodyText = body
+    if len(chunks) == 1:
+      bodyBox.setBody(body)
+      return
 
-  def removeInlineCidImages(self, text):
-    return regexSub('src="cid:[^"]*"', '', text)
+    self.bodyRenderLimit = extraArgs['renderLimit']
+
+    #detect the format once for the whole body, not again for each appended chunk
+    self.bodyBox = bodyBox
+    bodyBox.setChunkedBody(chunks[0], Qt.mightBeRichText(chunks[0]))
+    self.renderedBodySize = len(chunks[0])
+    self.pendingBodyChunks = chunks[1:]
+    self.continueBodyChunks()
+  def continueBodyChunks(self):
+    if len(self.pendingBodyChunks) == 0:
+      self.bodyBox.setRemainingBodySize(0)
+    elif self.bodyRenderLimit == None or self.renderedBodySize < self.bodyRenderLimit:
+      self.bodyChunkTimer.start()
+    else:
+      remaining = sum(map(len, self.pendingBodyChunks))
+      self.bodyBox.setRemainingBodySize(remaining)
+  def appendBodyChunk(self):
+    if len(self.pendingBodyChunks) == 0:
+      return
+    chunk = self.pendingBodyChunks.pop(0)
+    self.bodyBox.appendBody(chunk)
+    self.renderedBodySize += len(chunk)
+    self.continueBodyChunks()
+  @pyqtSlot()
+  def loadRestOfBody(self):
+    if len(self.pendingBodyChunks) > 0:
+      self.bodyRenderLimit = None
+      self.bodyBox.setRemainingBodySize(0)
+      self.continueBodyChunks()
 
   @pyqtSlot(QObject)
   def copyBodyToClipboard(self, bodyView):
@@ -1193,8 +3115,8 @@ class Controller(QObject):
     cmd = [EMAIL_BIN, "--attachments",
       "--folder=" + self.folderName, self.accountName, destDir, str(self.header.Uid)]
 
-    self.startEmailCommandThread(cmd, None,
-      self.onSaveCurrentAttachmentsFinished, {})
+    self.startEmailCommand(cmd,
+      self.onSaveCurrentAttachmentsFinished, {}, COMMAND_PRIORITY_INTERACTIVE)
   def onSaveCurrentAttachmentsFinished(self, isSuccess, output, extraArgs):
     if output.strip() == "":
       output = "{no attachments}"
@@ -1203,75 +3125,50 @@ class Controller(QObject):
     else:
       self.notifierModel.notify("ERROR: saving attachments failed\n")
 
-  def startEmailCommandThread(self, command, messageBox, finishedAction, extraArgs):
-    print("starting command: " + str(command))
-    thread = EmailCommandThread(
+  def startEmailCommand(self, command, finishedAction, extraArgs,
+    priority, supersedeKey=None, isLogged=False, captureOutput=True,
+    logPrefix="", outputAction=None, isCoalesced=False):
+    self.commandScheduler.submit(CommandJob(
       command=command,
-      messageBox=messageBox,
       finishedAction=finishedAction,
-      extraArgs=extraArgs)
-    thread.finished.connect(lambda: self.onThreadFinished(thread))
-    thread.commandFinished.connect(self.onCommandFinished)
-    thread.setMessage.connect(self.onSetMessage)
-    thread.appendMessage.connect(self.onAppendMessage)
-    self.threads.append(thread)
-    thread.start()
-  def onThreadFinished(self, thread):
-    self.threads.remove(thread)
-  def onCommandFinished(self, isSuccess, output, finishedAction, extraArgs):
-    if finishedAction != None:
-      finishedAction(isSuccess, output, extraArgs)
-  def onSetMessage(self, messageBox, message):
-    if messageBox != None:
-      messageBox.setText(message)
-  def onAppendMessage(self, messageBox, message):
-    if messageBox != None:
-      oldText = messageBox.getText()
-      lines = oldText.splitlines()
-      maxLines = 500
-      if len(lines) > maxLines:
-        lines = lines[0-maxLines:]
-      oldText = "\n".join(lines) + "\n"
-      messageBox.setText(oldText + message)
-      messageBox.scrollToBottom()
+      extraArgs=extraArgs,
+      priority=priority,
+      supersedeKey=supersedeKey,
+      isLogged=isLogged,
+      captureOutput=captureOutput,
+      logPrefix=logPrefix,
+      outputAction=outputAction,
+      isCoalesced=isCoalesced))
 
   @pyqtSlot()
   def ensureHeadersUpToDate(self):
-    minUid = min(map(lambda header: header.Uid, self.currentHeaders))
-    (total, headers) = self.emailManager.fetchHeaders(
-      self.accountName, self.folderName,
-      limit=None, exclude=self.currentHeaders, minUid=minUid)
-    self.totalSize = total
-    self.prependHeaders(headers)
-
-  @pyqtSlot(int)
-  def moreHeaders(self, percentage):
-    if self.accountName == None:
+    if self.accountName == None or self.folderName == None:
       return
+    if self.headerLoader != None:
+      self.headerRefreshPending = True
+      return
+    self.startHeaderLoader(HeaderLoaderThread.MODE_REFRESH)
 
-    if percentage != None:
-      limit = int(self.totalSize * percentage / 100)
-    else:
-      limit = 0
-    if limit < PAGE_MORE_SIZE:
-      limit = PAGE_MORE_SIZE
-    (total, headers) = self.emailManager.fetchHeaders(
-      self.accountName, self.folderName,
-      limit=limit, exclude=self.currentHeaders, minUid=None)
-    self.totalSize = total
-    self.appendHeaders(headers)
+  def updateUnreadUids(self, unread, changedUids):
+    for uid in changedUids:
+      if uid in unread:
+        self.unreadUids.add(uid)
+      else:
+        self.unreadUids.discard(uid)
+      header = self.headerModel.getCachedHeader(uid)
+      if header != None:
+        header.setRead(uid not in unread)
 
   @pyqtSlot()
   def updateCounterBox(self):
     if self.counterBox == None:
       return
     totalLen = self.totalSize
-    curLen = len(self.currentHeaders)
-    showingLen = len(self.headerModel.getItems())
+    showingLen = self.headerModel.rowCount()
     msg = ""
-    if showingLen != curLen:
+    if showingLen != totalLen:
       msg += "(" + str(showingLen) + " showing)  "
-    msg += str(curLen) + " / " + str(totalLen)
+    msg += str(totalLen)
     self.counterBox.setCounterText(msg)
 
   def AccountName(self):
@@ -1280,68 +3177,532 @@ class Controller(QObject):
   def HtmlMode(self):
     return self.htmlMode
 
+  def QueueDepth(self):
+    return self.commandScheduler.getQueueDepth()
+
   accountNameChanged = pyqtSignal()
   AccountName = pyqtProperty(STR_TYPE, AccountName, notify=accountNameChanged)
   htmlModeChanged = pyqtSignal()
   HtmlMode = pyqtProperty(bool, HtmlMode, notify=htmlModeChanged)
+  queueDepthChanged = pyqtSignal()
+  QueueDepth = pyqtProperty(int, QueueDepth, notify=queueDepthChanged)
 
+#masks have one byte per uid, 1 to show and 0 to hide
 class HeaderFilter():
+  INVERT_MASK_TABLE = bytes.maketrans(b"\x00\x01", b"\x01\x00")
   def __init__(self, name):
     self.name = name
-  def filterHeader(self, header):
-    return True
+  def getMask(self, uids, unreadUids):
+    return b"\x01" * len(uids)
 
 class HeaderFilterWhitelist(HeaderFilter):
   def __init__(self, name, uids):
     HeaderFilter.__init__(self, name)
     self.name = name
     self.okUids = set(uids)
-  def filterHeader(self, header):
-    return header.uid_ in self.okUids
+    self.maskUids = None
+    self.mask = None
+  def addUids(self, uids):
+    self.okUids.update(uids)
+    self.maskUids = None
+  def getMask(self, uids, unreadUids):
+    if uids is not self.maskUids:
+      self.mask = bytes(map(self.okUids.__contains__, uids))
+      self.maskUids = uids
+    return self.mask
 
 class HeaderFilterAtt(HeaderFilter):
   def __init__(self, name, att, value):
     HeaderFilter.__init__(self, name)
     self.att = att
     self.value = value
-  def filterHeader(self, header):
+  def getMask(self, uids, unreadUids):
     if self.att == "read":
-      return header.read_ == self.value
+      unreadMask = bytes(map(unreadUids.__contains__, uids))
+      if self.value:
+        return unreadMask.translate(HeaderFilter.INVERT_MASK_TABLE)
+      else:
+        return unreadMask
+    return HeaderFilter.getMask(self, uids, unreadUids)
+
+
+class HeaderLoaderThread(QThread):
+  MODE_LOAD = "load"
+  MODE_REFRESH = "refresh"
+  headersLoaded = pyqtSignal(int, int, list, object)
+  headersRefreshed = pyqtSignal(int, object)
+  def __init__(self, emailManager, mode, generation, accName, folderName, snapshot):
+    QThread.__init__(self)
+    self.emailManager = emailManager
+    self.mode = mode
+    self.generation = generation
+    self.accName = accName
+    self.folderName = folderName
+    self.snapshot = snapshot
+    self.cancelled = False
+  def cancel(self):
+    self.cancelled = True
+  def run(self):
+    if self.mode == self.MODE_REFRESH:
+      delta = self.emailManager.updateFolderUids(self.accName, self.folderName, self.snapshot)
+      if not self.cancelled:
+        self.headersRefreshed.emit(self.generation, delta)
+      return
+
+    tracker = self.emailManager.getUidTracker(self.accName, self.folderName)
+    tracker.refresh()
+    snapshot = tracker.getSnapshot()
+    uids = snapshot.uids
+    total = len(uids)
+
+    firstUids = self.emailManager.loadFirstHeaders(self.accName, self.folderName)
+    if self.cancelled:
+      return
+    self.headersLoaded.emit(self.generation, total, firstUids, snapshot)
+
+    headerIndex = self.emailManager.getHeaderIndex(self.accName, self.folderName)
+    headerIndex.refresh()
+
+    for start in range(len(firstUids), total, HEADER_BATCH_SIZE):
+      if self.cancelled:
+        return
+      batch = uids[start:start+HEADER_BATCH_SIZE]
+      self.headersLoaded.emit(self.generation, total, batch, None)
+    self.emailManager.trimFolderCaches()
+
+class GlobalSearchThread(QThread):
+  sourcePaged = pyqtSignal(int, str, str, list)
+  sourceSearched = pyqtSignal(int, str, str, int, object)
+  def __init__(self, emailManager, generation, searchText, sources, sourcesLock, isCancelled):
+    QThread.__init__(self)
+    self.emailManager = emailManager
+    self.generation = generation
+    self.searchText = searchText
+    self.sources = sources
+    self.sourcesLock = sourcesLock
+    self.isCancelled = isCancelled
+  def run(self):
+    while not self.isCancelled():
+      with self.sourcesLock:
+        if len(self.sources) == 0:
+          return
+        (accName, folderName) = self.sources.pop(0)
+      try:
+        count = self.searchSource(accName, folderName)
+        errorMsg = None
+      except Exception as e:
+        count = 0
+        errorMsg = str(e)
+      if not self.isCancelled():
+        self.sourceSearched.emit(self.generation, accName, folderName, count, errorMsg)
+      self.emailManager.trimFolderCaches()
+  def searchSource(self, accName, folderName):
+    query = buildSearchQuery(self.searchText)
+    if queryHasBodyTerms(query):
+      request = self.emailManager.backend.run([EMAIL_SEARCH_BIN,
+        "--search", "--folder=" + folderName, accName, self.searchText])
+      if request.exitCode != 0:
+        raise Exception(request.getStderr())
+      uids = sorted(map(int, request.getStdout().splitlines()), reverse=True)
+      self.onPage(accName, folderName, uids, 0)
+      return len(uids)
+
+    tracker = self.emailManager.getUidTracker(accName, folderName)
+    tracker.refresh()
+    folderUids = tracker.getUids()
+    if len(folderUids) == 0:
+      return 0
+    pagedCounts = [0]
+    def onPage(uids, isFirstPage):
+      self.onPage(accName, folderName, uids, pagedCounts[0])
+      pagedCounts[0] += len(uids)
+    uids = self.emailManager.searchHeaders(accName, folderName, query,
+      min(folderUids), max(folderUids), self.isCancelled, None, onPage)
+    return 0 if uids == None else len(uids)
+  def onPage(self, accName, folderName, uids, pagedCount):
+    uids = uids[0:max(0, GLOBAL_SEARCH_SOURCE_LIMIT - pagedCount)]
+    if len(uids) == 0 or self.isCancelled():
+      return
+    results = []
+    for uid in uids:
+      fields = self.emailManager.getHeaderFields(accName, folderName, uid)
+      if fields != None:
+        (hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject) = fields
+        results.append((uid, hdrDate, hdrFrom, hdrSubject))
+    self.sourcePaged.emit(self.generation, accName, folderName, results)
+
+#reads only the uids above each folder's harvest progress, oldest first
+#  sent folder recipients are counted as sent-to, everything else as received-from
+class ContactHarvestThread(QThread):
+  contactsHarvested = pyqtSignal(str)
+  def __init__(self, emailManager, accNames, ownAddresses):
+    QThread.__init__(self)
+    self.emailManager = emailManager
+    self.accNames = accNames
+    self.ownAddresses = ownAddresses
+  def run(self):
+    for accName in self.accNames:
+      if not os.path.isdir(EMAIL_DIR + "/" + accName):
+        continue
+      contactStore = ContactStore(accName)
+      try:
+        isHarvested = False
+        for folder in self.emailManager.getFolders(accName):
+          if self.harvestFolder(contactStore, accName, folder.Name):
+            isHarvested = True
+          self.emailManager.trimFolderCaches()
+        if isHarvested:
+          self.contactsHarvested.emit(accName)
+      except Exception as e:
+        print("could not harvest contacts for " + accName + ": " + str(e))
+      finally:
+        contactStore.close()
+  def harvestFolder(self, contactStore, accName, folderName):
+    folderCache = self.emailManager.getFolderCache(accName, folderName)
+    folderCache.tracker.refresh()
+    folderCache.headerIndex.refresh()
+    allUids = sorted(folderCache.tracker.getUids())
+    (harvestedMaxUid, harvestedMinUid, harvestedCount) = contactStore.getHarvestProgress(folderName)
+    #uids only grow, so a lower first uid or more uids up to the harvested one means
+    #  the folder was renumbered, e.g.: after a UIDVALIDITY reset
+    if harvestedMinUid != None and len(allUids) > 0 and (allUids[0] < harvestedMinUid
+        or bisect.bisect_right(allUids, harvestedMaxUid) > harvestedCount):
+      print("uids renumbered in " + accName + "/" + folderName + ", harvesting again")
+      harvestedMaxUid = 0
+    uids = allUids[bisect.bisect_right(allUids, harvestedMaxUid):]
+    if len(uids) == 0:
+      #keep the renumbering check current after messages are removed
+      if len(allUids) > 0:
+        uidCount = bisect.bisect_right(allUids, harvestedMaxUid)
+        if (allUids[0], uidCount) != (harvestedMinUid, harvestedCount):
+          contactStore.addHarvest(folderName, harvestedMaxUid, allUids[0], uidCount, {})
+      return False
+    isSent = folderName == "sent"
+    ownAddress = self.ownAddresses.get(accName, "")
+    for i in range(0, len(uids), CONTACT_HARVEST_BATCH_SIZE):
+      batchUids = uids[i:i+CONTACT_HARVEST_BATCH_SIZE]
+      contacts = {}
+      for uid in batchUids:
+        fields = self.emailManager.getHeaderFields(accName, folderName, uid)
+        if fields == None:
+          continue
+        (hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject) = fields
+        if isSent:
+          addresses = email.utils.getaddresses([hdrTo, hdrCC, hdrBCC])
+        else:
+          addresses = email.utils.getaddresses([hdrFrom])
+        seen = parseHeaderDate(hdrDate)
+        for (name, address) in addresses:
+          address = address.lower()
+          if "@" not in address or address == ownAddress:
+            continue
+          (oldName, sentCount, receivedCount, lastSeen) = contacts.get(address, ("", 0, 0, 0))
+          if isSent:
+            sentCount += 1
+          else:
+            receivedCount += 1
+          contacts[address] = (name if name != "" else oldName,
+            sentCount, receivedCount, max(lastSeen, seen))
+      contactStore.addHarvest(folderName, batchUids[-1], allUids[0],
+        bisect.bisect_right(allUids, batchUids[-1]), contacts)
+    print("harvested contacts from " + str(len(uids)) + " headers in " + accName + "/" + folderName)
     return True
 
+class DirListing():
+  def __init__(self, dirPath, mtime, paths):
+    self.dirPath = dirPath
+    self.mtime = mtime
+    self.paths = paths
+
+#directories first, with a trailing separator, then files
+#  entry types come from scandir, so no extra stat per entry
+class DirListThread(QThread):
+  dirListed = pyqtSignal(str, object)
+  def __init__(self, text, dirListings):
+    QThread.__init__(self)
+    self.text = text
+    self.dirListings = dirListings
+  def run(self):
+    dirPath = self.extractDir(self.text)
+    if dirPath == None:
+      self.dirListed.emit(self.text, None)
+      return
+    dirPath = os.path.normpath(dirPath)
+    try:
+      mtime = os.stat(dirPath).st_mtime
+    except OSError:
+      mtime = None
+    dirListing = self.dirListings.get(dirPath)
+    if dirListing == None or dirListing.mtime != mtime:
+      dirListing = DirListing(dirPath, mtime, self.listDir(dirPath))
+    self.dirListed.emit(self.text, dirListing)
+  def extractDir(self, filePath):
+    try:
+      dirPath = os.path.dirname(filePath)
+      if os.path.isdir(filePath):
+        return filePath
+      elif os.path.isdir(dirPath):
+        return dirPath
+      else:
+        return None
+    except:
+      print("FAILED TO EXTRACT DIR: " + filePath)
+      return None
+  def listDir(self, dirPath):
+    dirs = []
+    files = []
+    try:
+      for entry in os.scandir(dirPath):
+        try:
+          isDir = entry.is_dir()
+        except OSError:
+          isDir = False
+        if isDir:
+          dirs.append(entry.path + os.sep)
+        else:
+          files.append(entry.path)
+    except OSError:
+      print("FAILED TO LIST DIR: " + dirPath)
+    return sorted(dirs) + sorted(files)
+
+class HeaderPreloadThread(QThread):
+  def __init__(self, emailManager, accNames, folderName):
+    QThread.__init__(self)
+    self.emailManager = emailManager
+    self.accNames = accNames
+    self.folderName = folderName
+  def run(self):
+    for accName in self.accNames:
+      self.emailManager.preloadFolder(accName, self.folderName)
+
+class HeaderSearchThread(QThread):
+  headersSearched = pyqtSignal(object, list, object)
+  headersPaged = pyqtSignal(object, list, bool)
+  def __init__(self, emailManager, extraArgs, accName, folderName, query, queryKey,
+    minUid, maxUid, refineUids, isCancelled):
+    QThread.__init__(self)
+    self.emailManager = emailManager
+    self.extraArgs = extraArgs
+    self.accName = accName
+    self.folderName = folderName
+    self.query = query
+    self.queryKey = queryKey
+    self.minUid = minUid
+    self.maxUid = maxUid
+    self.refineUids = refineUids
+    self.isCancelled = isCancelled
+  def run(self):
+    if self.isCancelled():
+      return
+    try:
+      if self.refineUids != None:
+        uids = self.emailManager.refineHeaderSearch(self.accName, self.folderName,
+          self.query, self.refineUids, self.isCancelled)
+      else:
+        uids = self.emailManager.searchHeaders(self.accName, self.folderName,
+          self.query, self.minUid, self.maxUid, self.isCancelled, self.queryKey,
+          self.onPage)
+    except Exception as e:
+      if not self.isCancelled():
+        self.headersSearched.emit(self.extraArgs, [], str(e))
+      return
+    if uids != None and not self.isCancelled():
+      self.headersSearched.emit(self.extraArgs, uids, None)
+  def onPage(self, uids, isFirstPage):
+    if not self.isCancelled():
+      self.headersPaged.emit(self.extraArgs, uids, isFirstPage)
+
+#with no body, reads it from the cache dir first, and emits None if it is not cached
+class BodyPrepareThread(QThread):
+  bodyPrepared = pyqtSignal(int, object, list)
+  def __init__(self, emailManager, generation, body, transform, isHtml, isChunked,
+      renderLimit, bodyCacheKey):
+    QThread.__init__(self)
+    self.emailManager = emailManager
+    self.generation = generation
+    self.body = body
+    self.transform = transform
+    self.isHtml = isHtml
+    self.isChunked = isChunked
+    self.renderLimit = renderLimit
+    self.bodyCacheKey = bodyCacheKey
+  def run(self):
+    body = self.body
+    if body == None:
+      body = self.emailManager.readCachedBody(*self.bodyCacheKey)
+      if body == None:
+        self.bodyPrepared.emit(self.generation, None, [])
+        return
+      self.emailManager.putBodyCacheEntry(*(self.bodyCacheKey + (body,)))
+    body = prepareBody(body, self.transform, self.isHtml, self.renderLimit)
+    if self.isChunked:
+      chunks = splitBodyChunks(body, self.isHtml)
+    else:
+      chunks = [body]
+    self.bodyPrepared.emit(self.generation, body, chunks)
 
-class EmailCommandThread(QThread):
-  commandFinished = pyqtSignal(bool, str, object, dict)
-  setMessage = pyqtSignal(QObject, str)
-  appendMessage = pyqtSignal(QObject, str)
-  def __init__(self, command, messageBox=None, finishedAction=None, extraArgs=None):
+class BodyPrefetchThread(QThread):
+  def __init__(self, emailManager, accName, folderName, uids, isHtml):
     QThread.__init__(self)
+    self.emailManager = emailManager
+    self.accName = accName
+    self.folderName = folderName
+    self.uids = uids
+    self.isHtml = isHtml
+    self.cancelled = False
+  def cancel(self):
+    self.cancelled = True
+  def run(self):
+    self.emailManager.prefetchBodies(self.accName, self.folderName, self.uids, self.isHtml,
+      lambda: self.cancelled)
+
+#only jobs with isCoalesced can be merged with an identical pending job,
+#  which must be safe for reads and updates, never for sends or flag changes
+class CommandJob():
+  def __init__(self, command, finishedAction, extraArgs, priority, supersedeKey,
+    isLogged, captureOutput, logPrefix, outputAction, isCoalesced):
     self.command = command
-    self.messageBox = messageBox
-    self.finishedAction = finishedAction
+    self.isCoalesced = isCoalesced
+    self.isLogged = isLogged
+    self.captureOutput = captureOutput
+    self.logPrefix = logPrefix
+    self.outputAction = outputAction
     self.extraArgs = extraArgs
-  def run(self):
-    proc = subprocess.Popen(self.command, stdout=subprocess.PIPE)
-    output = ""
+    self.callbacks = [(finishedAction, extraArgs)]
+    self.priority = priority
+    self.supersedeKey = supersedeKey
+    self.request = None
+    self.cancelled = False
+
+class CommandScheduler(QObject):
+  jobFinished = pyqtSignal(object, bool, str)
+  jobOutput = pyqtSignal(object, str)
+  queueDepthChanged = pyqtSignal()
+  def __init__(self, backend, workerCount, logModel):
+    QObject.__init__(self)
+    self.backend = backend
+    self.logModel = logModel
+    self.workerCount = workerCount
+    self.workers = []
+    self.pending = []
+    self.running = []
+    self.nextSeq = 0
+    self.cond = threading.Condition()
+    self.jobFinished.connect(self.onJobFinished)
+    self.jobOutput.connect(self.onJobOutput)
+
+  def getQueueDepth(self):
+    with self.cond:
+      return len(self.pending) + len(self.running)
+
+  def submit(self, job):
+    with self.cond:
+      for (_, _, pendingJob) in self.pending:
+        if job.isCoalesced and pendingJob.isCoalesced and pendingJob.command == job.command:
+          print("coalescing command: " + str(job.command))
+          pendingJob.callbacks += job.callbacks
+          return
+      if job.supersedeKey != None:
+        self.cancelJobs(job.supersedeKey)
+      heapq.heappush(self.pending, (job.priority, self.nextSeq, job))
+      self.nextSeq += 1
+      activeCount = len(self.pending) + len(self.running)
+      if len(self.workers) < min(self.workerCount, activeCount):
+        worker = threading.Thread(target=self.runWorker)
+        worker.daemon = True
+        self.workers.append(worker)
+        worker.start()
+      self.cond.notify()
+    self.queueDepthChanged.emit()
+
+  def cancel(self, supersedeKey):
+    with self.cond:
+      self.cancelJobs(supersedeKey)
+    self.queueDepthChanged.emit()
+
+  def ensureWorkerCount(self, workerCount):
+    with self.cond:
+      self.workerCount = max(self.workerCount, workerCount)
+
+  def cancelJobs(self, supersedeKey):
+    keep = []
+    for entry in self.pending:
+      if entry[2].supersedeKey == supersedeKey:
+        print("dropping superseded command: " + str(entry[2].command))
+        entry[2].cancelled = True
+      else:
+        keep.append(entry)
+    heapq.heapify(keep)
+    self.pending = keep
+    for job in self.running:
+      if job.supersedeKey == supersedeKey and not job.cancelled:
+        print("killing superseded command: " + str(job.command))
+        job.cancelled = True
+        if job.request != None:
+          job.request.kill()
+
+  def hasRunnableJob(self):
+    if len(self.pending) == 0:
+      return False
+    if self.pending[0][0] == COMMAND_PRIORITY_UPDATE:
+      updateCount = len(list(filter(
+        lambda job: job.priority == COMMAND_PRIORITY_UPDATE, self.running)))
+      return updateCount < self.workerCount - 1
+    return True
+
+  def runWorker(self):
     while True:
-      line = proc.stdout.readline()
-      if not line:
-         break
-      line = toStr(line)
-      self.appendMessage.emit(self.messageBox, line)
-      output += line
-    proc.wait()
+      with self.cond:
+        while not self.hasRunnableJob():
+          self.cond.wait()
+        (_, _, job) = heapq.heappop(self.pending)
+        self.running.append(job)
+      self.runJob(job)
+
+  def runJob(self, job):
+    print("starting command: " + str(job.command))
+    request = self.backend.start(job.command,
+      streamOutput=job.isLogged, keepOutput=job.captureOutput)
+    with self.cond:
+      job.request = request
+      cancelled = job.cancelled
+    if cancelled:
+      request.kill()
+
+    if job.isLogged:
+      for line in request.readLines():
+        if job.cancelled:
+          continue
+        line = toStr(line)
+        self.logModel.appendText(job.logPrefix + line)
+        if job.outputAction != None and line.strip() != "":
+          self.jobOutput.emit(job, line)
+    request.wait()
+    output = toStr(request.getStdout())
+
+    success = request.exitCode == 0
+    if job.isLogged and not job.cancelled:
+      if success:
+        self.logModel.appendText(job.logPrefix + "SUCCESS\n")
+      else:
+        self.logModel.appendText(job.logPrefix + "FAILURE\n")
 
-    if proc.returncode == 0:
-      success = True
-      status = "SUCCESS\n"
-    else:
-      success = False
-      status = "FAILURE\n"
+    with self.cond:
+      self.running.remove(job)
+      self.cond.notify_all()
+    self.jobFinished.emit(job, success, output)
 
-    self.appendMessage.emit(self.messageBox, status)
+  def onJobOutput(self, job, line):
+    if not job.cancelled:
+      job.outputAction(line, job.extraArgs)
 
-    self.commandFinished.emit(success, output, self.finishedAction, self.extraArgs)
+  def onJobFinished(self, job, success, output):
+    self.queueDepthChanged.emit()
+    if job.cancelled:
+      return
+    for (finishedAction, extraArgs) in job.callbacks:
+      if finishedAction != None:
+        finishedAction(success, output, extraArgs)
 
 class BaseListModel(QAbstractListModel):
   def __init__(self):
@@ -1384,9 +3745,7 @@ class BaseListModel(QAbstractListModel):
     self.items = []
   def removeRows(self, firstRow, rowCount, parent = QModelIndex()):
     self.beginRemoveRows(parent, firstRow, firstRow+rowCount-1)
-    while rowCount > 0:
-      del self.items[firstRow]
-      rowCount -= 1
+    del self.items[firstRow:firstRow+rowCount]
     self.endRemoveRows()
     self.changed.emit()
   changed = pyqtSignal()
@@ -1410,8 +3769,66 @@ class HeaderModel(BaseListModel):
   COLUMNS = (b'header',)
   def __init__(self):
     BaseListModel.__init__(self)
+    self.headerFactory = None
+    self.headerCache = {}
+    self.rowsByUid = None
+    self.viewFirstRow = 0
+    self.viewLastRow = 0
   def roleNames(self):
     return dict(enumerate(HeaderModel.COLUMNS))
+  def setHeaderFactory(self, headerFactory):
+    self.headerFactory = headerFactory
+  def resetCache(self):
+    self.headerCache = {}
+  def getUids(self):
+    return self.items
+  def getCachedHeader(self, uid):
+    return self.headerCache.get(uid)
+  def getRow(self, uid):
+    if self.rowsByUid == None:
+      self.rowsByUid = dict(zip(self.items, range(len(self.items))))
+    return self.rowsByUid.get(uid)
+  #rows the view may have delegates for, including its cacheBuffer
+  @pyqtSlot(int, int)
+  def setViewRange(self, firstRow, lastRow):
+    self.viewFirstRow = firstRow
+    self.viewLastRow = lastRow
+  def getHeader(self, row):
+    uid = self.items[row]
+    header = self.headerCache.get(uid)
+    if header == None:
+      header = self.headerFactory(uid)
+      self.headerCache[uid] = header
+      if len(self.headerCache) > HEADER_MODEL_CACHE_SIZE:
+        self.evictHeaders()
+    return header
+  #dropping the last reference deletes the QObject, so never evict a header
+  #  a delegate may still be bound to, allowing for delegates not yet destroyed
+  def evictHeaders(self):
+    minRow = self.viewFirstRow - HEADER_MODEL_EVICT_DISTANCE
+    maxRow = self.viewLastRow + HEADER_MODEL_EVICT_DISTANCE
+    for uid in list(self.headerCache.keys()):
+      header = self.headerCache[uid]
+      if header.selected_ or header.isLoading_:
+        continue
+      row = self.getRow(uid)
+      if row == None or row < minRow or row > maxRow:
+        del self.headerCache[uid]
+  def prependItems(self, items):
+    self.rowsByUid = None
+    BaseListModel.prependItems(self, items)
+  def appendItems(self, items):
+    self.rowsByUid = None
+    BaseListModel.appendItems(self, items)
+  def removeRows(self, firstRow, rowCount, parent = QModelIndex()):
+    self.rowsByUid = None
+    BaseListModel.removeRows(self, firstRow, rowCount, parent)
+  @pyqtSlot(int, result=QObject)
+  def get(self, index):
+    return self.getHeader(index)
+  def data(self, index, role):
+    if role == Qt.DisplayRole:
+      return self.getHeader(index.row())
 
 class ConfigModel(BaseListModel):
   COLUMNS = (b'config',)
@@ -1427,6 +3844,39 @@ class FilterButtonModel(BaseListModel):
   def roleNames(self):
     return dict(enumerate(FilterButtonModel.COLUMNS))
 
+class SearchResultModel(BaseListModel):
+  COLUMNS = (b'result',)
+  def __init__(self):
+    BaseListModel.__init__(self)
+    self.ascDates = []
+  def roleNames(self):
+    return dict(enumerate(SearchResultModel.COLUMNS))
+  def clear(self):
+    BaseListModel.clear(self)
+    self.ascDates = []
+  def insertSorted(self, results):
+    #newest first, after any results with the same date
+    for result in results:
+      row = len(self.ascDates) - bisect.bisect_left(self.ascDates, result.date_)
+      self.beginInsertRows(QModelIndex(), row, row)
+      self.items.insert(row, result)
+      bisect.insort(self.ascDates, result.date_)
+      self.endInsertRows()
+    if len(results) > 0:
+      self.changed.emit()
+
+class SearchSourceModel(BaseListModel):
+  COLUMNS = (b'source',)
+  def __init__(self):
+    BaseListModel.__init__(self)
+  def roleNames(self):
+    return dict(enumerate(SearchSourceModel.COLUMNS))
+  def getSource(self, accName, folderName):
+    for source in self.items:
+      if source.accName_ == accName and source.folderName_ == folderName:
+        return source
+    return None
+
 class AddressBookModel(BaseListModel):
   COLUMNS = (b'address',)
   def __init__(self):
@@ -1448,6 +3898,42 @@ class FileInfoModel(BaseListModel):
   def roleNames(self):
     return dict(enumerate(FileInfoModel.COLUMNS))
 
+class LogModel(BaseListModel):
+  COLUMNS = (b'line',)
+  linesQueued = pyqtSignal()
+  def __init__(self):
+    BaseListModel.__init__(self)
+    self.items = ["CONSOLE OUTPUT"]
+    self.queuedLines = []
+    self.queueLock = threading.Lock()
+    self.flushTimer = QTimer()
+    self.flushTimer.setSingleShot(True)
+    self.flushTimer.setInterval(LOG_FLUSH_INTERVAL_MILLIS)
+    self.flushTimer.timeout.connect(self.flushQueuedLines)
+    self.linesQueued.connect(self.onLinesQueued)
+  def roleNames(self):
+    return dict(enumerate(LogModel.COLUMNS))
+  def appendText(self, text):
+    lines = toStr(text).splitlines()
+    with self.queueLock:
+      wasEmpty = len(self.queuedLines) == 0
+      self.queuedLines.extend(lines)
+      if len(self.queuedLines) > LOG_MAX_LINES:
+        del self.queuedLines[0:len(self.queuedLines) - LOG_MAX_LINES]
+    if wasEmpty and len(lines) > 0:
+      self.linesQueued.emit()
+  def onLinesQueued(self):
+    if not self.flushTimer.isActive():
+      self.flushTimer.start()
+  def flushQueuedLines(self):
+    with self.queueLock:
+      lines = self.queuedLines
+      self.queuedLines = []
+    overflow = len(self.items) + len(lines) - LOG_MAX_LINES
+    if overflow > 0:
+      self.removeRows(0, min(overflow, len(self.items)))
+    self.appendItems(lines)
+
 
 class Account(QObject):
   def __init__(self, name_, lastUpdated_, lastUpdatedRel_, updateInterval_, refreshInterval_, unread_, total_, error_, isLoading_):
@@ -1461,6 +3947,7 @@ class Account(QObject):
     self.total_ = total_
     self.error_ = error_
     self.isLoading_ = isLoading_
+    self.progress_ = ""
     self.selected_ = False
   def Name(self):
     return self.name_
@@ -1480,6 +3967,8 @@ class Account(QObject):
     return self.error_
   def IsLoading(self):
     return self.isLoading_
+  def Progress(self):
+    return self.progress_
   def Selected(self):
     return self.selected_
   def refresh(self, lastUpdated_, lastUpdatedRel_, updateInterval_, refreshInterval_, unread_, total_, error_):
@@ -1494,6 +3983,9 @@ class Account(QObject):
   def setLoading(self, isLoading_):
     self.isLoading_ = isLoading_
     self.changed.emit()
+  def setProgress(self, progress_):
+    self.progress_ = progress_
+    self.changed.emit()
   def setSelected(self, selected_):
     self.selected_ = selected_
     self.changed.emit()
@@ -1507,6 +3999,7 @@ class Account(QObject):
   Total = pyqtProperty(int, Total, notify=changed)
   Error = pyqtProperty(STR_TYPE, Error, notify=changed)
   IsLoading = pyqtProperty(bool, IsLoading, notify=changed)
+  Progress = pyqtProperty(STR_TYPE, Progress, notify=changed)
   Selected = pyqtProperty(bool, Selected, notify=changed)
 
 class Folder(QObject):
@@ -1521,6 +4014,10 @@ class Folder(QObject):
     return self.unread_
   def Total(self):
     return self.total_
+  def refresh(self, unread_, total_):
+    self.unread_ = unread_
+    self.total_ = total_
+    self.changed.emit()
   changed = pyqtSignal()
   Name = pyqtProperty(STR_TYPE, Name, notify=changed)
   Unread = pyqtProperty(int, Unread, notify=changed)
@@ -1698,10 +4195,67 @@ class FileInfo(QObject):
   MtimeFmt = pyqtProperty(STR_TYPE, MtimeFmt, notify=changed)
   ErrorMsg = pyqtProperty(STR_TYPE, ErrorMsg, notify=changed)
 
+class SearchResult(QObject):
+  def __init__(self, accName_, folderName_, uid_, date_, from_, subject_):
+    QObject.__init__(self)
+    self.accName_ = accName_
+    self.folderName_ = folderName_
+    self.uid_ = uid_
+    self.date_ = date_
+    self.from_ = from_
+    self.subject_ = subject_
+  def Account(self):
+    return self.accName_
+  def Folder(self):
+    return self.folderName_
+  def Uid(self):
+    return self.uid_
+  def Date(self):
+    return self.date_
+  def From(self):
+    return self.from_
+  def Subject(self):
+    return self.subject_
+  changed = pyqtSignal()
+  Account = pyqtProperty(STR_TYPE, Account, notify=changed)
+  Folder = pyqtProperty(STR_TYPE, Folder, notify=changed)
+  Uid = pyqtProperty(int, Uid, notify=changed)
+  Date = pyqtProperty(STR_TYPE, Date, notify=changed)
+  From = pyqtProperty(STR_TYPE, From, notify=changed)
+  Subject = pyqtProperty(STR_TYPE, Subject, notify=changed)
+
+class SearchSource(QObject):
+  def __init__(self, accName_, folderName_):
+    QObject.__init__(self)
+    self.accName_ = accName_
+    self.folderName_ = folderName_
+    self.count_ = 0
+    self.isFinished_ = False
+    self.errorMsg_ = ""
+  def Name(self):
+    return self.accName_ + "/" + self.folderName_
+  def Count(self):
+    return self.count_
+  def IsFinished(self):
+    return self.isFinished_
+  def ErrorMsg(self):
+    return self.errorMsg_
+  def setFinished(self, count_, errorMsg_):
+    self.count_ = count_
+    self.isFinished_ = True
+    self.errorMsg_ = "" if errorMsg_ == None else errorMsg_
+    self.changed.emit()
+  changed = pyqtSignal()
+  Name = pyqtProperty(STR_TYPE, Name, notify=changed)
+  Count = pyqtProperty(int, Count, notify=changed)
+  IsFinished = pyqtProperty(bool, IsFinished, notify=changed)
+  ErrorMsg = pyqtProperty(STR_TYPE, ErrorMsg, notify=changed)
+
 class MainWindow(QQuickView):
   def __init__(self, qmlFile, controller,
     accountModel, folderModel, headerModel, configModel, filterButtonModel, notifierModel,
-    addressBookModel, fileListModel, fileInfoModel):
+    addressBookModel, fileListModel, fileInfoModel, logModel,
+    searchResultModel, searchSourceModel):
     super(MainWindow, self).__init__(None)
     context = self.rootContext()
     context.setContextProperty('accountModel', accountModel)
@@ -1713,6 +4267,9 @@ class MainWindow(QQuickView):
     context.setContextProperty('addressBookModel', addressBookModel)
     context.setContextProperty('fileListModel', fileListModel)
     context.setContextProperty('fileInfoModel', fileInfoModel)
+    context.setContextProperty('logModel', logModel)
+    context.setContextProperty('searchResultModel', searchResultModel)
+    context.setContextProperty('searchSourceModel', searchSourceModel)
     context.setContextProperty('controller', controller)
 
     self.setResizeMode(QQuickView.SizeRootObjectToView)
@@ -1725,7 +4282,8 @@ class MainWindow(QQuickView):
 class SendWindow(QQuickView):
   def __init__(self, qmlFile, controller, mainWindow,
     accountModel, folderModel, headerModel, configModel, filterButtonModel, notifierModel,
-    addressBookModel, fileListModel, fileInfoModel):
+    addressBookModel, fileListModel, fileInfoModel, logModel,
+    searchResultModel, searchSourceModel):
     super(SendWindow, self).__init__(None)
 
     context = self.rootContext()
@@ -1738,6 +4296,9 @@ class SendWindow(QQuickView):
     context.setContextProperty('addressBookModel', addressBookModel)
     context.setContextProperty('fileListModel', fileListModel)
     context.setContextProperty('fileInfoModel', fileInfoModel)
+    context.setContextProperty('logModel', logModel)
+    context.setContextProperty('searchResultModel', searchResultModel)
+    context.setContextProperty('searchSourceModel', searchSourceModel)
     context.setContextProperty('controller', controller)
 
     # copy MainWindow QObject properties into context *before* SendWindow QML initialization
@@ -1748,6 +4309,773 @@ class SendWindow(QQuickView):
     self.setSource(QUrl(qmlFile))
 
 
+def getHeaderFilePath(accName, folderName, uid):
+  return EMAIL_DIR + "/" + accName + "/" + folderName + "/" + "headers/" + str(uid)
+
+def getBodyFilePath(accName, folderName, uid, bodyDirName):
+  return EMAIL_DIR + "/" + accName + "/" + folderName + "/" + bodyDirName + "/" + str(uid)
+
+def readFileBytes(filePath):
+  try:
+    f = open(filePath, 'rb')
+    data = f.read()
+    f.close()
+    return data
+  except (IOError, OSError):
+    return None
+
+#same output as QtEmail::Body::getBody
+def formatMimeBody(data, preferHtml):
+  if PYTHON3:
+    msg = email.message_from_bytes(data)
+  else:
+    msg = email.message_from_string(data)
+
+  text = []
+  html = []
+  attNames = []
+  inlineAttNames = []
+  usedAttNames = set()
+  for part in msg.walk():
+    if part.is_multipart():
+      continue
+    contentType = part.get_content_type()
+    disposition = part.get("content-disposition", "")
+    if contentType == "text/plain" or contentType == "text/html":
+      payload = part.get_payload(decode=True)
+      if payload == None:
+        payload = b""
+      charset = part.get_content_charset() or "utf-8"
+      try:
+        payload = payload.decode(charset, "replace")
+      except LookupError:
+        payload = payload.decode("utf-8", "replace")
+      if contentType == "text/plain":
+        text.append(payload)
+      else:
+        html.append(payload)
+    elif "attachment" in disposition:
+      attNames.append(getMimeAttachmentName(part, usedAttNames))
+    elif "inline" in disposition:
+      inlineAttNames.append(getMimeAttachmentName(part, usedAttNames))
+
+  body = ""
+  for isHtml in ([True, False] if preferHtml else [False, True]):
+    fmt = "\n".join(html if isHtml else text)
+    if len(regexSub(r"\W+", "", fmt)) > 0:
+      body = fmt
+      break
+  body = body.replace("\r\n", "\n")
+  if body.endswith("\n"):
+    body = body[:-1]
+  if len(body) > 0:
+    body += "\n"
+
+  attFmt = ""
+  if len(attNames) > 0:
+    if preferHtml:
+      for attName in attNames:
+        attFmt += "<i>attachment: " + attName + "</i><br/>"
+      attFmt += "<br/>"
+    else:
+      for attName in attNames:
+        attFmt += "attachment: " + attName + "\n"
+      attFmt += "\n"
+  if len(inlineAttNames) > 0:
+    count = str(len(inlineAttNames))
+    if preferHtml:
+      attFmt += ("<small><i>inline-atts(" + count + "): "
+        + " ".join(inlineAttNames) + "</i></small><br/><br/>")
+    else:
+      attFmt += "inline-atts(" + count + "): " + " ".join(inlineAttNames) + "\n\n"
+
+  return attFmt + body
+
+#same file name MIME::Parser::Filer picks for a part, which getBody prints
+def getMimeAttachmentName(part, usedAttNames):
+  recommended = part.get_filename()
+  if recommended != None:
+    recommended = toStr(str(email.header.make_header(email.header.decode_header(recommended))))
+    if recommended.strip() == "":
+      recommended = None
+
+  attName = None
+  if recommended != None:
+    attName = exorciseMimeFileName(recommended)
+  if attName == None:
+    m = regexMatch(r'.*(\.\w+)$', recommended or "", flags=re.DOTALL)
+    ext = m.group(1) if m else ".dat"
+    attName = "msg-" + str(os.getpid()) + "-" + str(len(usedAttNames) + 1) + ext
+
+  suffixNum = 0
+  uniqueName = attName
+  while uniqueName in usedAttNames:
+    suffixNum += 1
+    uniqueName = regexSub(r'^(.*?)(\.|$)', r'\g<1>-' + str(suffixNum) + r'\2', attName, count=1)
+  usedAttNames.add(uniqueName)
+  return uniqueName
+
+def exorciseMimeFileName(fileName):
+  last = regexSub(r'^.*[/\\]', '', fileName, flags=re.DOTALL)
+  if len(last) > 0 and not isEvilMimeFileName(last):
+    return last
+  m = regexMatch(r'^(.*)\.([^.]+)$', last, flags=re.DOTALL)
+  if m:
+    (root, ext) = (m.group(1), m.group(2))
+  else:
+    (root, ext) = (last, "")
+  root = root[:14]
+  ext = ext[:3]
+  if not regexMatch(r'^[a-zA-Z0-9_]+$', ext):
+    ext = "dat"
+  trunc = root + "." + ext
+  if not isEvilMimeFileName(trunc):
+    return trunc
+  return None
+
+def isEvilMimeFileName(fileName):
+  if len(fileName) == 0 or regexMatch(r'^\.+$', fileName):
+    return True
+  if regexMatch(r'.*[\\/:\[\]]|.*[^\x20-\x7e]', fileName, flags=re.DOTALL):
+    return True
+  return fileName != fileName.strip()
+
+#only html bodies too big to render at once lose their styles and remote images
+def prepareBody(body, transform, isHtml, renderLimit):
+  if transform:
+    body = transform(body)
+  body = regexSub(r'src="cid:[^"]*"', '', body)
+  if isHtml and renderLimit != None and len(body) > renderLimit:
+    body = regexSub(r'<style[^>]*>.*?</style>', '', body, flags=re.DOTALL|re.IGNORECASE)
+    body = regexSub(r'<img[^>]*src=["\']?(?:cid:|https?:)[^>]*>', '', body, flags=re.IGNORECASE)
+    body = regexSub(r'\sstyle\s*=\s*("[^"]*"|\'[^\']*\')', '', body, flags=re.IGNORECASE)
+  return body
+
+#split plain text at line ends, since each chunk is appended as a paragraph
+#  html is split after block elements, closing the elements still open there
+#  and reopening them at the start of the next chunk
+def splitBodyChunks(body, isHtml):
+  if isHtml and Qt.mightBeRichText(body):
+    return splitHtmlBodyChunks(body)
+
+  chunks = []
+  start = 0
+  chunkSize = BODY_FIRST_CHUNK_SIZE
+  while start < len(body):
+    end = body.find("\n", start + chunkSize)
+    if end < 0:
+      chunks.append(body[start:])
+      break
+    chunks.append(body[start:end])
+    start = end + 1
+    chunkSize = BODY_CHUNK_SIZE
+  return chunks
+
+#never splits inside lists that number their items, preformatted text or head,
+#  a body with no such boundary stays in one chunk
+def splitHtmlBodyChunks(body):
+  chunks = []
+  openTags = []
+  chunkPrefix = ""
+  start = 0
+  chunkSize = BODY_FIRST_CHUNK_SIZE
+  tagRegex = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][a-zA-Z0-9]*)[^>]*>', re.DOTALL)
+  rawTextRegex = re.compile(r'</(script|style)\s*>', re.IGNORECASE)
+  pos = 0
+  while True:
+    m = tagRegex.search(body, pos)
+    if m == None:
+      break
+    pos = m.end()
+    if m.group(2) == None:
+      continue
+    isClose = m.group(1) == "/"
+    tag = m.group(2).lower()
+    if tag in ["html", "body"]:
+      continue
+    if not isClose and tag in ["script", "style"]:
+      rawEnd = rawTextRegex.search(body, pos)
+      pos = len(body) if rawEnd == None else rawEnd.end()
+      continue
+
+    if isClose:
+      for i in range(len(openTags)-1, -1, -1):
+        if openTags[i][0] == tag:
+          del openTags[i:]
+          break
+    elif tag not in BODY_HTML_VOID_TAGS and not m.group(0).endswith("/>"):
+      implicitClose = BODY_HTML_IMPLICIT_CLOSE.get(tag, set())
+      while len(openTags) > 0 and openTags[-1][0] in implicitClose:
+        openTags.pop()
+      openTags.append((tag, m.group(0)))
+
+    splitTag = "/" + tag if isClose else tag
+    if pos - start < chunkSize or splitTag not in BODY_HTML_SPLIT_AFTER_TAGS:
+      continue
+    if len(openTags) > 0 and not all(t[0] in BODY_HTML_REOPEN_TAGS for t in openTags):
+      continue
+
+    closeTags = "".join(map(lambda t: "</" + t[0] + ">", reversed(openTags)))
+    chunks.append(chunkPrefix + body[start:pos] + closeTags)
+    chunkPrefix = "".join(map(lambda t: t[1], openTags))
+    start = pos
+    chunkSize = BODY_CHUNK_SIZE
+
+  rest = body[start:]
+  if len(chunks) > 0 and regexSub(r'\s|</[^>]*>', '', rest) == "":
+    chunks[-1] += rest
+  elif len(rest) > 0 or len(chunks) == 0:
+    chunks.append(chunkPrefix + rest)
+  return chunks
+
+def parseHeaderDate(hdrDate):
+  try:
+    return time.mktime(time.strptime(hdrDate, "%Y-%m-%d %H:%M:%S"))
+  except (ValueError, OverflowError):
+    return 0
+
+def readHeaderFile(filePath):
+  if not os.path.isfile(filePath):
+    print("MISSING EMAIL HEADER: " + filePath)
+    return None
+  f = open(filePath, 'r')
+  header = f.read()
+  f.close()
+  hdrDate = ""
+  hdrFrom = ""
+  hdrTo = ""
+  hdrCC = ""
+  hdrBCC = ""
+  hdrSubject = ""
+  for line in header.split('\n'):
+    if line.strip() == "":
+      continue
+    m = regexMatch(r'(\w+): (.*)', line)
+    if not m:
+      print("MALFORMED HEADER FILE: " + filePath)
+      return None
+    field = m.group(1)
+    val = m.group(2)
+    if PYTHON2:
+      try:
+        val = val.encode('utf-8')
+      except:
+        val = val.decode('utf-8')
+
+    if field == "Date":
+      hdrDate = val
+    elif field == "From":
+      hdrFrom = val
+    elif field == "To":
+      hdrTo = val
+    elif field == "CC":
+      hdrCC = val
+    elif field == "BCC":
+      hdrBCC = val
+    elif field == "Subject":
+      hdrSubject = val
+  return [hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject]
+
+def statFile(filePath):
+  try:
+    st = os.stat(filePath)
+    return (st.st_size, st.st_mtime_ns)
+  except OSError:
+    return None
+
+def joinMultilineConfigEntries(lines):
+  entries = []
+  curEntry = ""
+  for line in lines:
+    isContinuation = regexMatch(r"^\s+", line) != None or curEntry.endswith("\\")
+    line = regexSub(r"(\s|\r|\n|\x00)+$", "", line)
+    if isContinuation:
+      if curEntry.endswith("\\"):
+        curEntry = curEntry[:-1]
+      curEntry += "\n" + line
+    else:
+      entries.append(curEntry)
+      curEntry = line
+  entries.append(curEntry)
+  return entries
+
+#same as Config.pm readConfig and validateConfig, keys must be in the schemas
+def parseConfigLines(lines, accountSchema, optionsSchema):
+  if len(accountSchema) == 0 or len(optionsSchema) == 0:
+    print("could not read config schema")
+    return None
+  accKeys = {'REQ': [], 'OPT': [], 'MAP': []}
+  for (key, desc) in accountSchema:
+    m = regexMatch(r"^\[(REQ|OPT|MAP)\]", desc)
+    if m:
+      accKeys[m.group(1)].append(key)
+  okAccKeys = "|".join(map(re.escape, accKeys['REQ'] + accKeys['OPT']))
+  if len(accKeys['MAP']) > 0:
+    okAccKeys += r"|(?:(?:" + "|".join(map(re.escape, accKeys['MAP'])) + r")\.\w+)"
+  okOptionsKeys = "|".join(map(lambda schemaEntry: re.escape(schemaEntry[0]), optionsSchema))
+
+  accounts = {}
+  accOrder = []
+  options = {}
+  for entry in joinMultilineConfigEntries(lines):
+    optionMatch = regexMatch(r"^" + CONFIG_PREFIX + r"\.(" + okOptionsKeys + r")\s*=\s*(.+)$",
+      entry)
+    accMatch = regexMatch(r"^" + CONFIG_PREFIX + r"\.(\w+)\.(" + okAccKeys + r")\s*=\s*(.+)$",
+      entry, re.DOTALL)
+    if optionMatch:
+      options[optionMatch.group(1)] = optionMatch.group(2)
+    elif accMatch:
+      accName = accMatch.group(1)
+      if accName not in accounts:
+        accounts[accName] = {'name': accName}
+        accOrder.append(accName)
+      val = accMatch.group(3)
+      if val.endswith("\n"):
+        val = val[:-1]
+      accounts[accName][accMatch.group(2)] = val
+    elif entry.startswith(CONFIG_PREFIX + "."):
+      print("unknown config entry: " + entry)
+      return None
+  for accName in accOrder:
+    for key in sorted(accKeys['REQ']):
+      if key not in accounts[accName]:
+        print("Missing '" + key + "' for '" + accName + "' in " + CONFIG_FILE)
+        return None
+  return {'accounts': accounts, 'accOrder': accOrder, 'options': options}
+
+#same grammar as email-search.pl buildQuery
+HEADER_SEARCH_FIELDS = ["date", "from", "subject", "to", "cc", "bcc"]
+
+def buildSearchQuery(queryStr):
+  quotes = {}
+  queryStr = escapeQueryStr(queryStr, quotes)
+  query = parseQueryStr(queryStr)
+  query = unescapeQuery(query, quotes)
+  query = reduceQuery(query)
+  return query
+
+def perlSplit(sep, string):
+  parts = string.split(sep)
+  while len(parts) > 0 and parts[-1] == "":
+    parts.pop()
+  return parts
+
+def parseQueryStr(queryStr):
+  if not re.search(r"\(.*\)", queryStr):
+    return parseFlatQueryStr(queryStr)
+
+  orGroups = []
+  parensGroups = []
+  cur = ""
+  parens = 0
+  isCurParensNegated = False
+  i = 0
+  while i < len(queryStr):
+    ch = queryStr[i]
+    nextCh = queryStr[i+1] if i+1 < len(queryStr) else ""
+    if ch == "!" and nextCh == "(":
+      if parens == 0:
+        parensGroups.append((cur, isCurParensNegated))
+        cur = ""
+        isCurParensNegated = True
+      else:
+        cur += ch + nextCh
+      i += 1
+      parens += 1
+    elif ch == "(":
+      if parens == 0:
+        parensGroups.append((cur, isCurParensNegated))
+        cur = ""
+        isCurParensNegated = False
+      else:
+        cur += ch
+      parens += 1
+    elif ch == ")":
+      parens -= 1
+      if parens == 0:
+        parensGroups.append((cur, isCurParensNegated))
+        cur = ""
+        isCurParensNegated = False
+      else:
+        cur += ch
+      if parens < 0:
+        parens = 0 #ignore unmatched ')'
+    elif ch == "|":
+      if parens == 0:
+        parensGroups.append((cur, isCurParensNegated))
+        cur = ""
+        isCurParensNegated = False
+        orGroups.append(parensGroups)
+        parensGroups = []
+      else:
+        cur += ch
+    else:
+      cur += ch
+    i += 1
+  parensGroups.append((cur, isCurParensNegated)) #ignore unmatched '('
+  orGroups.append(parensGroups)
+
+  outerQuery = {'type': "or", 'parts': []}
+  for orGroup in orGroups:
+    innerQuery = {'type': "and", 'parts': []}
+    for (parensGroup, isNegated) in orGroup:
+      if len(parensGroup) == 0:
+        continue
+      part = parseQueryStr(parensGroup)
+      if isNegated:
+        negateQuery(part)
+      innerQuery['parts'].append(part)
+    outerQuery['parts'].append(innerQuery)
+  return outerQuery
+
+def parseFlatQueryStr(flatQueryStr):
+  okHeaderFields = "|".join(HEADER_SEARCH_FIELDS)
+  outerQuery = {'type': "or", 'parts': []}
+  for orStr in perlSplit("|", flatQueryStr):
+    innerQuery = {'type': "and", 'parts': []}
+    for andStr in perlSplit("&", orStr):
+      headerMatch = re.search("(" + okHeaderFields + ")(!?)~(.*)", andStr, re.IGNORECASE)
+      bodyMatch = re.search(r"(body)(!?)~(.*)", andStr, re.IGNORECASE)
+      bodyPlainMatch = re.search(r"(b|bodyplain|bodytext|bodyplaintext|plain|plaintext)(!?)~(.*)",
+        andStr, re.IGNORECASE)
+      dateMatch = re.search(r"(d)(!?)~(.*)", andStr, re.IGNORECASE)
+      if headerMatch:
+        (queryType, fields, m) = ("header", [headerMatch.group(1).lower()], headerMatch)
+      elif bodyMatch:
+        (queryType, fields, m) = ("body", [], bodyMatch)
+      elif bodyPlainMatch:
+        (queryType, fields, m) = ("bodyplain", [], bodyPlainMatch)
+      elif dateMatch:
+        (queryType, fields, m) = ("date", [], dateMatch)
+      else:
+        (queryType, fields, m) = ("header", list(HEADER_SEARCH_FIELDS), None)
+
+      if m != None:
+        negated = m.group(2) == "!"
+        content = m.group(3)
+      else:
+        negated = False
+        content = andStr
+      innerQuery['parts'].append({
+        'type': queryType,
+        'fields': fields,
+        'negated': negated,
+        'content': content,
+      })
+    outerQuery['parts'].append(innerQuery)
+  return outerQuery
+
+def negateQuery(query):
+  if query['type'] == "and" or query['type'] == "or":
+    query['type'] = "or" if query['type'] == "and" else "and"
+    for part in query['parts']:
+      negateQuery(part)
+  else:
+    query['negated'] = not query['negated']
+
+def parseDateParam(date):
+  dateVals = {'single': None, 'start': None, 'end': None}
+  rangeMatch = re.match(r"^(\d\d\d\d-\d\d-\d\d)(?:\.\.|\.\.\.|~)(\d\d\d\d-\d\d-\d\d)$", date)
+  singleMatch = re.match(r"^(\d\d\d\d-\d\d-\d\d)$", date)
+  if rangeMatch:
+    dateVals['start'] = rangeMatch.group(1)
+    dateVals['end'] = rangeMatch.group(2)
+  elif singleMatch:
+    dateVals['single'] = singleMatch.group(1)
+  return dateVals
+
+def escapeQueryStr(queryStr, quotes):
+  queryStr = re.sub(r"[\t\n\r]", " ", queryStr)
+  queryStr = queryStr.replace("%", "%boing%")
+  queryStr = queryStr.replace("\\ ", "%ws%")
+  queryStr = queryStr.replace("\\&", "%amp%")
+  queryStr = queryStr.replace("\\+", "%plus%")
+  queryStr = queryStr.replace("\\|", "%bar%")
+  queryStr = queryStr.replace("\\#", "%hash%")
+  queryStr = queryStr.replace("\\~", "%tilde%")
+  queryStr = queryStr.replace("\\!", "%bang%")
+  queryStr = queryStr.replace("\\\"", "%dblquote%")
+
+  quoteId = 0
+  while True:
+    m = re.search(r'"([^"]*)"', queryStr)
+    if not m:
+      break
+    quotes["quote" + str(quoteId)] = m.group(1)
+    queryStr = queryStr[:m.start()] + "%quote" + str(quoteId) + "%" + queryStr[m.end():]
+    quoteId += 1
+
+  if "#{YESTERDAY}" in queryStr:
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    queryStr = queryStr.replace("#{YESTERDAY}", yesterday.strftime("%Y-%m-%d"))
+  if "#{TODAY}" in queryStr:
+    queryStr = queryStr.replace("#{TODAY}", datetime.date.today().strftime("%Y-%m-%d"))
+
+  queryStr = re.sub(r"\s*&&\s*", "%AND%", queryStr)
+  queryStr = re.sub(r"\s*\|\|\s*", "%OR%", queryStr)
+  queryStr = re.sub(r"\s*\+\+\s*", "%OR%", queryStr)
+  queryStr = re.sub(r"\s+", "%AND%", queryStr)
+
+  queryStr = queryStr.replace("&", "%amp%")
+  queryStr = queryStr.replace("|", "%bar%")
+  queryStr = queryStr.replace("+", "%plus%")
+
+  queryStr = queryStr.replace("%AND%", "&")
+  queryStr = queryStr.replace("%OR%", "|")
+  return queryStr
+
+def unescapeQueryStr(queryStr, quotes):
+  queryStr = re.sub(r"%(quote\d+)%", lambda m: quotes.get(m.group(1), ""), queryStr)
+  queryStr = queryStr.replace("%dblquote%", "\"")
+  queryStr = queryStr.replace("%bang%", "!")
+  queryStr = queryStr.replace("%tilde%", "~")
+  queryStr = queryStr.replace("%hash%", "#")
+  queryStr = queryStr.replace("%bar%", "|")
+  queryStr = queryStr.replace("%plus%", "+")
+  queryStr = queryStr.replace("%amp%", "&")
+  queryStr = queryStr.replace("%ws%", " ")
+  queryStr = queryStr.replace("%boing%", "%")
+  return queryStr
+
+def unescapeQuery(query, quotes):
+  if query['type'] == "and" or query['type'] == "or":
+    query['parts'] = list(map(lambda part: unescapeQuery(part, quotes), query['parts']))
+  else:
+    query['content'] = unescapeQueryStr(query['content'], quotes)
+  return query
+
+def reduceQuery(query):
+  queryType = query['type']
+  if queryType == "and" or queryType == "or":
+    parts = list(filter(lambda part: part != None, map(reduceQuery, query['parts'])))
+
+    # a OR (b OR c) == a OR b OR c
+    newParts = []
+    for part in parts:
+      if part['type'] == queryType:
+        newParts += list(filter(lambda p: p != None, map(reduceQuery, part['parts'])))
+      else:
+        newParts.append(part)
+    parts = newParts
+
+    if len(parts) == 0:
+      return None
+    elif len(parts) == 1:
+      return parts[0]
+    else:
+      return {'type': queryType, 'parts': parts}
+  else:
+    if re.match(r"^\s*$", query['content']):
+      return None
+    return dict(query)
+
+def queryHasBodyTerms(query):
+  if query == None:
+    return False
+  elif query['type'] == "and" or query['type'] == "or":
+    return any(map(queryHasBodyTerms, query['parts']))
+  else:
+    return query['type'] == "body" or query['type'] == "bodyplain"
+
+#a refinement only ever matches a subset of what the original matched
+#  e.g.: 'fo' => 'foo', 'fo' => 'fo bar', 'from~fo' => 'from~foo'
+#  as regexes, only patterns without special chars match the same as substrings
+def isQueryRefinement(oldQuery, newQuery):
+  oldTerms = getPlainHeaderTerms(oldQuery)
+  newTerms = getPlainHeaderTerms(newQuery)
+  if oldTerms == None or newTerms == None:
+    return False
+  if isHeaderRegexSearch():
+    for term in oldTerms + newTerms:
+      if re.escape(term['content']) != term['content']:
+        return False
+  for oldTerm in oldTerms:
+    isRefined = False
+    for newTerm in newTerms:
+      if (oldTerm['fields'] == newTerm['fields']
+        and asciiLower(oldTerm['content']) in asciiLower(newTerm['content'])):
+        isRefined = True
+        break
+    if not isRefined:
+      return False
+  return True
+
+def getPlainHeaderTerms(query):
+  if query == None:
+    return None
+  elif query['type'] == "and":
+    terms = query['parts']
+  else:
+    terms = [query]
+  for term in terms:
+    if term['type'] != "header" or term['negated']:
+      return None
+  return terms
+
+#sqlite LIKE is case-insensitive for ASCII only
+def asciiLower(string):
+  return regexSub(r"[A-Z]+", lambda m: m.group(0).lower(), string)
+
+def matchQueryFields(query, fields):
+  (hdrDate, hdrFrom, hdrTo, hdrCC, hdrBCC, hdrSubject) = fields
+  if query == None:
+    return True
+  elif query['type'] == "and":
+    return all(map(lambda part: matchQueryFields(part, fields), query['parts']))
+  elif query['type'] == "or":
+    return any(map(lambda part: matchQueryFields(part, fields), query['parts']))
+  elif query['type'] == "header":
+    fieldVals = {'date': hdrDate, 'from': hdrFrom, 'subject': hdrSubject,
+      'to': hdrTo, 'cc': hdrCC, 'bcc': hdrBCC}
+    content = asciiLower(query['content'])
+    for field in query['fields']:
+      isMatch = content in asciiLower(fieldVals[field])
+      if isMatch != query['negated']:
+        return True
+    return False
+  elif query['type'] == "date":
+    dateVals = parseDateParam(query['content'])
+    day = hdrDate[0:10]
+    if dateVals['single'] != None:
+      isMatch = day == dateVals['single']
+    elif dateVals['start'] != None and dateVals['end'] != None:
+      isMatch = dateVals['start'] <= day and day <= dateVals['end']
+    else:
+      raise Exception("invalid date query: " + query['content'])
+    return isMatch != query['negated']
+  else:
+    raise Exception("cannot search " + query['type'] + " in header fields")
+
+#canonical form of a parsed query, for caching results
+def formatQueryKey(query):
+  if query == None:
+    return ""
+  elif query['type'] == "and" or query['type'] == "or":
+    return query['type'] + "(" + ",".join(map(formatQueryKey, query['parts'])) + ")"
+  else:
+    content = regexSub(r"([\\(),])", r"\\\1", query['content'])
+    negated = "!" if query['negated'] else ""
+    queryType = query['type']
+    if queryType == "header" and isHeaderRegexSearch():
+      queryType = "header-regexp"
+    return queryType + ":" + "+".join(query['fields']) + negated + "~" + content
+
+#email-search.pl matches header terms as case-insensitive regexes if sqlite3-pcre exists
+def isHeaderRegexSearch():
+  return os.path.isfile(SQLITE_PCRE_LIB)
+
+#the same escaping email-search.pl does before REGEXP, which leaves backslashes literal
+def formatHeaderRegex(content):
+  content = content.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+  return "(?i)" + content
+
+#fallback for X REGEXP Y when the pcre extension cannot be loaded
+#  sqlite3-pcre does not compile in utf8 mode, so (?i) folds ASCII case only
+def sqlRegexp(pattern, value):
+  if value == None:
+    return False
+  return re.search(pattern, value, re.ASCII if PYTHON3 else 0) != None
+
+def formatQuerySql(query):
+  if query['type'] == "and" or query['type'] == "or":
+    sqlParts = []
+    params = []
+    for part in query['parts']:
+      (partSql, partParams) = formatQuerySql(part)
+      sqlParts.append("(" + partSql + ")")
+      params += partParams
+    return ((" " + query['type'] + " ").join(sqlParts), params)
+  elif query['type'] == "header" and isHeaderRegexSearch():
+    regexp = "not regexp" if query['negated'] else "regexp"
+    conds = []
+    for field in query['fields']:
+      conds.append("header_" + field + " " + regexp + " ?")
+    return (" or ".join(conds), [formatHeaderRegex(query['content'])] * len(conds))
+  elif query['type'] == "header":
+    content = query['content']
+    like = "not like" if query['negated'] else "like"
+    if "\\" in content or "%" in content or "_" in content:
+      content = content.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+      escape = " escape '\\'"
+    else:
+      escape = ""
+    conds = []
+    for field in query['fields']:
+      conds.append("header_" + field + " " + like + " ?" + escape)
+    return (" or ".join(conds), ["%" + content + "%"] * len(conds))
+  elif query['type'] == "date":
+    dateVals = parseDateParam(query['content'])
+    if dateVals['single'] != None:
+      opEQ = "!=" if query['negated'] else "="
+      return ("substr(header_date, 1, 10) " + opEQ + " ?", [dateVals['single']])
+    elif dateVals['start'] != None and dateVals['end'] != None:
+      opBETWEEN = "not between" if query['negated'] else "between"
+      return ("substr(header_date, 1, 10) " + opBETWEEN + " ? and ?",
+        [dateVals['start'], dateVals['end']])
+    else:
+      raise Exception("invalid date query: " + query['content'])
+  else:
+    raise Exception("cannot search " + query['type'] + " in the header index")
+
+def getFolderName(folder):
+  name = folder.lower()
+  name = regexSub(r"[^a-z0-9]+", "_", name)
+  name = regexSub(r"^_+", "", name)
+  name = regexSub(r"_+$", "", name)
+  return name
+
+def parseFolders(acc):
+  folders = []
+  folders.append(("inbox", acc.get('inbox', "INBOX")))
+  if 'sent' in acc:
+    folders.append(("sent", acc['sent']))
+  if 'folders' in acc:
+    for folder in acc['folders'].split(":"):
+      folder = folder.strip()
+      folders.append((getFolderName(folder), folder))
+  return folders
+
+def getCountIncludeFolderNames(acc):
+  countInclude = acc.get('count_include', "inbox")
+  folderNames = list(map(lambda name: name.strip(), countInclude.split(":")))
+  okFolderNames = list(map(lambda folder: folder[0], parseFolders(acc)))
+  for folderName in folderNames:
+    if folderNames.count(folderName) > 1 or folderName not in okFolderNames:
+      print("invalid count_include folder name: " + folderName)
+      return None
+  return folderNames
+
+def parseIntervalConfig(value):
+  if value != None and regexMatch(r"^\d+$", value):
+    return int(value)
+  return 0
+
+def relTime(t):
+  if t == None:
+    return "never"
+  diff = int(time.time()) - t
+  if diff == 0:
+    return "now"
+  if diff > 0:
+    ago = "ago"
+  else:
+    diff = 0 - diff
+    ago = "in the future"
+
+  diffs = [
+    ["year",   int(0.5 + diff / 60.0 / 60 / 24 / 365.25)],
+    ["month",  int(0.5 + diff / 60.0 / 60 / 24 / 30.4)],
+    ["day",    int(0.5 + diff / 60.0 / 60 / 24)],
+    ["hour",   int(0.5 + diff / 60.0 / 60)],
+    ["minute", int(0.5 + diff / 60.0)],
+    ["second", int(0.5 + diff)],
+  ]
+  for (unit, val) in diffs:
+    if val > 0:
+      if val != 1:
+        unit += "s"
+      return str(val) + " " + unit + " " + ago
+
 def listModelToArray(listModel, obj=None):
   arr = []
   for row in range(0, listModel.rowCount()):
@@ -1775,5 +5103,11 @@ def toStr(string):
     except:
       return str(string)
 
+def toBytes(string):
+  if type(string) == bytes:
+    return string
+  else:
+    return string.encode("utf-8")
+
 if __name__ == "__main__":
   sys.exit(main())
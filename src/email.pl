@@ -26,6 +26,7 @@ BEGIN {
     UNREAD_COUNTS_FILE => "$baseDir/unread-counts",
     STATUS_LINE_FILE => "$baseDir/status-line",
     STATUS_SHORT_FILE => "$baseDir/status-short",
+    STATUS_LOCK_FILE => "$baseDir/status.lock",
 
     IMAP_CLIENT_SETTINGS => {
       Peek => 1,
@@ -70,7 +71,7 @@ my $usage = "
   $0 -h|--help
     show this message
 
-  $0 [--update] [--folder=FOLDER_NAME_FILTER] [ACCOUNT_NAME ACCOUNT_NAME ...]
+  $0 [--update] [--no-update-cmd] [--folder=FOLDER_NAME_FILTER] [ACCOUNT_NAME ACCOUNT_NAME ...]
     -for each account specified {or all non-skipped accounts if none are specified}:
       -login to IMAP server, or create file $$GVAR{EMAIL_DIR}/ACCOUNT_NAME/error
       -for each FOLDER_NAME {or just FOLDER_NAME_FILTER if specified}:
@@ -96,6 +97,11 @@ my $usage = "
       e.g.: 3:AOL
             6:GMAIL
             0:WORK_GMAIL
+    -run update_cmd, unless --no-update-cmd is given
+
+  $0 --update-cmd
+    run update_cmd, if configured
+    {for callers that update accounts separately with --no-update-cmd}
 
   $0 --token ACCOUNT_NAME
     fetch OAUTH Bearer access_token using google
@@ -301,6 +307,22 @@ my $usage = "
     <KEY_NAME>=<DESC>
       KEY_NAME: one of: " . join(" ", getOptionsConfigKeys()) . "
       DESC:     text description
+
+  $0 --server
+    load all modules once, then read framed requests on STDIN,
+      run each one as a forked copy of this program,
+      and write framed stdout/stderr/exit code responses to STDOUT
+    requests can overlap, and are identified by an integer ID chosen by the client
+    each frame is \"<TYPE> <ID> <LENGTH>\\n<PAYLOAD>\"
+      client frames:
+        REQ   run the command whose args are in PAYLOAD, each one followed by a NUL
+        KILL  terminate the process group of request ID
+      server frames:
+        READY sent once at startup, with ID 0
+        OUT   stdout of request ID
+        ERR   stderr of request ID
+        EXIT  exit code of request ID, sent after all OUT and ERR frames
+    exits, terminating all running requests, when STDIN is closed
 ";
 
 sub main(@){
@@ -311,11 +333,19 @@ sub main(@){
   }elsif($cmd =~ /^(--update)$/ and @_ >= 0){
     require QtEmail::UpdatePrint;
     QtEmail::Shared::MODIFY_GVAR('VERBOSE', 1);
+    my $runUpdateCmd = 1;
+    if(@_ > 0 and $_[0] =~ /^--no-update-cmd$/){
+      $runUpdateCmd = 0;
+      shift;
+    }
     my $folderNameFilter = optFolder \@_, undef;
     my @accNames = @_;
-    my $success = QtEmail::UpdatePrint::cmdUpdate($folderNameFilter, @accNames);
+    my $success = QtEmail::UpdatePrint::cmdUpdate($folderNameFilter, $runUpdateCmd, @accNames);
     my $exitCode = $success ? 0 : 1;
     exit $exitCode;
+  }elsif($cmd =~ /^(--update-cmd)$/ and @_ == 0){
+    require QtEmail::UpdatePrint;
+    QtEmail::UpdatePrint::cmdRunUpdateCmd();
   }elsif($cmd =~ /^(--token)$/ and @_ == 1){
     require QtEmail::Email;
     my ($accName) = @_;
@@ -496,6 +526,9 @@ sub main(@){
   }elsif($cmd =~ /^(--read-options-schema)$/ and @_ == 0){
     require QtEmail::Email;
     QtEmail::Email::cmdReadConfigOptionsSchema("options");
+  }elsif($cmd =~ /^(--server)$/ and @_ == 0){
+    require QtEmail::Server;
+    QtEmail::Server::cmdServer(\&main);
   }else{
     die $usage;
   }
@@ -0,0 +1,119 @@
+#!/usr/bin/perl
+#the gui formats cached bodies itself, it must print what email.pl --body prints
+use strict;
+use warnings;
+use FindBin;
+use File::Temp qw(tempdir);
+use Test::More;
+
+my $srcDir = "$FindBin::Bin/../src";
+
+eval { require MIME::Parser; 1 } or plan skip_all => "MIME::Parser is not installed";
+system("python3 -c 'import PyQt5' 2>/dev/null") == 0
+  or plan skip_all => "python3 with PyQt5 is not installed";
+
+my $home = tempdir(CLEANUP => 1);
+$ENV{HOME} = $home;
+
+my $BOUNDARY_MIXED = "mixed-boundary";
+my $BOUNDARY_ALT = "alt-boundary";
+my $FIXTURE = join "\r\n",
+  "From: sender\@example.com",
+  "To: rcpt\@example.com",
+  "Subject: parity",
+  "MIME-Version: 1.0",
+  "Content-Type: multipart/mixed; boundary=\"$BOUNDARY_MIXED\"",
+  "",
+  "--$BOUNDARY_MIXED",
+  "Content-Type: multipart/alternative; boundary=\"$BOUNDARY_ALT\"",
+  "",
+  "--$BOUNDARY_ALT",
+  "Content-Type: text/plain; charset=utf-8",
+  "",
+  "plain words here",
+  "--$BOUNDARY_ALT",
+  "Content-Type: text/html; charset=utf-8",
+  "",
+  "<p>html <b>words</b> here</p>",
+  "--$BOUNDARY_ALT--",
+  "--$BOUNDARY_MIXED",
+  "Content-Type: application/pdf; name=\"report.pdf\"",
+  "Content-Disposition: attachment; filename=\"report.pdf\"",
+  "Content-Transfer-Encoding: base64",
+  "",
+  "JVBERi0xLjQK",
+  "--$BOUNDARY_MIXED",
+  "Content-Type: application/octet-stream",
+  "Content-Disposition: attachment; filename=\"../../docs/plan.doc\"",
+  "Content-Transfer-Encoding: base64",
+  "",
+  "AAECAw==",
+  "--$BOUNDARY_MIXED",
+  "Content-Type: image/png",
+  "Content-Disposition: inline; filename=\"logo.png\"",
+  "Content-Transfer-Encoding: base64",
+  "",
+  "iVBORw0KGgo=",
+  "--$BOUNDARY_MIXED--",
+  "";
+
+my $conf = "$home/.config/qtemail/qtemail.conf";
+my $folderDir = "$home/.cache/email/TEST/inbox";
+system "mkdir", "-p", "$home/.config/qtemail", "$folderDir/bodies", "$folderDir/bodies-plain";
+open FH, "> $conf" or die "Could not write $conf\n";
+print FH join "", map {"email.TEST.$_\n"} (
+  "user = test\@example.com",
+  "password = pw",
+  "server = imap.example.com",
+  "port = 993",
+);
+close FH;
+
+sub writeFile($$){
+  my ($file, $contents) = @_;
+  open FH, "> $file" or die "Could not write $file\n";
+  print FH $contents;
+  close FH;
+}
+
+sub emailPlBody($$){
+  my ($bodyArg, $uid) = @_;
+  open FH, "-|", "perl", "-I$srcDir", "$srcDir/email.pl",
+    $bodyArg, "--no-download", "--folder=inbox", "TEST", $uid
+    or die "Could not run email.pl\n";
+  my $out = join '', <FH>;
+  close FH;
+  return $out;
+}
+
+sub guiCachedBody($$){
+  my ($isHtml, $uid) = @_;
+  my $py = join "\n",
+    "import importlib.util, sys",
+    "spec = importlib.util.spec_from_file_location('emailgui', sys.argv[1])",
+    "g = importlib.util.module_from_spec(spec)",
+    "spec.loader.exec_module(g)",
+    "body = g.EmailManager().readCachedBody('TEST', 'inbox', int(sys.argv[2]), sys.argv[3] == '1')",
+    "sys.stdout.buffer.write(b'<NONE>' if body == None else body.encode('utf-8'))",
+    "";
+  local $ENV{QT_QPA_PLATFORM} = "offscreen";
+  open FH, "-|", "python3", "-c", $py, "$srcDir/email-gui.py", $uid, $isHtml
+    or die "Could not run python3\n";
+  my $out = join '', <FH>;
+  close FH;
+  return $out;
+}
+
+writeFile "$folderDir/bodies/1", $FIXTURE;
+
+my $perlHtml = emailPlBody "--body-html", 1;
+like $perlHtml, qr/attachment: report\.pdf/, "email.pl names attachments";
+is guiCachedBody(1, 1), $perlHtml, "html body matches email.pl --body-html";
+
+my $perlPlain = emailPlBody "--body-plain", 1;
+is guiCachedBody(0, 1), $perlPlain, "plain body matches email.pl --body-plain";
+
+writeFile "$folderDir/bodies-plain/2", "stale plain body\n";
+is guiCachedBody(0, 2), "<NONE>", "plain body is not used without the full body";
+
+done_testing();
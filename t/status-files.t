@@ -0,0 +1,78 @@
+#!/usr/bin/perl
+#two per-account updates finishing at once, while the status line is read
+use strict;
+use warnings;
+use FindBin;
+use lib "$FindBin::Bin/../src";
+use File::Temp qw(tempdir);
+use Test::More;
+
+my $home;
+BEGIN {
+  $home = tempdir(CLEANUP => 1);
+  $ENV{HOME} = $home;
+  require QtEmail::Shared;
+  my $baseDir = "$home/.cache/email";
+  QtEmail::Shared::INIT_GVAR({
+    EMAIL_DIR => $baseDir,
+    UNREAD_COUNTS_FILE => "$baseDir/unread-counts",
+    STATUS_LINE_FILE => "$baseDir/status-line",
+    STATUS_SHORT_FILE => "$baseDir/status-short",
+    STATUS_LOCK_FILE => "$baseDir/status.lock",
+  });
+}
+use QtEmail::Email qw(
+  writeStatusFiles formatStatusLine
+  readGlobalUnreadCountsFile updateGlobalUnreadCountsFile
+);
+
+my $ITERATIONS = 300;
+my @accNames = qw(ALPHA BETA);
+
+my $config = {accOrder => [@accNames], accounts => {}, options => {}};
+for my $accName(@accNames){
+  $$config{accounts}{$accName} = {name => $accName};
+  my $dir = "$home/.cache/email/$accName/inbox";
+  system "mkdir", "-p", $dir;
+  open FH, "> $dir/unread" or die;
+  print FH "1\n2\n";
+  close FH;
+}
+updateGlobalUnreadCountsFile $config;
+writeStatusFiles @accNames;
+
+sub runChild($){
+  my ($sub) = @_;
+  my $pid = fork;
+  die "could not fork\n" if not defined $pid;
+  if($pid == 0){
+    my $ok = eval { for my $i(1..$ITERATIONS){ &$sub() }; 1 };
+    print STDERR $@ if not $ok;
+    exit($ok ? 0 : 1);
+  }
+  return $pid;
+}
+
+my @pids;
+for my $accName(@accNames){
+  push @pids, runChild sub {
+    updateGlobalUnreadCountsFile $config;
+    writeStatusFiles @accNames;
+  };
+}
+push @pids, runChild sub {
+  formatStatusLine readGlobalUnreadCountsFile(), @accNames;
+};
+
+for my $pid(@pids){
+  waitpid $pid, 0;
+  is $?, 0, "process $pid finished without errors";
+}
+
+is_deeply readGlobalUnreadCountsFile(), {ALPHA => 2, BETA => 2}, "unread counts";
+open FH, "< $home/.cache/email/status-line" or die;
+my $statusLine = join '', <FH>;
+close FH;
+is $statusLine, "A2 B2\n", "status line";
+
+done_testing();